@@ -0,0 +1 @@
+"""离线性能测试工具：用替身 AstrBot 事件/上下文/bot 驱动 WifePlugin，无需真实 QQ 机器人。"""
@@ -0,0 +1,85 @@
+"""
+背包存储基准：在不同容量（backpack_size）与占用数下，对比旧的定长 list 格式与稀疏槽位格式的
+磁盘开销，以及读取背包、找空位、写回背包的耗时。
+
+用法::
+
+    python -m bench.backpack
+    python -m bench.backpack --sizes 7,100,1000 --owned 5,50 --users 200
+
+对每组 (容量, 占用数)：随机生成 --users 个用户的背包，分别以两种格式写入群配置，统计 JSON 字节数，
+并测量 get_user_backpack + first_empty 与一次槽位写入（store_user_backpack）的平均耗时。
+旧格式在读取时仍被兼容解析（开销与容量成正比），写回后即改存为稀疏格式。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from bench.harness import load_plugin_module
+
+
+def timed_us(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1e6 / repeat
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="7,100,1000,10000", help="背包容量（逗号分隔）")
+    ap.add_argument("--owned", default="5,50", help="每个用户占用的槽位数（逗号分隔）")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+
+    module = load_plugin_module(tempfile.mkdtemp(prefix="animewife-backpack-"))
+    rng = random.Random(args.seed)
+    results = []
+    for size in (int(x) for x in args.sizes.split(",") if x.strip()):
+        for k in (int(x) for x in args.owned.split(",") if x.strip()):
+            k = min(k, size)
+            dense: dict[str, list] = {}
+            sparse: dict[str, dict] = {}
+            for u in range(args.users):
+                items: list = [None] * size
+                for slot in rng.sample(range(size), k):
+                    items[slot] = f"作品{rng.randrange(500)}!角色{rng.randrange(50000)}.jpg"
+                dense[str(u)] = items
+                sparse[str(u)] = module.normalize_backpack(items, size).raw()
+            row = {
+                "backpack_size": size,
+                "owned_per_user": k,
+                "list_json_bytes_per_user": round(len(json.dumps(dense, ensure_ascii=False).encode("utf-8")) / args.users, 1),
+                "sparse_json_bytes_per_user": round(len(json.dumps(sparse, ensure_ascii=False).encode("utf-8")) / args.users, 1),
+            }
+            for name, backpacks in (("list", dense), ("sparse", sparse)):
+                cfg = {module.BACKPACKS_KEY: backpacks}
+                row[f"{name}_read_first_empty_us"] = round(timed_us(
+                    lambda: module.get_user_backpack(cfg, "0", size)[1].first_empty(), args.repeat
+                ), 2)
+            cfg = {module.BACKPACKS_KEY: dict(sparse)}
+
+            def write() -> None:
+                backpacks, items = module.get_user_backpack(cfg, "1", size)
+                slot = items.first_empty() or 1
+                items.set(slot, "作品0!角色0.jpg")
+                module.store_user_backpack(cfg, "1", backpacks, items)
+                items.set(slot, None)
+                module.store_user_backpack(cfg, "1", backpacks, items)
+
+            row["sparse_write_twice_us"] = round(timed_us(write, args.repeat), 2)
+            results.append(row)
+
+    print(json.dumps({"meta": {"users": args.users, "repeat": args.repeat}, "results": results}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
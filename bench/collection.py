@@ -0,0 +1,108 @@
+"""
+图鉴存储基准：在 --catalog 张图片的图库编号上，测量图鉴位图的磁盘/内存开销与读写耗时，
+并与“每个用户存文件名列表”的做法对比。
+
+用法::
+
+    python -m bench.collection --catalog 50000
+    python -m bench.collection --catalog 50000 --owned 10,100,1000,10000 --users 200
+
+对每个收集数量 k：随机生成 --users 个用户各收集 k 张，统计编码后的大小（群配置 JSON 中的字节数）、
+collect_wife（解码 + 置位 + 编码）与“我的图鉴”计算的耗时。
+另外报告图库编号文件的大小、编号表与序号 -> 作品对照表的内存占用。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from bench.harness import load_plugin_module
+
+
+def catalog_names(size: int, sources: int) -> list[str]:
+    return [f"作品{i % sources}!角色{i}.jpg" for i in range(size)]
+
+
+def timed_ms(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / repeat
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--catalog", type=int, default=50000)
+    ap.add_argument("--sources", type=int, default=500, help="作品数")
+    ap.add_argument("--owned", default="10,100,1000,10000", help="每个用户收集的数量（逗号分隔）")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="animewife-collection-")
+    module = load_plugin_module(data_dir)
+    names = catalog_names(args.catalog, args.sources)
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    asyncio.run(module.catalog_index.sync(names))
+    sync_ms = (time.perf_counter() - t0) * 1000.0
+    index_kb = (tracemalloc.get_traced_memory()[0] - base) / 1024
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    module.catalog_index.completion(0, names)  # 构建序号 -> 作品的对照表
+    sources_ms = (time.perf_counter() - t0) * 1000.0
+    sources_kb = (tracemalloc.get_traced_memory()[0] - base) / 1024
+    tracemalloc.stop()
+
+    results = []
+    for k in (int(x) for x in args.owned.split(",") if x.strip()):
+        k = min(k, args.catalog)
+        cfg: dict = {}
+        lists: dict[str, list[str]] = {}
+        for u in range(args.users):
+            picks = rng.sample(names, k)
+            lists[str(u)] = picks
+            cfg.setdefault(module.COLLECTION_KEY, {})[str(u)] = module.encode_bitset(
+                module.bitset_from([module.catalog_index.index_of(x) for x in picks])
+            )
+        col = cfg[module.COLLECTION_KEY]
+        bitset_bytes = len(json.dumps(col, ensure_ascii=False).encode("utf-8"))
+        list_bytes = len(json.dumps(lists, ensure_ascii=False).encode("utf-8"))
+        sample = names[rng.randrange(len(names))]
+        collect_ms = timed_ms(lambda: module.collect_wife(cfg, "0", sample), 200)
+        bits = module.decode_bitset(col["0"])
+        results.append({
+            "owned_per_user": k,
+            "bitset_json_bytes_per_user": round(bitset_bytes / args.users, 1),
+            "filename_list_json_bytes_per_user": round(list_bytes / args.users, 1),
+            "ratio": round(list_bytes / bitset_bytes, 1) if bitset_bytes else None,
+            "encoding": col["0"][:1],
+            "collect_wife_ms": round(collect_ms, 4),
+            "completion_by_source_ms": round(timed_ms(lambda: module.catalog_index.completion(bits, names), 50), 4),
+        })
+
+    result = {
+        "meta": {"catalog": args.catalog, "sources": args.sources, "users": args.users},
+        "catalog_index_file_kb": round(os.path.getsize(module.CATALOG_INDEX_FILE) / 1024, 1),
+        "catalog_index_sync_ms": round(sync_ms, 1),
+        "catalog_index_memory_kb": round(index_kb, 1),
+        "source_table_ms": round(sources_ms, 1),
+        "source_table_memory_kb": round(sources_kb, 1),
+        "per_user": results,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,277 @@
+"""
+替身 AstrBot 运行环境。
+
+main.py 在导入时就依赖 ``astrbot.api.all`` / ``astrbot.api.star``，并把数据目录固定到
+``StarTools.get_data_dir``。这里在导入插件前向 ``sys.modules`` 注入最小替身模块，
+把数据目录指向临时目录，并提供假的事件、上下文与 bot（群成员列表/成员信息/禁言）。
+未安装 aiohttp 时同样注入替身（不访问网络），基准测试不需要 AstrBot 的任何依赖。
+插件配置的 redis_url 可以填 fakeredis://，连接进程内的 fakeredis（插件本身只接受真实的 Redis 地址）。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import os
+import sys
+import types
+from pathlib import Path
+
+PLUGIN_MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+# ==================== 替身消息组件 ====================
+
+class At:
+    def __init__(self, qq=None, **kwargs):
+        self.qq = qq
+
+
+class Plain:
+    def __init__(self, text: str = "", **kwargs):
+        self.text = text
+
+
+class Image:
+    def __init__(self, file: str):
+        self.file = file
+
+    @staticmethod
+    def fromURL(url: str) -> "Image":
+        return Image(url)
+
+    @staticmethod
+    def fromFileSystem(path: str) -> "Image":
+        return Image(path)
+
+
+class Node:
+    def __init__(self, uin=None, name=None, content=None, **kwargs):
+        self.uin = uin
+        self.name = name
+        self.content = content or []
+
+
+class Nodes:
+    def __init__(self, nodes=None, **kwargs):
+        self.nodes = nodes or []
+
+
+class Star:
+    def __init__(self, context=None):
+        self.context = context
+
+
+class EventMessageType:
+    GROUP_MESSAGE = "group_message"
+
+
+def event_message_type(_type):
+    return lambda func: func
+
+
+def register(*args, **kwargs):
+    return lambda cls: cls
+
+
+class FakeContext:
+    """插件构造参数 context 的替身（插件本身不使用其中任何能力）。"""
+
+
+class FakeBot:
+    """OneBot 风格 bot 替身：群成员列表、成员信息、禁言；可模拟接口延迟。"""
+
+    def __init__(self, members_per_group: int = 50, latency_ms: float = 0.0):
+        self.members_per_group = members_per_group
+        self.latency = latency_ms / 1000.0
+        self.bans: list[tuple[int, int, int]] = []
+        self.calls: dict[str, int] = {}
+
+    async def _delay(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def get_group_member_list(self, group_id: int):
+        await self._delay("get_group_member_list")
+        return [
+            {"user_id": 10000 + i, "nickname": f"成员{i}", "card": ""}
+            for i in range(self.members_per_group)
+        ]
+
+    async def get_group_member_info(self, group_id: int, user_id: int):
+        await self._delay("get_group_member_info")
+        return {"user_id": user_id, "nickname": f"用户{user_id}", "card": ""}
+
+    async def set_group_ban(self, group_id: int, user_id: int, duration: int):
+        await self._delay("set_group_ban")
+        self.bans.append((group_id, user_id, duration))
+
+
+class FakeMessageObj:
+    def __init__(self, group_id, message: list):
+        self.group_id = group_id
+        self.message = message
+
+
+class FakeEvent:
+    """AstrMessageEvent 替身：只实现插件用到的属性与结果构造方法。"""
+
+    def __init__(self, group_id, user_id, text: str, *, at_targets=(), nick: str | None = None, bot=None):
+        chain = [Plain(text)] + [At(qq=t) for t in at_targets]
+        self.message_obj = FakeMessageObj(group_id, chain)
+        self.message_str = text
+        self.is_at_or_wake_command = True
+        self.bot = bot
+        self._uid = user_id
+        self._nick = nick or f"用户{user_id}"
+
+    def get_sender_id(self):
+        return self._uid
+
+    def get_sender_name(self):
+        return self._nick
+
+    def get_self_id(self):
+        return "10000"
+
+    def plain_result(self, text: str):
+        return ("plain", text)
+
+    def chain_result(self, chain: list):
+        return ("chain", chain)
+
+
+# ==================== 插件加载 ====================
+
+def install_astrbot_stubs(data_dir: str) -> None:
+    """注入替身 astrbot 模块；数据目录固定为 data_dir。"""
+    astrbot = types.ModuleType("astrbot")
+    api = types.ModuleType("astrbot.api")
+    api.logger = logging.getLogger("astrbot")
+    all_mod = types.ModuleType("astrbot.api.all")
+    for obj in (At, Plain, Image, Node, Nodes, Star, EventMessageType, event_message_type, register):
+        setattr(all_mod, obj.__name__, obj)
+    all_mod.AstrBotConfig = dict
+    all_mod.AstrMessageEvent = FakeEvent
+    all_mod.Context = FakeContext
+    star_mod = types.ModuleType("astrbot.api.star")
+
+    class StarTools:
+        @staticmethod
+        def get_data_dir(name: str) -> Path:
+            os.makedirs(data_dir, exist_ok=True)
+            return Path(data_dir)
+
+    star_mod.StarTools = StarTools
+    astrbot.api = api
+    api.all = all_mod
+    api.star = star_mod
+    sys.modules.update({
+        "astrbot": astrbot,
+        "astrbot.api": api,
+        "astrbot.api.all": all_mod,
+        "astrbot.api.star": star_mod,
+    })
+    install_aiohttp_stub()
+
+
+class _OfflineClientSession:
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError("替身环境不访问网络（未安装 aiohttp）")
+
+
+def install_aiohttp_stub() -> None:
+    """未安装 aiohttp 时注入替身：基准测试只用本地图库，插件只在导入期用到 ClientTimeout。"""
+    try:
+        import aiohttp  # noqa: F401
+        return
+    except ImportError:
+        pass
+    aiohttp = types.ModuleType("aiohttp")
+    aiohttp.ClientTimeout = lambda total=None, **kwargs: types.SimpleNamespace(total=total, **kwargs)
+    aiohttp.ClientSession = _OfflineClientSession
+    sys.modules["aiohttp"] = aiohttp
+
+
+_fake_redis_server = None
+
+
+def reset_fakeredis() -> None:
+    """丢弃进程内 fakeredis 的全部数据（下次连接 fakeredis:// 时重新创建）。"""
+    global _fake_redis_server
+    _fake_redis_server = None
+
+
+def install_fakeredis(module) -> None:
+    """
+    让插件配置 redis_url 为 fakeredis:// 时连接进程内的 fakeredis（需要 pip install fakeredis），
+    同一进程内的各插件实例共享一个 FakeServer；其他 URL 仍交给插件自己的 make_redis_client。
+    """
+    make_real_client = module.make_redis_client
+
+    def make_redis_client(url: str):
+        global _fake_redis_server
+        if not url.startswith("fakeredis://"):
+            return make_real_client(url)
+        import fakeredis
+
+        if _fake_redis_server is None:
+            _fake_redis_server = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=_fake_redis_server, decode_responses=True)
+
+    module.make_redis_client = make_redis_client
+
+
+def load_plugin_module(data_dir: str, module_name: str = "animewife_main"):
+    """在替身环境中导入 main.py（每个进程只应导入一次：模块有导入期全局状态）。"""
+    install_astrbot_stubs(data_dir)
+    spec = importlib.util.spec_from_file_location(module_name, PLUGIN_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    install_fakeredis(module)
+    return module
+
+
+def make_catalog(module, size: int) -> list[str]:
+    """在插件图片目录下生成 size 个空图片文件作为本地图库（《作品》!角色 命名）。"""
+    os.makedirs(module.IMG_DIR, exist_ok=True)
+    names = []
+    for i in range(size):
+        name = f"作品{i % 97}!角色{i}.jpg"
+        path = os.path.join(module.IMG_DIR, name)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        names.append(name)
+    return names
+
+
+def make_plugin(module, config: dict | None = None, *, admins=()):
+    """构造 WifePlugin 实例（配置缺省值与 _conf_schema.json 一致）。"""
+    cfg = {
+        "need_prefix": False,
+        "ntr_max": 3,
+        "ntr_possibility": 0.2,
+        "change_max_per_day": 3,
+        "swap_max_per_day": 2,
+        "reset_max_uses_per_day": 3,
+        "reset_success_rate": 0.3,
+        "reset_mute_duration": 300,
+        "backpack_size": 7,
+        "image_base_url": "",
+        "image_list_url": "",
+    }
+    cfg.update(config or {})
+    plugin = module.WifePlugin(FakeContext(), cfg)
+    plugin.admins = [str(a) for a in admins]
+    return plugin
+
+
+async def dispatch(plugin, event) -> list:
+    """驱动一次 on_all_messages，收集全部输出。"""
+    out = []
+    async for res in plugin.on_all_messages(event):
+        out.append(res)
+    return out
@@ -0,0 +1,221 @@
+"""
+多进程压力测试：P 个进程各自导入插件、共享同一数据目录并发执行命令，最后校验没有丢失更新。
+
+用法::
+
+    python -m bench.multiproc --procs 4 --groups 3 --users 10 --rounds 5
+    python -m bench.multiproc --procs 4 --no-lock      # 对照：不开跨进程锁，观察丢失的更新
+    python -m bench.multiproc --procs 4 --backend redis                         # 本地 fakeredis TCP 服务
+    python -m bench.multiproc --procs 4 --backend redis --redis-url redis://127.0.0.1:6379/15
+
+每个进程使用互不相同的用户，在每个群里先“抽老婆”一次，再“换老婆” --rounds 次（换老婆上限设为 --rounds）。
+结束后检查：每个用户在每个群的换老婆次数都等于 --rounds（records.json），且群配置里都有该用户的今日老婆。
+进程之间写的是同一个 records.json 和同一批群配置文件，没有跨进程锁时后写入者会覆盖先写入者的修改。
+--backend redis 时各进程相当于共享同一 Redis 的多个节点（未指定 --redis-url 时在本进程启动 fakeredis 的 TCP 服务）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from bench.harness import FakeBot, FakeEvent, dispatch, load_plugin_module, make_catalog, make_plugin
+from bench.run import summarize
+
+GROUP_BASE = 300000
+USER_BASE = 400000
+
+
+def worker_users(worker: int, users: int) -> list[int]:
+    return [USER_BASE + worker * users + u for u in range(users)]
+
+
+def worker_main(worker: int, args: dict, start, out) -> None:
+    module = load_plugin_module(args["data_dir"])
+    make_catalog(module, args["catalog"])
+
+    async def run() -> dict:
+        bot = FakeBot()
+        plugin = make_plugin(module, {
+            "shared_data_lock": args["lock"],
+            "change_max_per_day": args["rounds"],
+            "rng_seed": str(worker),
+            **args["storage"],
+        })
+        await module.ensure_state_loaded()
+        samples: list[float] = []
+        failed = 0
+        gids = [GROUP_BASE + g for g in range(args["groups"])]
+        uids = worker_users(worker, args["users"])
+
+        async def one(gid: int, uid: int, text: str) -> None:
+            nonlocal failed
+            t = time.perf_counter()
+            out_msgs = await dispatch(plugin, FakeEvent(gid, uid, text, bot=bot))
+            samples.append((time.perf_counter() - t) * 1000.0)
+            if any("失败" in str(getattr(m, "text", m)) for m in out_msgs):
+                failed += 1
+
+        start.wait()  # 所有进程加载完成后同时开始
+        t0 = time.perf_counter()
+        for text in ["抽老婆"] + ["换老婆"] * args["rounds"]:
+            await asyncio.gather(*(one(g, u, text) for g in gids for u in uids))
+        elapsed = time.perf_counter() - t0
+        waits = module.metrics.series(f"{module.shared_lock.metric}_wait_ms")
+        reloads = {
+            dict(lbl).get("data"): int(v)
+            for (name, lbl), v in module.metrics.counters.items() if name == "shared_reloads"
+        }
+        await plugin.terminate()
+        return {
+            "worker": worker,
+            "commands": len(samples),
+            "elapsed_s": round(elapsed, 3),
+            "failed_replies": failed,
+            "latency": summarize(samples),
+            "file_lock_waits": sum(h.total for _, h in waits),
+            "file_lock_wait_p99_ms": round(max((h.quantile(0.99) for _, h in waits), default=0.0), 3),
+            "reloads": reloads,
+            "conflicts": int(sum(v for (name, _), v in module.metrics.counters.items() if name == "storage_conflicts")),
+        }
+
+    try:
+        out.put(asyncio.run(run()))
+    except BaseException as e:
+        # 让主进程不必等到超时才发现失败
+        out.put({"worker": worker, "error": repr(e)})
+        raise
+
+
+def today_str() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() + 8 * 3600))
+
+
+def read_state(data_dir: str, storage: dict, gid: str) -> tuple[dict, dict]:
+    """读取某群的 (群配置, 换老婆次数 {uid: count})。"""
+    if storage:
+        import redis
+
+        client = redis.Redis.from_url(storage["redis_url"], decode_responses=True)
+        prefix = storage["redis_prefix"]
+        cfg = client.hgetall(f"{prefix}:g:{gid}")
+        counts_prefix = f"{prefix}:cnt:change:{today_str()}:{gid}:"
+        keys = list(client.scan_iter(match=counts_prefix + "*"))
+        counts = {k[len(counts_prefix):]: int(v) for k, v in zip(keys, client.mget(keys) if keys else [])}
+        return cfg, counts
+    config_dir = os.path.join(data_dir, "config")
+    with open(os.path.join(config_dir, "records.json"), encoding="utf-8") as f:
+        records = json.load(f)
+    with open(os.path.join(config_dir, f"{gid}.json"), encoding="utf-8") as f:
+        cfg = json.load(f)
+    counts = {
+        uid: rec.get("count") for uid, rec in records.get("change", {}).get(gid, {}).items()
+        if isinstance(rec, dict)
+    }
+    return cfg, counts
+
+
+def verify(data_dir: str, storage: dict, procs: int, groups: int, users: int, rounds: int) -> dict:
+    """检查每个用户的换老婆次数与今日老婆记录，返回丢失的更新数。"""
+    lost_counts = 0
+    lost_wives = 0
+    for g in range(groups):
+        gid = str(GROUP_BASE + g)
+        cfg, counts = read_state(data_dir, storage, gid)
+        for w in range(procs):
+            for uid in map(str, worker_users(w, users)):
+                if counts.get(uid) != rounds:
+                    lost_counts += 1
+                if uid not in cfg:
+                    lost_wives += 1
+    expected = procs * groups * users
+    return {"expected_users": expected, "lost_change_counts": lost_counts, "lost_today_wives": lost_wives}
+
+
+def start_fake_redis() -> tuple[str, object]:
+    """在后台线程启动 fakeredis 的 TCP 服务，返回 (URL, 服务对象)。"""
+    from fakeredis import TcpFakeServer
+
+    class NoDelayServer(TcpFakeServer):
+        # 与 redis-server 一样关闭 Nagle，否则流水线请求会碰上 40ms 的延迟确认
+        def get_request(self):
+            conn, addr = super().get_request()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return conn, addr
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = NoDelayServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0", server
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--groups", type=int, default=3)
+    ap.add_argument("--users", type=int, default=10, help="每个进程的用户数")
+    ap.add_argument("--rounds", type=int, default=5, help="每个用户在每个群换老婆的次数")
+    ap.add_argument("--catalog", type=int, default=500)
+    ap.add_argument("--no-lock", action="store_true", help="不开启跨进程锁（对照组，仅文件后端）")
+    ap.add_argument("--backend", choices=("file", "redis"), default="file")
+    ap.add_argument("--redis-url", default=None, help="Redis 地址（默认启动本地 fakeredis TCP 服务）")
+    ap.add_argument("--data-dir", default=None)
+    args = ap.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="animewife-mp-")
+    storage: dict = {}
+    server = None
+    if args.backend == "redis":
+        url = args.redis_url
+        if not url:
+            url, server = start_fake_redis()
+        # 每次运行使用独立前缀，不与已有数据混在一起
+        storage = {"storage_backend": "redis", "redis_url": url, "redis_prefix": f"animewife-mp-{os.getpid()}"}
+    params = {
+        "data_dir": data_dir, "groups": args.groups, "users": args.users,
+        "rounds": args.rounds, "catalog": args.catalog, "lock": not args.no_lock, "storage": storage,
+    }
+    ctx = mp.get_context("spawn")
+    start = ctx.Barrier(args.procs + 1)
+    out = ctx.Queue()
+    procs = [ctx.Process(target=worker_main, args=(w, params, start, out)) for w in range(args.procs)]
+    for p in procs:
+        p.start()
+    start.wait()
+    t0 = time.perf_counter()
+    workers = sorted((out.get() for _ in procs), key=lambda r: r["worker"])
+    wall = time.perf_counter() - t0
+    for p in procs:
+        p.join()
+
+    errors = [r for r in workers if "error" in r]
+    if errors:
+        print(json.dumps({"errors": errors}, ensure_ascii=False, indent=2))
+        return 2
+    check = verify(data_dir, storage, args.procs, args.groups, args.users, args.rounds)
+    if server is not None:
+        server.shutdown()
+    total = sum(r["commands"] for r in workers)
+    result = {
+        "meta": {**params, "procs": args.procs, "backend": args.backend},
+        "wall_s": round(wall, 3),
+        "throughput_cmd_s": round(total / wall, 1) if wall else 0.0,
+        "check": check,
+        "workers": workers,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    ok = check["lost_change_counts"] == 0 and check["lost_today_wives"] == 0
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+"""
+聊天记录回放：把匿名化的群消息 JSONL 按原始时间形状回放到 WifePlugin。
+
+合成负载（bench.run）模拟不出真实流量的形状——零点刚过全员抽老婆、成群结队的牛老婆风暴。
+这里读取每行一条消息的 JSONL::
+
+    {"ts": 1760803200.5, "gid": "g1", "uid": "u42", "text": "牛老婆", "at": ["u7"]}
+
+字段：``ts``（Unix 秒或 ISO 8601 字符串）、``gid``、``uid``、``text``、``at``（可省略）。
+``timestamp`` / ``at_targets`` 作为别名也可识别。插件按 QQ 号处理 id（如 At(qq=int(uid))），
+非纯数字的匿名 id 按首次出现顺序映射为稳定的数字 id（群与用户各自独立编号）。
+
+用法::
+
+    python -m bench.replay chat.jsonl --speed 1          # 按原速回放
+    python -m bench.replay chat.jsonl --speed 20         # 20 倍速
+    python -m bench.replay chat.jsonl --speed max --out a.json
+    python -m bench.replay chat.jsonl --speed max --compare a.json
+
+插件的 ``get_today()`` 绑定到日志时间（上海时区），跨零点的日志按日志日期计数。
+输出按日志时间分窗的延迟（--window 秒）、每条命令的延迟分位数，以及最终状态校验和
+（群配置、记录、交换请求、NTR 开关），用于确认存储引擎改动前后结果一致。
+
+插件的随机数按群分流、种子取 --seed（见 rng_seed 配置），不同群之间的交错不影响结果。
+``--speed max`` 严格按日志顺序逐条处理，结果完全可复现；定速回放时消息按时间点并发下发，
+同一群内的处理交错仍可能改变随机数消耗顺序，校验和仅供参考。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import platform
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench.harness import FakeBot, FakeEvent, dispatch, load_plugin_module, make_catalog, make_plugin
+from bench.run import WriteMeter, peak_rss_kb, summarize
+
+# 校验和中忽略的字段：按墙钟时间生成，回放之间必然不同
+VOLATILE_SWAP_KEYS = {"expires_at"}
+
+
+def parse_ts(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    dt = datetime.fromisoformat(str(value))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone(timedelta(hours=8)))
+    return dt.timestamp()
+
+
+class IdMap:
+    """匿名 id → 数字 id：纯数字 id 原样保留，其余按首次出现顺序从 start 起编号。"""
+
+    def __init__(self, start: int):
+        self.next = start
+        self.ids: dict[str, str] = {}
+
+    def __call__(self, raw) -> str:
+        raw = str(raw)
+        if raw.isdigit():
+            return raw
+        if raw not in self.ids:
+            self.ids[raw] = str(self.next)
+            self.next += 1
+        return self.ids[raw]
+
+
+def load_log(path: str, limit: int | None = None) -> list[tuple[float, str, str, str, tuple]]:
+    """读取 JSONL 日志，返回按时间排序的 (ts, gid, uid, text, at_targets)。"""
+    out = []
+    gids, uids = IdMap(900000000), IdMap(800000000)
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+                ts = parse_ts(row.get("ts", row.get("timestamp")))
+                ats = row.get("at", row.get("at_targets")) or ()
+                out.append((ts, gids(row["gid"]), uids(row["uid"]), str(row.get("text", "")), tuple(uids(a) for a in ats)))
+            except (KeyError, TypeError, ValueError) as e:
+                raise SystemExit(f"{path}:{lineno}: 无法解析的日志行（{e}）")
+            if limit and len(out) >= limit:
+                break
+    # 稳定排序：同一时间戳保持文件内顺序
+    out.sort(key=lambda m: m[0])
+    return out
+
+
+class ReplayClock:
+    """把插件的 get_today() 绑定到日志时间（上海时区）。"""
+
+    def __init__(self, module):
+        self.today: str | None = None
+        self._orig = module.get_today
+        module.get_today = self.get_today
+
+    def advance(self, ts: float) -> None:
+        self.today = (datetime.fromtimestamp(ts, tz=timezone.utc) + timedelta(hours=8)).date().isoformat()
+
+    def get_today(self) -> str:
+        return self.today or self._orig()
+
+
+def digest(obj) -> str:
+    text = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_records(records: dict) -> dict:
+    """次数为 0 与没有记录等价（文件后端返还后保留 0，Redis 计数器回滚后也可能留下 0）。"""
+    out = {}
+    for kind, groups in records.items():
+        for gid, users in groups.items():
+            kept = {uid: rec for uid, rec in users.items() if isinstance(rec, dict) and rec.get("count")}
+            if kept:
+                out.setdefault(kind, {})[gid] = kept
+    return out
+
+
+def state_checksums(module, gids) -> dict:
+    """最终状态校验和：与存储方式无关，只取插件可见的逻辑状态。"""
+    groups = {}
+    swaps = {}
+    for gid in sorted(gids):
+        groups[gid] = digest(module.load_group_config(gid))
+        reqs = module.swap_store.group(gid)
+        swaps[gid] = digest({
+            uid: {k: v for k, v in rec.items() if k not in VOLATILE_SWAP_KEYS}
+            for uid, rec in reqs.items()
+        })
+    result = {
+        "groups": groups,
+        "swaps": swaps,
+        "records": digest(normalize_records(module.export_records())),
+        "ntr": digest(module.ntr_statuses),
+    }
+    result["total"] = digest(result)
+    return result
+
+
+class Timeline:
+    """按日志时间分窗收集延迟与调度滞后。"""
+
+    def __init__(self, t0: float, window: float):
+        self.t0 = t0
+        self.window = max(window, 1e-6)
+        self.latency: dict[int, list[float]] = {}
+        self.lag: dict[int, float] = {}
+
+    def add(self, ts: float, latency_ms: float, lag_ms: float) -> None:
+        idx = int((ts - self.t0) // self.window)
+        self.latency.setdefault(idx, []).append(latency_ms)
+        self.lag[idx] = max(self.lag.get(idx, 0.0), lag_ms)
+
+    def rows(self) -> list[dict]:
+        out = []
+        for idx in sorted(self.latency):
+            s = summarize(self.latency[idx])
+            out.append({
+                "start": datetime.fromtimestamp(self.t0 + idx * self.window, tz=timezone(timedelta(hours=8))).isoformat(),
+                "count": s["count"],
+                "p50_ms": s["p50_ms"],
+                "p99_ms": s["p99_ms"],
+                "max_ms": s["max_ms"],
+                "max_lag_ms": round(self.lag.get(idx, 0.0), 3),
+            })
+        return out
+
+
+async def replay(plugin, bot, messages, clock: ReplayClock, *, speed: float | None, window: float):
+    """speed=None 表示最快速度（逐条顺序处理）；否则按 (ts - t0) / speed 定时并发下发。"""
+    latencies: dict[str, list[float]] = {}
+    timeline = Timeline(messages[0][0] if messages else 0.0, window)
+
+    async def one(ts, gid, uid, text, ats, lag_ms):
+        event = FakeEvent(gid, uid, text, at_targets=ats, bot=bot)
+        t0 = time.perf_counter()
+        await dispatch(plugin, event)
+        dt = (time.perf_counter() - t0) * 1000.0
+        cmd = text.split()[0] if text.split() else ""
+        latencies.setdefault(cmd, []).append(dt)
+        timeline.add(ts, dt, lag_ms)
+
+    if speed is None:
+        for ts, gid, uid, text, ats in messages:
+            clock.advance(ts)
+            await one(ts, gid, uid, text, ats, 0.0)
+        return latencies, timeline
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    base = timeline.t0
+    tasks = []
+    for ts, gid, uid, text, ats in messages:
+        due = start + (ts - base) / speed
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        clock.advance(ts)
+        lag_ms = max(0.0, loop.time() - due) * 1000.0
+        tasks.append(asyncio.create_task(one(ts, gid, uid, text, ats, lag_ms)))
+    await asyncio.gather(*tasks)
+    return latencies, timeline
+
+
+def compare_checksums(current: dict, baseline: dict) -> tuple[bool, str]:
+    cur, base = current.get("checksums", {}), baseline.get("checksums", {})
+    if cur.get("total") == base.get("total"):
+        return True, f"状态校验和一致：{cur.get('total')}"
+    lines = [f"状态校验和不一致：{base.get('total')} → {cur.get('total')}"]
+    for key in ("records", "ntr"):
+        if cur.get(key) != base.get(key):
+            lines.append(f"• {key} 不同")
+    for key in ("groups", "swaps"):
+        a, b = base.get(key, {}), cur.get(key, {})
+        diff = sorted(g for g in set(a) | set(b) if a.get(g) != b.get(g))
+        if diff:
+            lines.append(f"• {key} 不同的群（{len(diff)}）：{', '.join(diff[:20])}")
+    return False, "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("log", help="匿名化群消息 JSONL")
+    ap.add_argument("--speed", default="max", help="回放倍速：1、N 或 max（默认 max）")
+    ap.add_argument("--window", type=float, default=60.0, help="延迟分窗宽度（日志时间，秒）")
+    ap.add_argument("--limit", type=int, default=None, help="只回放前 N 条")
+    ap.add_argument("--catalog", type=int, default=1000, help="本地图库图片数")
+    ap.add_argument("--bot-latency-ms", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=42, help="随机种子（--config 未指定 rng_seed 时也作为插件的 rng_seed）")
+    ap.add_argument("--config", default="{}", help="插件配置覆盖（JSON）")
+    ap.add_argument("--admins", default="", help="管理员 uid，逗号分隔（数字 id，与回放中的 uid 一致）")
+    ap.add_argument("--data-dir", default=None, help="数据目录（默认临时目录）")
+    ap.add_argument("--out", default=None, help="结果 JSON 路径")
+    ap.add_argument("--compare", default=None, help="与之对比状态校验和的基线结果 JSON")
+    args = ap.parse_args(argv)
+
+    speed = None if str(args.speed).lower() == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        raise SystemExit("--speed 必须为正数或 max")
+    messages = load_log(args.log, args.limit)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="animewife-replay-")
+    module = load_plugin_module(data_dir)
+    make_catalog(module, args.catalog)
+    meter = WriteMeter(module)
+    clock = ReplayClock(module)
+    config = json.loads(args.config)
+    config.setdefault("rng_seed", str(args.seed))
+    bot = FakeBot(latency_ms=args.bot_latency_ms)
+    admins = [a.strip() for a in args.admins.split(",") if a.strip()]
+
+    async def run():
+        plugin = make_plugin(module, config, admins=admins)
+        t0 = time.perf_counter()
+        lat, timeline = await replay(plugin, bot, messages, clock, speed=speed, window=args.window)
+        elapsed = time.perf_counter() - t0
+        # terminate() 会清空内存状态，校验和必须在此之前计算
+        checksums = state_checksums(module, {m[1] for m in messages})
+        await plugin.terminate()
+        return lat, timeline, elapsed, checksums
+
+    latencies, timeline, elapsed, checksums = asyncio.run(run())
+    all_samples = [x for v in latencies.values() for x in v]
+    result = {
+        "meta": {
+            "log": args.log,
+            "messages": len(messages),
+            "speed": args.speed,
+            "window_s": args.window,
+            "catalog": args.catalog,
+            "seed": args.seed,
+            "config": config,
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "timeline": timeline.rows(),
+        "commands": {cmd: summarize(v) for cmd, v in latencies.items()},
+        "total": {
+            **summarize(all_samples),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_msg_s": round(len(all_samples) / elapsed, 2) if elapsed > 0 else 0.0,
+            "writes": meter.writes,
+            "bytes_written": meter.bytes,
+            "peak_rss_kb": peak_rss_kb(),
+        },
+        "checksums": checksums,
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            same, report = compare_checksums(result, json.load(f))
+        print(report)
+        return 0 if same else 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,229 @@
+"""
+合成负载基准：N 个群 × M 个用户 × 命令混合，驱动 WifePlugin.on_all_messages。
+
+用法::
+
+    python -m bench.run --groups 20 --users 50 --messages 5000 --out bench-result.json
+    python -m bench.run --messages 5000 --compare bench-result.json
+
+输出每条命令的延迟分位数（毫秒）、吞吐、写盘字节数与峰值 RSS，并保存为 JSON，
+便于不同版本之间对比（--compare）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from bench.harness import FakeBot, FakeEvent, dispatch, load_plugin_module, make_catalog, make_plugin
+
+DEFAULT_MIX = (
+    "抽老婆=25,老婆背包=15,查老婆=15,换老婆=8,牛老婆=10,替换老婆=5,交换老婆=5,"
+    "同意交换=4,拒绝交换=2,查看交换请求=5,重置牛=2,重置换=2,发老婆=2"
+)
+
+# 需要 @目标 的命令
+AT_COMMANDS = {"牛老婆", "交换老婆", "同意交换", "拒绝交换", "发老婆"}
+
+
+def parse_mix(text: str) -> list[tuple[str, float]]:
+    mix = []
+    for part in text.split(","):
+        if "=" in part:
+            cmd, w = part.split("=", 1)
+            mix.append((cmd.strip(), float(w)))
+    return mix
+
+
+def percentile(sorted_vals: list[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+def summarize(samples: list[float]) -> dict:
+    vals = sorted(samples)
+    return {
+        "count": len(vals),
+        "mean_ms": round(sum(vals) / len(vals), 4) if vals else 0.0,
+        "p50_ms": round(percentile(vals, 0.50), 4),
+        "p90_ms": round(percentile(vals, 0.90), 4),
+        "p99_ms": round(percentile(vals, 0.99), 4),
+        "max_ms": round(vals[-1], 4) if vals else 0.0,
+    }
+
+
+def peak_rss_kb() -> int | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 返回字节，Linux 返回 KB
+    return int(rss / 1024) if sys.platform == "darwin" else int(rss)
+
+
+class WriteMeter:
+    """包装 module.save_json，统计写盘次数与字节数。"""
+
+    def __init__(self, module):
+        self.writes = 0
+        self.bytes = 0
+        self._orig = module.save_json
+
+        def save_json(path, data):
+            self._orig(path, data)
+            self.writes += 1
+            try:
+                self.bytes += os.path.getsize(path)
+            except OSError:
+                pass
+
+        module.save_json = save_json
+
+
+def make_messages(args, rng: random.Random) -> list[tuple[int, int, str, tuple]]:
+    mix = parse_mix(args.mix)
+    cmds = [c for c, _ in mix]
+    weights = [w for _, w in mix]
+    out = []
+    for _ in range(args.messages):
+        gid = 100000 + rng.randrange(args.groups)
+        uid = 200000 + rng.randrange(args.users)
+        cmd = rng.choices(cmds, weights)[0]
+        ats: tuple = ()
+        text = cmd
+        if cmd in AT_COMMANDS:
+            tid = 200000 + rng.randrange(args.users)
+            ats = (tid,)
+        if cmd == "查老婆" and rng.random() < 0.5:
+            text = f"{cmd} {rng.randint(1, 8)}"
+        elif cmd == "替换老婆":
+            text = f"{cmd} {rng.randint(1, 7)}"
+        elif cmd == "发老婆":
+            uid = 1  # 管理员
+            text = f"{cmd} 角色{rng.randrange(args.catalog)}"
+        out.append((gid, uid, text, ats))
+    return out
+
+
+async def drive(plugin, bot, messages, concurrency: int) -> dict[str, list[float]]:
+    latencies: dict[str, list[float]] = {}
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(gid, uid, text, ats):
+        async with sem:
+            event = FakeEvent(gid, uid, text, at_targets=ats, bot=bot)
+            t0 = time.perf_counter()
+            await dispatch(plugin, event)
+            dt = (time.perf_counter() - t0) * 1000.0
+            latencies.setdefault(text.split()[0], []).append(dt)
+
+    await asyncio.gather(*(one(*m) for m in messages))
+    return latencies
+
+
+def compare(current: dict, baseline: dict) -> str:
+    lines = [f"{'命令':<10}{'p50(基线→当前)':>26}{'p99(基线→当前)':>26}"]
+    for cmd, cur in sorted(current["commands"].items()):
+        base = baseline.get("commands", {}).get(cmd)
+        if not base:
+            continue
+        lines.append(
+            f"{cmd:<10}{base['p50_ms']:>12.3f} → {cur['p50_ms']:<11.3f}{base['p99_ms']:>12.3f} → {cur['p99_ms']:<11.3f}"
+        )
+    ct, bt = current["total"], baseline.get("total", {})
+    if bt:
+        lines.append(
+            f"吞吐 {bt.get('throughput_msg_s', 0):.1f} → {ct['throughput_msg_s']:.1f} msg/s；"
+            f"写盘 {bt.get('bytes_written', 0)} → {ct['bytes_written']} 字节"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--groups", type=int, default=10)
+    ap.add_argument("--users", type=int, default=50, help="每群用户数")
+    ap.add_argument("--messages", type=int, default=5000)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="命令权重，如 抽老婆=25,老婆背包=15")
+    ap.add_argument("--catalog", type=int, default=1000, help="本地图库图片数")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--bot-latency-ms", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=42, help="随机种子（--config 未指定 rng_seed 时也作为插件的 rng_seed）")
+    ap.add_argument("--config", default="{}", help="插件配置覆盖（JSON）")
+    ap.add_argument("--data-dir", default=None, help="数据目录（默认临时目录）")
+    ap.add_argument("--out", default=None, help="结果 JSON 路径")
+    ap.add_argument("--compare", default=None, help="与之对比的基线结果 JSON")
+    args = ap.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="animewife-bench-")
+    module = load_plugin_module(data_dir)
+    make_catalog(module, args.catalog)
+    meter = WriteMeter(module)
+
+    config = json.loads(args.config)
+    config.setdefault("rng_seed", str(args.seed))
+    rng = random.Random(args.seed)
+    messages = make_messages(args, rng)
+    bot = FakeBot(latency_ms=args.bot_latency_ms)
+
+    async def run():
+        plugin = make_plugin(module, config, admins=[1])
+        t0 = time.perf_counter()
+        lat = await drive(plugin, bot, messages, args.concurrency)
+        elapsed = time.perf_counter() - t0
+        await plugin.terminate()
+        return lat, elapsed
+
+    latencies, elapsed = asyncio.run(run())
+    all_samples = [x for v in latencies.values() for x in v]
+    result = {
+        "meta": {
+            "groups": args.groups,
+            "users": args.users,
+            "messages": args.messages,
+            "mix": args.mix,
+            "catalog": args.catalog,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "config": config,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "commands": {cmd: summarize(v) for cmd, v in latencies.items()},
+        "total": {
+            **summarize(all_samples),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_msg_s": round(len(all_samples) / elapsed, 2) if elapsed > 0 else 0.0,
+            "writes": meter.writes,
+            "bytes_written": meter.bytes,
+            "peak_rss_kb": peak_rss_kb(),
+        },
+    }
+
+    if module.lock_profiler.enabled:
+        result["locks"] = module.lock_profiler.as_dict()
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(result, json.load(f)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,135 @@
+"""
+启动耗时基准：生成 N 个群的数据文件后，测量导入插件、数据加载完成、预加载完成的耗时，
+以及预加载命中/未命中的群各自的首条命令延迟。
+
+用法::
+
+    python -m bench.startup --groups 5000
+    python -m bench.startup --groups 5000 --preload 200 --data-dir /tmp/aw-5k   # 复用已生成的数据
+
+每个群生成 --users 个用户的今日老婆与背包，records.json 含每群的次数记录，
+每 5 个群生成一个交换请求文件。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench.harness import FakeBot, FakeEvent, dispatch, load_plugin_module, make_plugin
+
+GROUP_BASE = 100000
+USER_BASE = 200000
+
+
+def today_str() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() + 8 * 3600))
+
+
+def generate(data_dir: str, groups: int, users: int, seed: int) -> None:
+    """按插件的文件布局生成数据（已存在 records.json 时跳过）。"""
+    config_dir = os.path.join(data_dir, "config")
+    swap_dir = os.path.join(config_dir, "swap_requests")
+    if os.path.exists(os.path.join(config_dir, "records.json")):
+        return
+    os.makedirs(swap_dir, exist_ok=True)
+    rng = random.Random(seed)
+    today = today_str()
+    records = {"ntr": {}, "change": {}, "reset": {}, "swap": {}}
+
+    def img() -> str:
+        return f"作品{rng.randrange(97)}!角色{rng.randrange(1000)}.jpg"
+
+    for g in range(groups):
+        gid = str(GROUP_BASE + g)
+        cfg: dict = {}
+        backpacks = {}
+        for u in range(users):
+            uid = str(USER_BASE + u)
+            cfg[uid] = [img(), today, f"用户{uid}"]
+            backpacks[uid] = {str(i): img() for i in range(1, 8) if rng.random() < 0.6}
+        cfg["__wife_backpacks__"] = backpacks
+        with open(os.path.join(config_dir, f"{gid}.json"), "w", encoding="utf-8") as f:
+            json.dump(cfg, f, ensure_ascii=False, indent=4)
+        for kind in records:
+            records[kind][gid] = {str(USER_BASE + u): {"date": today, "count": 1} for u in range(0, users, 3)}
+        if g % 5 == 0:
+            with open(os.path.join(swap_dir, f"{gid}.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    str(USER_BASE + 1): {
+                        "target": str(USER_BASE + 2), "date": today,
+                        "offer_slot": 1, "want_slot": 1, "expires_at": time.time() + 86400,
+                    }
+                }, f)
+        # 越靠后的群越“最近活跃”
+        os.utime(os.path.join(config_dir, f"{gid}.json"), (1_700_000_000 + g, 1_700_000_000 + g))
+    with open(os.path.join(config_dir, "records.json"), "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--groups", type=int, default=5000)
+    ap.add_argument("--users", type=int, default=30, help="每群用户数")
+    ap.add_argument("--preload", type=int, default=100, help="预加载最近活跃的群数（preload_recent_groups）")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--data-dir", default=None, help="数据目录（默认临时目录；已有数据时直接复用）")
+    args = ap.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="animewife-startup-")
+    t0 = time.perf_counter()
+    generate(data_dir, args.groups, args.users, args.seed)
+    gen_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    module = load_plugin_module(data_dir)
+    import_ms = (time.perf_counter() - t0) * 1000.0
+
+    async def run() -> dict:
+        bot = FakeBot()
+        t0 = time.perf_counter()
+        plugin = make_plugin(module, {"preload_recent_groups": args.preload, "rng_seed": str(args.seed)})
+        init_ms = (time.perf_counter() - t0) * 1000.0
+        await module.ensure_state_loaded()
+        ready_ms = (time.perf_counter() - t0) * 1000.0
+        preload_task = module._preload_task
+        if preload_task is not None:
+            await preload_task
+        preload_ms = (time.perf_counter() - t0) * 1000.0
+
+        async def first_command(gid: int) -> float:
+            event = FakeEvent(gid, USER_BASE + 1, "老婆背包", bot=bot)
+            t = time.perf_counter()
+            await dispatch(plugin, event)
+            return (time.perf_counter() - t) * 1000.0
+
+        await first_command(GROUP_BASE + args.groups // 2)     # 预热：排除首条命令的一次性开销
+        hot = await first_command(GROUP_BASE + args.groups - 1)  # 最近活跃，已预加载
+        cold = await first_command(GROUP_BASE)                   # 最久未活跃，按需加载
+        await plugin.terminate()
+        return {
+            "plugin_init_ms": round(init_ms, 3),
+            "state_ready_ms": round(ready_ms, 3),
+            "preload_done_ms": round(preload_ms, 3),
+            "first_command_preloaded_ms": round(hot, 3),
+            "first_command_cold_ms": round(cold, 3),
+        }
+
+    timings = asyncio.run(run())
+    result = {
+        "meta": {"groups": args.groups, "users": args.users, "preload": args.preload, "data_dir": data_dir},
+        "generate_s": round(gen_s, 3),
+        "import_ms": round(import_ms, 3),
+        **timings,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
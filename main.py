@@ -5,12 +5,20 @@ from astrbot.api.all import (
     Context,
     EventMessageType,
     Image,
+    Node,
+    Nodes,
     Plain,
     Star,
     event_message_type,
     register,
 )
+from astrbot.api import logger
 from astrbot.api.star import StarTools
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
 import random
@@ -20,26 +28,47 @@ import difflib
 import re
 import aiohttp
 import asyncio
+import base64
+import bisect
+import contextvars
+import copy
+import gzip
+import hashlib
+import heapq
 import tempfile
+import time
 import urllib.parse
 
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl，跨进程锁模式不可用
+    fcntl = None
+
 # ==================== 常量定义 ====================
 
 PLUGIN_DIR = StarTools.get_data_dir("astrbot_plugin_animewife")
 CONFIG_DIR = os.path.join(PLUGIN_DIR, "config")
 IMG_DIR = os.path.join(PLUGIN_DIR, "img", "wife")
 
-# 确保目录存在
-os.makedirs(CONFIG_DIR, exist_ok=True)
-os.makedirs(IMG_DIR, exist_ok=True)
-
 # 数据文件路径
 RECORDS_FILE = os.path.join(CONFIG_DIR, "records.json")
+# 旧版全局交换请求文件（仅用于迁移）；现按群拆分到 SWAP_REQUESTS_DIR/<gid>.json
 SWAP_REQUESTS_FILE = os.path.join(CONFIG_DIR, "swap_requests.json")
+SWAP_REQUESTS_DIR = os.path.join(CONFIG_DIR, "swap_requests")
 NTR_STATUS_FILE = os.path.join(CONFIG_DIR, "ntr_status.json")
+# 图库编号（图鉴位图的序号，只追加），见 CatalogIndex
+CATALOG_INDEX_FILE = os.path.join(CONFIG_DIR, "catalog_index.json")
+# 老婆来历日志：每群一个只追加的 JSONL（<群号>.jsonl），见 ProvenanceLog
+PROVENANCE_DIR = os.path.join(CONFIG_DIR, "provenance")
 BACKPACKS_KEY = "__wife_backpacks__"
 # 记录“今日老婆”在背包中的绑定槽位（用于换老婆/发老婆时同步更新同一槽位）
 BACKPACK_TODAY_SLOT_KEY = "__wife_backpack_today_slot__"
+# 群内统计（排行榜/谁有老婆用，随背包写入增量维护）：
+# {"size", "owned": {img: 份数}, "filled": {uid: 已用槽位}, "ntr": {uid: 牛成功次数},
+#  "owners": {img: {uid: [槽位, ...]}}}（反向索引，今日老婆临时态的槽位记为 0）
+WIFE_STATS_KEY = "__wife_stats__"
+# 图鉴：{uid: 编码后的位图}（按 CatalogIndex 序号记录曾经获得过的老婆）
+COLLECTION_KEY = "__wife_collection__"
 
 # 仅允许这些后缀用于从本地文件系统读取，避免路径穿越/任意文件读取
 ALLOWED_IMG_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
@@ -50,6 +79,55 @@ HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
 # 群成员“老婆”伪 ID 前缀：用于把群成员头像注入抽取池（不参与本地文件读取）
 MEMBER_ID_PREFIX = "__member__:"
 
+# 交换请求过期扫描的最长休眠间隔（秒）：兜底时钟漂移/休眠唤醒等情况
+SWAP_EXPIRY_MAX_SLEEP = 300
+
+# 启动加载失败后，后台任务重试加载的间隔（秒）
+STATE_LOAD_RETRY_DELAY = 5.0
+
+# 批量发老婆时并发查询群名片的上限（避免一次 @ 几十人时打满平台接口）
+MEMBER_INFO_CONCURRENCY = 8
+
+# 老婆排行的榜单：参数 -> (群统计字段, 标题, 单位)
+LEADERBOARD_KINDS = {
+    "老婆": ("owned", "最受欢迎的老婆", "份"),
+    "背包": ("filled", "背包最满", "位"),
+    "牛": ("ntr", "牛老婆成功", "次"),
+}
+
+# 老婆背包合并转发时最多放入的页数（平台对单条转发消息的节点数有限制），其余页按页码查看
+BACKPACK_FORWARD_MAX_PAGES = 50
+
+# 老婆来历日志的容量：文件后端单群日志超过该字节数时只保留较新的约 3/4；Redis 后端单群保留的条数
+PROVENANCE_MAX_BYTES = 256 * 1024
+PROVENANCE_MAX_ENTRIES = 2000
+# 内存中保留来历索引的群数（LRU），以及一次查询最多追溯的转手次数
+PROVENANCE_INDEX_GROUPS = 128
+PROVENANCE_CHAIN_MAX = 10
+
+# 后台修复的合并等待（秒）：同一时段读命令发现的不一致按群合并为一次事务写回
+REPAIR_BATCH_DELAY = 0.5
+
+# 指标导出文件（Prometheus 文本格式），由 metrics_dump_interval_sec 控制是否定期写出
+METRICS_FILE = os.path.join(PLUGIN_DIR, "metrics.prom")
+
+# 数据体检：无法解析的数据文件移入隔离目录（不覆盖原文件），体检报告逐文件写入 JSONL
+QUARANTINE_DIR = os.path.join(PLUGIN_DIR, "quarantine")
+INTEGRITY_REPORT_FILE = os.path.join(PLUGIN_DIR, "integrity_report.jsonl")
+
+# 数据导出/导入目录（JSONL，可选 gzip）；导入只接受该目录下的文件名
+BACKUP_DIR = os.path.join(PLUGIN_DIR, "backups")
+EXPORT_FORMAT_VERSION = 2  # 2：增加图库编号行（图鉴位图的序号）；仍可导入 1
+
+# 跨进程锁文件目录（见 SharedDataLock）
+LOCK_DIR = os.path.join(CONFIG_DIR, ".locks")
+
+# 随机数批量预生成大小（每个群流每次补充的 [0, 1) 浮点数个数）
+RNG_BATCH_SIZE = 64
+
+# 延迟直方图桶上界（毫秒）
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
 # QQ 头像 URL（aiocqhttp/OneBot 常用）
 QQ_AVATAR_URL = "https://q1.qlogo.cn/g?b=qq&nk={uid}&s=640"
 
@@ -61,29 +139,443 @@ records = {  # 统一的记录数据结构
     "reset": {},      # 重置使用次数
     "swap": {}        # 交换老婆请求次数
 }
-swap_requests = {}  # 交换请求数据
 ntr_statuses = {}  # NTR 开关状态
 
 # ==================== 并发锁 ====================
 
 config_locks = {}      # 群组配置锁
-records_lock = asyncio.Lock()  # 记录数据锁
-swap_lock = asyncio.Lock()     # 交换请求锁
+records_lock = asyncio.Lock()  # 记录数据锁（交换请求锁按群划分，见 SwapRequestStore）
 ntr_lock = asyncio.Lock()      # NTR 状态锁
+catalog_lock = asyncio.Lock()  # 图库编号锁（只在追加编号时持有）
+
+
+# ==================== 运行指标 ====================
+
+class Histogram:
+    """固定桶延迟直方图（毫秒）：O(log 桶数) 记录，分位数按桶内线性插值估算。"""
+
+    __slots__ = ("counts", "total", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum += ms
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0.0
+                if i >= len(LATENCY_BUCKETS_MS):
+                    return float(lo)
+                hi = LATENCY_BUCKETS_MS[i]
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return float(LATENCY_BUCKETS_MS[-1])
+
+
+class Metrics:
+    """
+    进程内运行指标：计数器与延迟直方图，键为 (名称, 标签元组)。
+    记录只做字典查找与加法，热路径开销可忽略；可渲染为 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_ms(self, name: str, ms: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(ms)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_ms(name, (time.perf_counter() - t0) * 1000.0, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def series(self, name: str) -> list[tuple[dict, Histogram]]:
+        """某直方图的全部标签组合 [(labels, hist)]。"""
+        return [(dict(lbl), h) for (n, lbl), h in self.histograms.items() if n == name]
+
+    def hit_rate(self, name: str) -> tuple[float, int]:
+        """缓存命中率：读取 name{result=hit|miss} 计数器，返回 (命中率, 总次数)。"""
+        hit = self.counter(name, result="hit")
+        total = hit + self.counter(name, result="miss")
+        return (hit / total if total else 0.0), int(total)
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+        self.started_at = time.time()
+
+    def render_prometheus(self, prefix: str = "animewife_") -> str:
+        def fmt_labels(labels, extra: tuple = ()) -> str:
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            body = ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for k, v in items
+            )
+            return "{" + body + "}"
+
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            full = f"{prefix}{name}_total"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{fmt_labels(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            full = f"{prefix}{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} histogram")
+                typed.add(full)
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS_MS, hist.counts):
+                cumulative += n
+                lines.append(f"{full}_bucket{fmt_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_bucket{fmt_labels(labels, (('le', '+Inf'),))} {hist.total}")
+            lines.append(f"{full}_sum{fmt_labels(labels)} {round(hist.sum, 6)}")
+            lines.append(f"{full}_count{fmt_labels(labels)} {hist.total}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# ==================== 锁竞争分析 ====================
+
+# 当前正在执行的命令名（由分发器设置），用于把锁等待/持有归因到命令
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar("animewife_command", default="后台任务")
+
+
+class LockStats:
+    __slots__ = ("acquires", "contended", "wait_ms", "max_wait_ms", "hold_ms", "max_hold_ms", "max_queue")
+
+    def __init__(self):
+        self.acquires = 0
+        self.contended = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.hold_ms = 0.0
+        self.max_hold_ms = 0.0
+        self.max_queue = 0
+
+    def on_acquire(self, wait_ms: float, queue: int) -> None:
+        self.acquires += 1
+        if queue > 0:
+            self.contended += 1
+        self.wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.max_queue = max(self.max_queue, queue)
+
+    def on_release(self, hold_ms: float) -> None:
+        self.hold_ms += hold_ms
+        self.max_hold_ms = max(self.max_hold_ms, hold_ms)
+
+
+class LockProfiler:
+    """
+    锁竞争统计：按锁（类型, 键）与按（类型, 命令）汇总等待/持有时间与排队深度，
+    并把等待时间归因到“到达时正持有锁的命令”（blocking）。
+    仅在 enable_lock_profiling() 后生效；未启用时所有锁都是原生 asyncio.Lock，没有额外开销。
+    """
+
+    KIND_NAMES = {"group": "群配置锁", "records": "记录锁", "swap": "交换请求锁", "ntr": "NTR锁"}
+
+    def __init__(self):
+        self.enabled = False
+        self.by_lock: dict[tuple[str, str], LockStats] = {}
+        self.by_command: dict[tuple[str, str], LockStats] = {}
+        self.blocking: dict[tuple[str, str], float] = {}
+
+    @staticmethod
+    def _stats(table: dict, key: tuple) -> LockStats:
+        st = table.get(key)
+        if st is None:
+            st = table[key] = LockStats()
+        return st
+
+    def record_acquire(self, kind: str, key: str, cmd: str, wait_ms: float, queue: int, blocker: str | None) -> None:
+        self._stats(self.by_lock, (kind, key)).on_acquire(wait_ms, queue)
+        self._stats(self.by_command, (kind, cmd)).on_acquire(wait_ms, queue)
+        if blocker is not None:
+            self.blocking[(kind, blocker)] = self.blocking.get((kind, blocker), 0.0) + wait_ms
+
+    def record_release(self, kind: str, key: str, cmd: str, hold_ms: float) -> None:
+        self._stats(self.by_lock, (kind, key)).on_release(hold_ms)
+        self._stats(self.by_command, (kind, cmd)).on_release(hold_ms)
+
+    def reset(self) -> None:
+        self.by_lock.clear()
+        self.by_command.clear()
+        self.blocking.clear()
+
+    def as_dict(self, top: int = 10) -> dict:
+        """结构化的 Top-N 报告（供 bench 输出 JSON）。"""
+        def row(st: LockStats) -> dict:
+            return {name: round(getattr(st, name), 3) for name in LockStats.__slots__}
+
+        locks = sorted(self.by_lock.items(), key=lambda kv: -kv[1].wait_ms)[:top]
+        cmds = sorted(self.by_command.items(), key=lambda kv: -kv[1].wait_ms)[:top]
+        blocking = sorted(self.blocking.items(), key=lambda kv: -kv[1])[:top]
+        return {
+            "locks": [{"kind": k, "key": key, **row(st)} for (k, key), st in locks],
+            "commands": [{"kind": k, "cmd": cmd, **row(st)} for (k, cmd), st in cmds],
+            "blocking": [{"kind": k, "cmd": cmd, "wait_ms": round(ms, 3)} for (k, cmd), ms in blocking],
+        }
+
+    def report(self, top: int = 5) -> str:
+        if not self.enabled:
+            return "锁竞争分析未启用（配置项 lock_profiling）。"
+        names = self.KIND_NAMES
+
+        def fmt(st: LockStats) -> str:
+            return (
+                f"获取{st.acquires}次/争用{st.contended}次，等待 总{st.wait_ms:.1f}ms 最大{st.max_wait_ms:.1f}ms，"
+                f"持有 总{st.hold_ms:.1f}ms 最大{st.max_hold_ms:.1f}ms，最大排队{st.max_queue}"
+            )
+
+        lines = ["【锁竞争】", "最拥堵的锁（按等待总时长）："]
+        ranked = sorted(self.by_lock.items(), key=lambda kv: -kv[1].wait_ms)
+        for (kind, key), st in ranked[:top]:
+            lines.append(f"• {names.get(kind, kind)}{f'[{key}]' if key else ''}：{fmt(st)}")
+        if not ranked:
+            lines.append("• 暂无")
+        lines.append("等待最久的命令：")
+        for (kind, cmd), st in sorted(self.by_command.items(), key=lambda kv: -kv[1].wait_ms)[:top]:
+            lines.append(f"• {cmd}@{names.get(kind, kind)}：{fmt(st)}")
+        if self.blocking:
+            lines.append("造成等待最多的持锁命令：")
+            for (kind, cmd), ms in sorted(self.blocking.items(), key=lambda kv: -kv[1])[:top]:
+                lines.append(f"• {cmd}@{names.get(kind, kind)}：累计阻塞他人 {ms:.1f}ms")
+        return "\n".join(lines)
+
+
+lock_profiler = LockProfiler()
+
+
+class ProfiledLock:
+    """带统计的 asyncio.Lock 包装：记录等待时间、持有时间、到达时排队深度与持锁命令。"""
+
+    __slots__ = ("kind", "key", "_lock", "_waiting", "_acquired_at", "_holder")
+
+    def __init__(self, kind: str, key: str = ""):
+        self.kind = kind
+        self.key = key
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self._acquired_at = 0.0
+        self._holder = ""
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def acquire(self) -> bool:
+        locked = self._lock.locked()
+        queue = self._waiting + (1 if locked else 0)
+        blocker = self._holder if locked else None
+        t0 = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._lock.acquire()
+        finally:
+            self._waiting -= 1
+        now = time.perf_counter()
+        self._acquired_at = now
+        self._holder = current_command.get()
+        lock_profiler.record_acquire(self.kind, self.key, self._holder, (now - t0) * 1000.0, queue, blocker)
+        return True
+
+    def release(self) -> None:
+        hold_ms = (time.perf_counter() - self._acquired_at) * 1000.0
+        lock_profiler.record_release(self.kind, self.key, self._holder, hold_ms)
+        self._lock.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return None
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+def make_lock(kind: str, key: str = ""):
+    """创建锁：启用锁竞争分析时返回 ProfiledLock，否则返回原生 asyncio.Lock。"""
+    if lock_profiler.enabled:
+        return ProfiledLock(kind, key)
+    return asyncio.Lock()
+
+
+def enable_lock_profiling() -> None:
+    """启用锁竞争分析：把现有的空闲锁替换为 ProfiledLock（应在处理消息前调用）。"""
+    global records_lock, ntr_lock
+    if lock_profiler.enabled:
+        return
+    lock_profiler.enabled = True
+    if not records_lock.locked():
+        records_lock = ProfiledLock("records")
+    if not ntr_lock.locked():
+        ntr_lock = ProfiledLock("ntr")
+    for gid, lock in list(config_locks.items()):
+        if not lock.locked():
+            config_locks[gid] = ProfiledLock("group", gid)
+    swap_store.profile_locks()
 
 
 def get_config_lock(group_id: str) -> asyncio.Lock:
     """获取或创建群组配置锁"""
     if group_id not in config_locks:
-        config_locks[group_id] = asyncio.Lock()
+        config_locks[group_id] = make_lock("group", group_id)
     return config_locks[group_id]
 
+
+# ==================== 跨进程文件锁 ====================
+
+def file_version(path: str) -> tuple | None:
+    """文件版本戳 (inode, mtime_ns, size)，文件不存在时为 None；原子写入每次都会换一个新 inode。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class SharedDataLock:
+    """
+    跨进程咨询锁（多个机器人进程共享同一数据目录时启用，依赖 fcntl.flock，仅 POSIX）：
+    - 每份数据对应 LOCK_DIR 下一个锁文件：group-<gid> / records / swap-<gid> / ntr；
+      总在持有对应的进程内锁之后再加锁，顺序与进程内一致（群配置 -> 记录 -> 交换请求）
+    - 加锁用 LOCK_NB 轮询并指数退避，不阻塞事件循环
+    - 版本检查：记录本进程最后一次读写各文件时的版本戳，持锁后发现版本变化（其他进程写过）才重新加载
+    未启用时所有方法都是空操作。
+    """
+
+    _UNSEEN = object()
+    metric = "file_lock"  # 指标名前缀：<metric>_wait_ms / <metric>_contended
+
+    def __init__(self):
+        self.enabled = False
+        self._fds: dict[str, int] = {}
+        self._versions: dict[str, object] = {}
+
+    def enable(self) -> bool:
+        """启用跨进程锁；平台不支持 fcntl 时返回 False。"""
+        if fcntl is None:
+            return False
+        self.enabled = True
+        return True
+
+    def _try_acquire(self, name: str) -> bool:
+        fd = self._fds.get(name)
+        if fd is None:
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            fd = self._fds[name] = os.open(os.path.join(LOCK_DIR, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def acquire(self, name: str) -> None:
+        kind = name.partition("-")[0]
+        t0 = time.perf_counter()
+        delay = 0.0005
+        while not self._try_acquire(name):
+            if delay == 0.0005:
+                metrics.inc(f"{self.metric}_contended", kind=kind)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.02)
+        metrics.observe_ms(f"{self.metric}_wait_ms", (time.perf_counter() - t0) * 1000.0, kind=kind)
+
+    def release(self, name: str) -> None:
+        fcntl.flock(self._fds[name], fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def hold(self, *names: str):
+        """按给定顺序持有若干锁文件（未启用时直接进入）。"""
+        held: list[str] = []
+        try:
+            if self.enabled:
+                for name in names:
+                    await self.acquire(name)
+                    held.append(name)
+            yield
+        finally:
+            for name in reversed(held):
+                self.release(name)
+
+    def version(self, path: str) -> tuple | None:
+        """读取文件前调用：先取版本再读，读到更新的内容最多导致一次多余的重新加载。"""
+        return file_version(path) if self.enabled else None
+
+    def note(self, path: str, version: object = _UNSEEN) -> None:
+        """记录本进程已读/已写的文件版本（不传 version 时取当前版本）。"""
+        if self.enabled:
+            self._versions[path] = file_version(path) if version is self._UNSEEN else version
+
+    def changed(self, path: str) -> bool:
+        """文件是否被其他进程改写过（未启用时恒为 False）。"""
+        return self.enabled and file_version(path) != self._versions.get(path, self._UNSEEN)
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds.clear()
+        self._versions.clear()
+        self.enabled = False
+
+
+shared_lock = SharedDataLock()  # 跨进程锁（由配置 shared_data_lock 启用）
+
 def get_today():
     """获取当前上海时区日期字符串"""
     utc_now = datetime.utcnow()
     return (utc_now + timedelta(hours=8)).date().isoformat()
 
 
+def next_midnight_ts(now: float | None = None) -> float:
+    """下一个上海时区零点的 Unix 时间戳。"""
+    now = time.time() if now is None else now
+    offset = 8 * 3600
+    return ((now + offset) // 86400 + 1) * 86400 - offset
+
+
 def load_json(path: str) -> dict:
     """安全加载 JSON 文件"""
     if not os.path.exists(path):
@@ -102,20 +594,26 @@ def load_json(path: str) -> dict:
         return {}
 
 
-def save_json(path: str, data: dict) -> None:
-    """保存数据到 JSON 文件（原子写入，避免半写入导致配置损坏）。"""
+def save_json(path: str, data: dict) -> bytes:
+    """保存数据到 JSON 文件（原子写入，避免半写入导致配置损坏），返回写入的字节。"""
+    payload = json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+    write_file_atomic(path, payload)
+    return payload
+
+
+def write_file_atomic(path: str, payload: bytes) -> None:
+    """同目录临时文件写入后 os.replace，读者只会看到旧内容或完整的新内容。"""
     os.makedirs(os.path.dirname(path), exist_ok=True)
     tmp_path = None
     try:
         # 使用同目录临时文件，确保 os.replace 原子替换
         with tempfile.NamedTemporaryFile(
-            mode="w",
-            encoding="utf-8",
+            mode="wb",
             dir=os.path.dirname(path),
             delete=False,
         ) as f:
             tmp_path = f.name
-            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.write(payload)
             f.flush()
             try:
                 os.fsync(f.fileno())
@@ -123,6 +621,9 @@ def save_json(path: str, data: dict) -> None:
                 # 某些环境下 fsync 可能不可用，忽略但仍保持原子替换
                 pass
         os.replace(tmp_path, path)
+        shared_lock.note(path)
+        metrics.inc("file_writes")
+        metrics.inc("bytes_written", len(payload))
     finally:
         if tmp_path and os.path.exists(tmp_path):
             try:
@@ -203,56 +704,290 @@ def get_cfg_nick(cfg: dict, uid: str, default: str | None = None) -> str:
     return default or str(uid)
 
 
+def read_file_bytes(path: str) -> bytes:
+    """读取文件原始字节；文件不存在或不可读时返回 b""。"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+
+def parse_json_bytes(payload: bytes) -> dict:
+    """解析 JSON 字节（自动识别 BOM）；空内容或损坏时返回 {}。"""
+    if not payload:
+        return {}
+    try:
+        return json.loads(payload)
+    except Exception:
+        return {}
+
+
+def decode_data_payload(payload: bytes) -> tuple[dict | None, str | None]:
+    """
+    解析数据文件内容并校验顶层结构，返回 (数据, 错误)。
+    空内容视为空数据；无法解析或顶层不是对象时返回 (None, 错误说明)，调用方应隔离该文件而不是当作空数据覆盖。
+    """
+    if not payload:
+        return {}, None
+    try:
+        data = json.loads(payload)
+    except Exception as e:
+        return None, f"JSON 解析失败：{e}"
+    if not isinstance(data, dict):
+        return None, f"顶层应为对象，实际为 {type(data).__name__}"
+    return data, None
+
+
+def quarantine_file(path: str, reason: str) -> str | None:
+    """把损坏的数据文件移入隔离目录（保留原内容，附带原因说明），返回隔离后的路径。"""
+    try:
+        os.makedirs(QUARANTINE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        dest = os.path.join(QUARANTINE_DIR, f"{os.path.basename(path)}.{stamp}")
+        n = 1
+        while os.path.exists(dest):
+            n += 1
+            dest = os.path.join(QUARANTINE_DIR, f"{os.path.basename(path)}.{stamp}.{n}")
+        os.replace(path, dest)
+        with open(dest + ".reason.txt", "w", encoding="utf-8") as f:
+            f.write(reason + "\n")
+    except OSError:
+        return None
+    metrics.inc("quarantined_files")
+    return dest
+
+
+class GroupConfigCache:
+    """
+    群配置文件内容缓存（按群号 LRU）：缓存序列化后的字节而不是 dict，
+    每次读取重新解析，调用方拿到的始终是独立的 dict，未保存的修改不会污染缓存。
+    只由本插件的保存操作更新；capacity 为 0 时不缓存。
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = max(0, int(capacity))
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+
+    def resize(self, capacity: int) -> None:
+        self.capacity = max(0, int(capacity))
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def get(self, gid: str) -> bytes | None:
+        payload = self._data.get(gid)
+        if payload is None:
+            metrics.inc("group_cache", result="miss")
+            return None
+        self._data.move_to_end(gid)
+        metrics.inc("group_cache", result="hit")
+        return payload
+
+    def put(self, gid: str, payload: bytes) -> None:
+        if self.capacity <= 0:
+            return
+        self._data[gid] = payload
+        self._data.move_to_end(gid)
+        if len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def discard(self, gid: str) -> None:
+        self._data.pop(gid, None)
+
+    def fill(self, gid: str, payload: bytes) -> bool:
+        """预加载专用：只在尚未缓存且仍有空位时写入，避免用较旧的文件内容覆盖刚保存的数据。"""
+        if gid in self._data or len(self._data) >= self.capacity:
+            return False
+        self._data[gid] = payload
+        self._data.move_to_end(gid, last=False)
+        return True
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+group_cache = GroupConfigCache()  # 群配置缓存（容量在插件初始化时由配置 group_cache_size 设置）
+group_versions: dict[str, int] = {}  # 群配置版本号：本进程每次保存/隔离群文件时 +1（单调递增）
+
+
+def bump_group_version(group_id: str) -> None:
+    group_versions[group_id] = group_versions.get(group_id, 0) + 1
+
+
+def group_version(group_id: str) -> object:
+    """
+    群配置当前版本，只用于判断“是否与之前读到的相同”：
+    文件后端为本进程版本号（跨进程模式附带文件版本戳）；Redis 后端为版本号键的值。
+    """
+    group_id = str(group_id)
+    if redis_store is not None:
+        return redis_store.group_version(group_id)
+    return group_versions.get(group_id, 0), shared_lock.version(os.path.join(CONFIG_DIR, f"{group_id}.json"))
+
+
 def load_group_config(group_id: str) -> dict:
-    """加载群组配置"""
-    return load_json(os.path.join(CONFIG_DIR, f"{group_id}.json"))
+    """加载群组配置（优先读缓存）；文件损坏时先隔离再按空配置处理，避免下次保存覆盖掉原数据"""
+    group_id = str(group_id)
+    if redis_store is not None:
+        return redis_store.load_group(group_id)[0]
+    with metrics.timer("storage_latency_ms", op="load_group_config"):
+        path = os.path.join(CONFIG_DIR, f"{group_id}.json")
+        payload = group_cache.get(group_id)
+        if payload is not None and shared_lock.changed(path):
+            # 跨进程模式：缓存的版本已被其他进程改写
+            metrics.inc("shared_reloads", data="group")
+            group_cache.discard(group_id)
+            payload = None
+        if payload is not None:
+            return parse_json_bytes(payload)
+        version = shared_lock.version(path)
+        payload = read_file_bytes(path)
+        data, err = decode_data_payload(payload)
+        if err is not None:
+            quarantine_file(path, err)
+            bump_group_version(group_id)
+            payload, data = b"", {}
+            version = shared_lock.version(path)
+        shared_lock.note(path, version)
+        group_cache.put(group_id, payload)
+        return data
 
 
 def save_group_config(group_id: str, config: dict) -> None:
     """保存群组配置"""
-    save_json(os.path.join(CONFIG_DIR, f"{group_id}.json"), config)
+    group_id = str(group_id)
+    if redis_store is not None:
+        redis_store.save_group(group_id, config)
+        return
+    with metrics.timer("storage_latency_ms", op="save_group_config"):
+        payload = save_json(os.path.join(CONFIG_DIR, f"{group_id}.json"), config)
+        group_cache.put(group_id, payload)
+        bump_group_version(group_id)
 
 
-def normalize_backpack(raw: object, size: int) -> list:
-    """将背包槽位标准化为固定长度 list[entry|None]，并兼容旧格式。"""
-    if size <= 0:
-        return []
+def read_group_snapshot(group_id: str, today: str) -> dict:
+    """
+    只读命令的无锁读取：返回群配置最近一次提交版本的私有副本。
+    已提交的内容是不可变的（缓存中的 bytes / 原子替换的文件 / Redis 事务写入的哈希），写入方只会整体替换，
+    事务进行中的修改只存在于事务自己的 dict 里，因此不持群锁也读不到半成品；副本上的修改不会写回。
+    当天尚未检查过的群在副本上做一致性修复，发现问题时交给后台写回。
+    """
+    group_id = str(group_id)
+    metrics.inc("lock_free_reads", data="group")
+    cfg = load_group_config(group_id)
+    if repairer.needs_check(group_id, today) and repairer.check(group_id, cfg, today):
+        repairer.request(group_id)
+    return cfg
+
+
+def _normalize_backpack_entry(x: object) -> object:
+    if isinstance(x, str) and x:
+        return x
+    if isinstance(x, dict) and isinstance(x.get("img"), str) and x.get("img"):
+        # {"img": "...", "note": "..."}
+        return {"img": x.get("img"), "note": x.get("note")}
+    return None
 
-    items: list = []
-    if isinstance(raw, list):
-        normalized = []
-        for x in raw:
-            if not x:
-                normalized.append(None)
-            elif isinstance(x, str):
-                normalized.append(x)
-            elif isinstance(x, dict) and isinstance(x.get("img"), str) and x.get("img"):
-                # {"img": "...", "note": "..."}
-                normalized.append({"img": x.get("img"), "note": x.get("note")})
-            else:
-                normalized.append(None)
-        items = normalized
-    elif isinstance(raw, dict):
-        # 允许用 {"1": "xx.jpg"} 这种形式初始化/迁移
-        items = [None] * size
+
+class Backpack:
+    """
+    稀疏背包：只保存有老婆的槽位 {槽位(1-based): entry}，空槽位不占空间。
+    存储格式为 {"槽位": entry}（与旧版的迁移格式相同，旧版读取不受影响）。
+    每次读取背包时从存储格式临时构造，不缓存任何派生结构：各操作的开销只与已用槽位数有关，与容量无关。
+    """
+
+    __slots__ = ("size", "slots")
+
+    def __init__(self, size: int, slots: dict[int, object] | None = None):
+        self.size = max(0, size)
+        self.slots: dict[int, object] = slots if slots is not None else {}
+
+    @property
+    def used(self) -> int:
+        return len(self.slots)
+
+    def get(self, slot: int) -> object:
+        return self.slots.get(slot)
+
+    def set(self, slot: int, entry: object) -> None:
+        """写入槽位；entry 为空时清空该槽位。越界的槽位忽略。"""
+        if not 1 <= slot <= self.size:
+            return
+        if entry:
+            self.slots[slot] = entry
+        else:
+            self.slots.pop(slot, None)
+
+    def first_empty(self) -> int | None:
+        """
+        返回第一个空槽位（1-based），没有空位则返回 None。
+        从 1 号起逐个查字典，至多查 已用槽位数 + 1 次（背包满时直接返回）。
+        """
+        if len(self.slots) >= self.size:
+            return None
+        slot = 1
+        while slot in self.slots:
+            slot += 1
+        return slot
+
+    def occupied(self) -> list[tuple[int, object]]:
+        """按槽位顺序返回 [(槽位, entry)]，只含有老婆的槽位。"""
+        return sorted(self.slots.items())
+
+    def pages(self, per_page: int) -> int:
+        """按有老婆的槽位分页的总页数（空背包也算 1 页）。"""
+        return max(1, -(-len(self.slots) // per_page))
+
+    def page(self, page: int, per_page: int) -> list[tuple[int, object]]:
+        """第 page 页（从 1 开始）的 [(槽位, entry)]；只取前 page * per_page 个槽位号排序。"""
+        keys = heapq.nsmallest(page * per_page, self.slots)
+        return [(i, self.slots[i]) for i in keys[(page - 1) * per_page:]]
+
+    def raw(self) -> dict[str, object]:
+        return {str(i): e for i, e in self.occupied()}
+
+
+def normalize_backpack(raw: object, size: int) -> Backpack:
+    """将存储的背包解析为 Backpack（兼容旧的定长 list 格式），超出容量的槽位丢弃。"""
+    slots: dict[int, object] = {}
+    if size <= 0:
+        return Backpack(0, slots)
+    if isinstance(raw, dict):
         for k, v in raw.items():
-            try:
-                idx = int(k)
-            except Exception:
-                continue
-            if 1 <= idx <= size and v:
-                if isinstance(v, str):
-                    items[idx - 1] = v
-                elif isinstance(v, dict) and isinstance(v.get("img"), str) and v.get("img"):
-                    items[idx - 1] = {"img": v.get("img"), "note": v.get("note")}
-    else:
-        items = []
+            idx = _coerce_int(k)
+            if idx is not None and 1 <= idx <= size:
+                entry = _normalize_backpack_entry(v)
+                if entry:
+                    slots[idx] = entry
+    elif isinstance(raw, list):
+        # 旧格式：定长 list[entry|None]，下次写入时改存为稀疏格式
+        for i, x in enumerate(raw[:size], start=1):
+            entry = _normalize_backpack_entry(x)
+            if entry:
+                slots[i] = entry
+    return Backpack(size, slots)
+
+
+def backpack_slot_entry(raw: object, slot: int, size: int) -> object:
+    """直接从存储格式读取单个槽位，不解析整个背包。"""
+    if not 1 <= slot <= size:
+        return None
+    if isinstance(raw, dict):
+        return _normalize_backpack_entry(raw.get(str(slot)))
+    if isinstance(raw, list) and slot <= len(raw):
+        return _normalize_backpack_entry(raw[slot - 1])
+    return None
+
 
-    if len(items) < size:
-        items.extend([None] * (size - len(items)))
-    elif len(items) > size:
-        items = items[:size]
-    return items
+def format_empty_slots(items: Backpack) -> str:
+    """把空槽位压缩为区间描述，例如 "2、5-7"（按已用槽位之间的间隙计算，不逐个列出空位）。"""
+    parts: list[str] = []
+    prev = 0
+    for slot in sorted(items.slots) + [items.size + 1]:
+        if slot > prev + 1:
+            parts.append(str(prev + 1) if slot == prev + 2 else f"{prev + 1}-{slot - 1}")
+        prev = slot
+    return "、".join(parts)
 
 
 def get_today_slot_marks(cfg: dict) -> dict:
@@ -295,12 +1030,12 @@ def _read_today_slot_mark(marks: dict, uid: str, today: str, size: int) -> int |
     return None
 
 
-def _infer_today_slot_from_items(items: list, img: str) -> int | None:
+def _infer_today_slot_from_items(items: Backpack, img: str) -> int | None:
     """尝试从背包里推断“今日老婆槽位”（兼容旧数据：抽老婆已入库但未记录绑定）。"""
     if not img or not isinstance(img, str):
         return None
     img_base = os.path.basename(img)
-    for i, entry in enumerate(items, start=1):
+    for i, entry in items.occupied():
         e_img, _ = backpack_entry_to_img_note(entry)
         if e_img == img:
             return i
@@ -317,7 +1052,7 @@ def bind_today_slot(cfg: dict, uid: str, today: str, slot: int) -> None:
     cfg[BACKPACK_TODAY_SLOT_KEY] = marks
 
 
-def get_or_infer_today_slot(cfg: dict, uid: str, today: str, size: int, *, items: list | None = None, prefer_img: str | None = None) -> int | None:
+def get_or_infer_today_slot(cfg: dict, uid: str, today: str, size: int, *, items: Backpack | None = None, prefer_img: str | None = None) -> int | None:
     """获取或推断今日绑定槽位；推断成功会写回 cfg。"""
     marks = get_today_slot_marks(cfg)
     slot = _read_today_slot_mark(marks, uid, today, size)
@@ -334,16 +1069,6 @@ def get_or_infer_today_slot(cfg: dict, uid: str, today: str, size: int, *, items
     return None
 
 
-def first_empty_slot(items: list) -> int | None:
-    """返回第一个空槽位（1-based），没有空位则返回 None。"""
-    for i, x in enumerate(items, start=1):
-        if not x:
-            return i
-        if isinstance(x, dict) and not x.get("img"):
-            return i
-    return None
-
-
 def backpack_entry_to_img_note(entry: object) -> tuple[str | None, str | None]:
     if not entry:
         return None, None
@@ -394,7 +1119,7 @@ def normalize_today_record(raw: object, today: str, *, nick_default: str | None
     return None
 
 
-def get_user_backpack(cfg: dict, uid: str, size: int) -> tuple[dict, list]:
+def get_user_backpack(cfg: dict, uid: str, size: int) -> tuple[dict, Backpack]:
     backpacks = cfg.get(BACKPACKS_KEY, {})
     if not isinstance(backpacks, dict):
         backpacks = {}
@@ -402,6 +1127,161 @@ def get_user_backpack(cfg: dict, uid: str, size: int) -> tuple[dict, list]:
     return backpacks, items
 
 
+def get_backpack_entry(cfg: dict, uid: str, slot: int, size: int) -> object:
+    """读取单个背包槽位（不解析整个背包）。"""
+    backpacks = cfg.get(BACKPACKS_KEY)
+    return backpack_slot_entry(backpacks.get(uid), slot, size) if isinstance(backpacks, dict) else None
+
+
+def _backpack_imgs(items: Backpack) -> list[str]:
+    return [img for img in (backpack_entry_to_img_note(x)[0] for _, x in items.occupied()) if img]
+
+
+def store_user_backpack(cfg: dict, uid: str, backpacks: dict, items: Backpack) -> None:
+    """
+    写回用户背包（所有背包写入都经过这里），按新旧槽位的差异：
+    - 新得到的老婆记入图鉴
+    - 增量更新群统计与反向索引；统计尚未建立或背包容量已变化时不更新，等查询时整体重建
+    """
+    old_items = normalize_backpack(backpacks.get(uid), items.size)
+    new = _backpack_imgs(items)
+    delta = Counter(new)
+    delta.subtract(_backpack_imgs(old_items))
+    for img, d in delta.items():
+        if d > 0:
+            collect_wife(cfg, uid, img)
+    if wife_stats_ready(cfg, items.size):
+        stats = cfg[WIFE_STATS_KEY]
+        owners = stats["owners"]
+        for slot in old_items.slots.keys() | items.slots.keys():
+            old_img = backpack_entry_to_img_note(old_items.get(slot))[0]
+            new_img = backpack_entry_to_img_note(items.get(slot))[0]
+            if old_img != new_img:
+                if old_img:
+                    _unlink_owner(owners, old_img, uid, slot)
+                if new_img:
+                    _link_owner(owners, new_img, uid, slot)
+        owned = stats.setdefault("owned", {})
+        for img, d in delta.items():
+            if d:
+                n = owned.get(img, 0) + d
+                if n > 0:
+                    owned[img] = n
+                else:
+                    owned.pop(img, None)
+        filled = stats.setdefault("filled", {})
+        if new:
+            filled[uid] = len(new)
+        else:
+            filled.pop(uid, None)
+    backpacks[uid] = items.raw()
+    cfg[BACKPACKS_KEY] = backpacks
+
+
+def wife_stats_ready(cfg: dict, size: int) -> bool:
+    stats = cfg.get(WIFE_STATS_KEY)
+    return isinstance(stats, dict) and stats.get("size") == size and isinstance(stats.get("owners"), dict)
+
+
+def _link_owner(owners: dict, img: str, uid: str, slot: int) -> None:
+    slots = owners.setdefault(img, {}).setdefault(uid, [])
+    if slot not in slots:
+        slots.append(slot)
+
+
+def _unlink_owner(owners: dict, img: str, uid: str, slot: int) -> None:
+    users = owners.get(img)
+    slots = users.get(uid) if users else None
+    if not slots or slot not in slots:
+        return
+    slots.remove(slot)
+    if not slots:
+        del users[uid]
+        if not users:
+            del owners[img]
+
+
+def _temp_img(raw: object) -> str | None:
+    """今日记录中临时态的图片（不看日期；槽位引用的记录返回 None）。"""
+    if isinstance(raw, list) and raw and isinstance(raw[0], str) and raw[0]:
+        return raw[0]
+    if isinstance(raw, dict) and "slot" not in raw and isinstance(raw.get("img"), str) and raw.get("img"):
+        return raw["img"]
+    return None
+
+
+def track_temp_owner(cfg: dict, uid: str, img: str | None) -> None:
+    """覆盖/删除 cfg[uid] 之前调用：把今日老婆临时态的变化同步到反向索引（槽位记为 0）。"""
+    stats = cfg.get(WIFE_STATS_KEY)
+    owners = stats.get("owners") if isinstance(stats, dict) else None
+    if not isinstance(owners, dict):
+        return
+    old = _temp_img(cfg.get(uid))
+    if old == img:
+        return
+    if old:
+        _unlink_owner(owners, old, uid, 0)
+    if img:
+        _link_owner(owners, img, uid, 0)
+
+
+def rebuild_wife_stats(cfg: dict, size: int, today: str) -> dict:
+    """扫描全部背包与今日记录重建群统计（牛成功次数无法从背包推出，原样保留）。"""
+    backpacks = cfg.get(BACKPACKS_KEY)
+    owned: Counter = Counter()
+    filled: dict[str, int] = {}
+    owners: dict[str, dict[str, list[int]]] = {}
+    for uid, raw in (backpacks.items() if isinstance(backpacks, dict) else ()):
+        items = normalize_backpack(raw, size)
+        imgs = _backpack_imgs(items)
+        owned.update(imgs)
+        if imgs:
+            filled[uid] = len(imgs)
+        for slot, x in items.occupied():
+            img = backpack_entry_to_img_note(x)[0]
+            if img:
+                _link_owner(owners, img, uid, slot)
+    for uid, raw in cfg.items():
+        img = None if uid.startswith("__") else _temp_img(raw)
+        if img and normalize_today_record(raw, today) is not None:
+            _link_owner(owners, img, uid, 0)
+    old = cfg.get(WIFE_STATS_KEY)
+    ntr = old.get("ntr") if isinstance(old, dict) and isinstance(old.get("ntr"), dict) else {}
+    stats = {"size": size, "owned": dict(owned), "filled": filled, "ntr": ntr, "owners": owners}
+    cfg[WIFE_STATS_KEY] = stats
+    return stats
+
+
+def wife_owners(cfg: dict, img: str, size: int, today: str) -> list[tuple[str, int]]:
+    """
+    反向索引中持有 img 的 [(uid, 编号)]（临时位编号为 size+1），只核对这些条目：
+    已失效的条目（如昨天的临时态）跳过。需先确认 wife_stats_ready。
+    """
+    out: list[tuple[str, int]] = []
+    for uid, slots in cfg[WIFE_STATS_KEY]["owners"].get(img, {}).items():
+        for slot in sorted(slots):
+            if slot == 0:
+                t_img, t_slot, _, _ = resolve_today_entity(cfg, uid, today, size)
+                if t_img == img and t_slot is None:
+                    out.append((uid, size + 1))
+            elif backpack_entry_to_img_note(get_backpack_entry(cfg, uid, slot, size))[0] == img:
+                out.append((uid, slot))
+    return out
+
+
+def top_entries(counts: dict, limit: int) -> list[tuple[str, int]]:
+    """计数最高的 limit 项（同分按键排序，结果稳定）。"""
+    return heapq.nsmallest(limit, counts.items(), key=lambda kv: (-kv[1], kv[0]))
+
+
+def record_ntr_success(cfg: dict, uid: str) -> None:
+    stats = cfg.get(WIFE_STATS_KEY)
+    if not isinstance(stats, dict):
+        stats = cfg[WIFE_STATS_KEY] = {}
+    ntr = stats.setdefault("ntr", {})
+    ntr[uid] = ntr.get(uid, 0) + 1
+
+
 def clear_today_binding(cfg: dict, uid: str, today: str) -> bool:
     """清理今日绑定槽位标记（仅当标记属于 today 时清理）。"""
     marks = get_today_slot_marks(cfg)
@@ -422,9 +1302,9 @@ def set_today_entity_slot(cfg: dict, uid: str, today: str, nick: str, size: int,
     img = normalize_img_id(img) or img
     backpacks, items = get_user_backpack(cfg, uid, size)
     if 1 <= slot <= size:
-        items[slot - 1] = make_backpack_entry(img, note)
-        backpacks[uid] = items
-        cfg[BACKPACKS_KEY] = backpacks
+        items.set(slot, make_backpack_entry(img, note))
+        store_user_backpack(cfg, uid, backpacks, items)
+        track_temp_owner(cfg, uid, None)
         cfg[uid] = {"date": today, "slot": int(slot), "nick": nick}
         bind_today_slot(cfg, uid, today, int(slot))
 
@@ -432,8 +1312,10 @@ def set_today_entity_slot(cfg: dict, uid: str, today: str, nick: str, size: int,
 def set_today_entity_unsaved(cfg: dict, uid: str, today: str, nick: str, img: str) -> None:
     """把“今日老婆实体 w”存为临时态（背包满/不入库时），w 仅存在于 cfg[uid]。"""
     img = normalize_img_id(img) or img
+    track_temp_owner(cfg, uid, img)
     cfg[uid] = {"date": today, "img": img, "nick": nick}
     clear_today_binding(cfg, uid, today)
+    collect_wife(cfg, uid, img)
 
 
 def set_today_entity_unsaved_with_note(cfg: dict, uid: str, today: str, nick: str, img: str, note: str | None) -> None:
@@ -442,108 +1324,168 @@ def set_today_entity_unsaved_with_note(cfg: dict, uid: str, today: str, nick: st
     rec = {"date": today, "img": img, "nick": nick}
     if isinstance(note, str) and note:
         rec["note"] = note
+    track_temp_owner(cfg, uid, img)
     cfg[uid] = rec
     clear_today_binding(cfg, uid, today)
+    collect_wife(cfg, uid, img)
+
+
+def give_today_entity(cfg: dict, uid: str, today: str, nick: str, size: int, img: str) -> int | None:
+    """
+    用 img 覆盖 uid 的今日老婆（遵循“实体 w”单一来源模型），返回存入的背包槽位；背包已满存为临时态时返回 None：
+    - 若今日老婆已落在背包槽位：覆盖同一槽位（不新增、不复制）
+    - 若今日老婆为临时态或今日没有老婆：优先入库到空槽位；满则临时态
+    """
+    prev_img, prev_slot, _, _ = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
+    if prev_img and prev_slot is not None and 1 <= prev_slot <= size:
+        set_today_entity_slot(cfg, uid, today, nick, size, prev_slot, img)
+        return prev_slot
+    _, items = get_user_backpack(cfg, uid, size)
+    empty = items.first_empty()
+    if empty is not None:
+        set_today_entity_slot(cfg, uid, today, nick, size, empty, img)
+        return empty
+    set_today_entity_unsaved(cfg, uid, today, nick, img)
+    return None
+
+
+def _find_today_slot(cfg: dict, uid: str, today: str, size: int, prefer_img: str | None) -> int | None:
+    """今日绑定槽位：优先读绑定表，其次按图片在背包中推断（不写回）。"""
+    slot = _read_today_slot_mark(get_today_slot_marks(cfg), uid, today, size)
+    if slot is None and prefer_img:
+        slot = _infer_today_slot_from_items(get_user_backpack(cfg, uid, size)[1], prefer_img)
+    return slot
+
+
+def resolve_today_entity(cfg: dict, uid: str, today: str, size: int, *, nick_default: str | None = None) -> tuple[str | None, int | None, str | None, str | None]:
+    """
+    解析“今日老婆实体 w”（纯查询，不修改 cfg）：
+    - 若 w 在背包：返回 (img, slot, nick, note)，其中 img 来自背包槽位
+    - 若 w 为临时态：返回 (img, None, nick, note)，其中 img 来自 cfg[uid]["img"]
+    旧格式/重复存储/悬挂绑定由 repair_today_entity 修复（群配置首次加载时检查），这里按修复后的结果解读。
+    """
+    rec = normalize_today_record(cfg.get(uid), today, nick_default=nick_default)
+    if not rec:
+        return None, None, None, None
+
+    nick = rec.get("nick") if isinstance(rec.get("nick"), str) and rec.get("nick") else (nick_default or None)
+    img_field = rec.get("img") if isinstance(rec.get("img"), str) and rec.get("img") else None
+    slot_field = rec.get("slot") if isinstance(rec.get("slot"), int) else None
+    note_field = rec.get("note") if isinstance(rec.get("note"), str) and rec.get("note") else None
+
+    if slot_field is None:
+        slot_field = _find_today_slot(cfg, uid, today, size, img_field)
+
+    if slot_field is not None and 1 <= int(slot_field) <= size:
+        slot_field = int(slot_field)
+        e_img, note = backpack_entry_to_img_note(get_backpack_entry(cfg, uid, slot_field, size))
+        if e_img:
+            return e_img, slot_field, nick, note
+        if img_field:
+            # 槽位为空但记录还留着 img：实体应落回该槽位
+            return img_field, slot_field, nick, None
+        return None, None, nick, None
+
+    if img_field:
+        return img_field, None, nick, note_field
+    return None, None, nick, None
 
 
-def resolve_today_entity(cfg: dict, uid: str, today: str, size: int, *, nick_default: str | None = None) -> tuple[str | None, int | None, str | None, str | None, bool]:
+def repair_today_entity(cfg: dict, uid: str, today: str, size: int, *, nick_default: str | None = None) -> list[str]:
     """
-    解析“今日老婆实体 w”：
-    - 若 w 在背包：返回 (img, slot, nick, note, changed)，其中 img 来自背包槽位
-    - 若 w 为临时态：返回 (img, None, nick, None, changed)，其中 img 来自 cfg[uid]["img"]
-    并在必要时做迁移/去重/修复（确保 w 同时只存在一处）。
+    把 uid 的今日老婆记录修复为标准形态（确保 w 同时只存在一处），返回修复说明；无需修复时返回空列表。
+    - 槽位引用：cfg[uid] = {date, slot, nick}，实体只在背包槽位，绑定表指向该槽位
+    - 临时态：cfg[uid] = {date, img, nick[, note]}，绑定表中没有该用户
     """
     raw = cfg.get(uid)
     rec = normalize_today_record(raw, today, nick_default=nick_default)
     if not rec:
-        # 如果 cfg 没有今日老婆记录，尝试清理悬挂绑定
-        changed = clear_today_binding(cfg, uid, today)
-        return None, None, None, None, changed
+        return ["清理悬挂的今日槽位绑定"] if clear_today_binding(cfg, uid, today) else []
 
+    fixes: list[str] = []
     nick = rec.get("nick") if isinstance(rec.get("nick"), str) and rec.get("nick") else (nick_default or None)
     img_field = rec.get("img") if isinstance(rec.get("img"), str) and rec.get("img") else None
     slot_field = rec.get("slot") if isinstance(rec.get("slot"), int) else None
     note_field = rec.get("note") if isinstance(rec.get("note"), str) and rec.get("note") else None
 
     backpacks, items = get_user_backpack(cfg, uid, size)
-    changed = False
 
     # 1) 优先使用绑定槽位（marks），并允许按 img 推断（兼容旧数据）
     if slot_field is None:
-        inferred = get_or_infer_today_slot(cfg, uid, today, size, items=items, prefer_img=img_field)
-        if inferred is not None:
-            slot_field = inferred
-            changed = True
+        slot_field = get_or_infer_today_slot(cfg, uid, today, size, items=items, prefer_img=img_field)
 
     # 2) 若有 slot 引用：实体必须只在该槽位存在；cfg[uid] 仅保存引用
     if slot_field is not None and 1 <= int(slot_field) <= size:
         slot_field = int(slot_field)
-        e_img, note = backpack_entry_to_img_note(items[slot_field - 1] if slot_field - 1 < len(items) else None)
+        e_img, _ = backpack_entry_to_img_note(items.get(slot_field))
         if not e_img and img_field:
-            # 修复：槽位为空但 cfg 还留着 img -> 把实体落回槽位，并去重
-            items[slot_field - 1] = make_backpack_entry(img_field)
-            e_img, note = img_field, None
-            changed = True
+            items.set(slot_field, make_backpack_entry(img_field))
+            e_img = img_field
+            fixes.append(f"{slot_field}号位为空，今日老婆落回该槽位")
         if not e_img:
-            # 槽位引用失效 -> 清理今日记录与绑定（不动背包其他槽位）
-            try:
-                del cfg[uid]
-            except Exception:
-                pass
-            if clear_today_binding(cfg, uid, today):
-                changed = True
-            return None, None, nick, None, True
-
-        # 若旧格式/错误格式：写回标准引用格式（并清掉 img 字段，避免重复存储）
-        if not (isinstance(raw, dict) and raw.get("date") == today and raw.get("slot") == slot_field and raw.get("nick") == nick and "img" not in raw):
+            track_temp_owner(cfg, uid, None)
+            cfg.pop(uid, None)
+            clear_today_binding(cfg, uid, today)
+            return [f"{slot_field}号位引用失效，清理今日记录"]
+
+        # 旧格式/错误格式：写回标准引用格式（并清掉 img 字段，避免重复存储）
+        if not (isinstance(raw, dict) and raw.get("slot") == slot_field and raw.get("nick") == nick and "img" not in raw):
+            track_temp_owner(cfg, uid, None)
             cfg[uid] = {"date": today, "slot": slot_field, "nick": nick}
-            changed = True
+            fixes.append(f"今日记录改写为{slot_field}号位引用")
 
         # 写回背包与绑定标记（items 可能被 normalize 过）
-        backpacks[uid] = items
-        cfg[BACKPACKS_KEY] = backpacks
+        store_user_backpack(cfg, uid, backpacks, items)
         bind_today_slot(cfg, uid, today, slot_field)
-        return e_img, slot_field, nick, note, changed
+        return fixes
 
     # 3) 无 slot：实体为临时态，只保留在 cfg[uid]["img"]
     if img_field:
-        if not (isinstance(raw, dict) and raw.get("date") == today and raw.get("img") == img_field and raw.get("nick") == nick):
+        if not (isinstance(raw, dict) and raw.get("img") == img_field and raw.get("nick") == nick):
+            track_temp_owner(cfg, uid, img_field)
             cfg[uid] = {"date": today, "img": img_field, "nick": nick}
             if note_field:
                 cfg[uid]["note"] = note_field
-            changed = True
+            fixes.append("今日记录改写为临时态")
         if clear_today_binding(cfg, uid, today):
-            changed = True
-        return img_field, None, nick, note_field, changed
+            fixes.append("清理临时态的槽位绑定")
+        return fixes
 
     # 兜底：无 img 且无 slot -> 清理
-    try:
-        del cfg[uid]
-    except Exception:
-        pass
-    if clear_today_binding(cfg, uid, today):
-        changed = True
-    return None, None, nick, None, True
+    track_temp_owner(cfg, uid, None)
+    cfg.pop(uid, None)
+    clear_today_binding(cfg, uid, today)
+    return ["今日记录既无图片也无槽位，已清理"]
+
+
+def repair_group_config(cfg: dict, today: str, size: int) -> list[tuple[str, str]]:
+    """检查并修复全群的今日老婆记录与绑定表，返回 [(uid, 修复说明)]。"""
+    marks = get_today_slot_marks(cfg)
+    uids = [k for k in cfg if not k.startswith("__")]
+    uids += [u for u in marks if u not in cfg]
+    fixes: list[tuple[str, str]] = []
+    for uid in uids:
+        # 既无今日记录也无绑定的用户（历史记录）不需要检查
+        if uid not in marks and normalize_today_record(cfg.get(uid), today) is None:
+            continue
+        for fix in repair_today_entity(cfg, uid, today, size):
+            fixes.append((uid, fix))
+    return fixes
 
 
 def remove_today_entity(cfg: dict, uid: str, today: str, size: int) -> tuple[str | None, int | None, bool]:
     """删除“今日老婆实体 w”：清空背包槽位(若存在)并移除今日老婆引用。"""
-    img, slot, nick, note, changed = resolve_today_entity(cfg, uid, today, size)
+    img, slot, _, _ = resolve_today_entity(cfg, uid, today, size)
     if not img:
-        return None, None, changed
+        return None, None, False
     backpacks, items = get_user_backpack(cfg, uid, size)
     if slot is not None and 1 <= slot <= size:
-        items[slot - 1] = None
-        backpacks[uid] = items
-        cfg[BACKPACKS_KEY] = backpacks
-        changed = True
-    try:
-        del cfg[uid]
-    except Exception:
-        pass
-    if clear_today_binding(cfg, uid, today):
-        changed = True
-    return img, slot, changed
+        items.set(slot, None)
+        store_user_backpack(cfg, uid, backpacks, items)
+    track_temp_owner(cfg, uid, None)
+    cfg.pop(uid, None)
+    clear_today_binding(cfg, uid, today)
+    return img, slot, True
 
 
 def format_backpack_item(entry: object) -> str:
@@ -563,20 +1505,20 @@ def get_today_slot_number(
     size: int,
     *,
     nick_default: str | None = None,
-) -> tuple[int | None, str | None, str | None, str | None, bool]:
+) -> tuple[int | None, str | None, str | None, str | None]:
     """
-    返回今日老婆所在的“背包编号”：
+    返回今日老婆所在的“背包编号” (编号, img, nick, note)：
     - 1..size 表示持久槽位
     - size+1 表示临时槽位（仅当今日老婆为临时态时存在）
     """
-    img, slot, nick, note, changed = resolve_today_entity(
+    img, slot, nick, note = resolve_today_entity(
         cfg, uid, today, size, nick_default=nick_default
     )
     if not img:
-        return None, None, nick, None, changed
+        return None, None, nick, None
     if slot is not None and 1 <= slot <= size:
-        return int(slot), img, nick, note, changed
-    return size + 1, img, nick, note, changed
+        return int(slot), img, nick, note
+    return size + 1, img, nick, note
 
 
 def get_slot_entry(
@@ -587,27 +1529,25 @@ def get_slot_entry(
     slot: int,
     *,
     nick_default: str | None = None,
-) -> tuple[str | None, str | None, bool, bool]:
+) -> tuple[str | None, str | None, bool]:
     """
     读取某个编号槽位的老婆：
     - slot in 1..size: 来自背包
     - slot == size+1: 来自临时槽位（仅当今日老婆为临时态时）
-    返回 (img, note, is_temp, changed)
+    返回 (img, note, is_temp)
     """
     if slot < 1 or slot > size + 1:
-        return None, None, False, False
+        return None, None, False
     if slot == size + 1:
-        tslot, img, _, note, changed = get_today_slot_number(
+        tslot, img, _, note = get_today_slot_number(
             cfg, uid, today, size, nick_default=nick_default
         )
         if tslot != size + 1 or not img:
-            return None, None, True, changed
-        return img, note, True, changed
+            return None, None, True
+        return img, note, True
 
-    _, items = get_user_backpack(cfg, uid, size)
-    entry = items[slot - 1] if 0 <= slot - 1 < len(items) else None
-    img, note = backpack_entry_to_img_note(entry)
-    return img, note, False, False
+    img, note = backpack_entry_to_img_note(get_backpack_entry(cfg, uid, slot, size))
+    return img, note, False
 
 
 def set_slot_entry(
@@ -636,9 +1576,8 @@ def set_slot_entry(
 
     backpacks, items = get_user_backpack(cfg, uid, size)
     if 1 <= slot <= size:
-        items[slot - 1] = make_backpack_entry(img, note)
-        backpacks[uid] = items
-        cfg[BACKPACKS_KEY] = backpacks
+        items.set(slot, make_backpack_entry(img, note))
+        store_user_backpack(cfg, uid, backpacks, items)
         return True
     return False
 
@@ -760,23 +1699,265 @@ def rank_wife_candidates(imgs: list[str], keyword: str, *, limit: int = 8) -> li
     return [img for _, img, _ in scored[: max(1, int(limit))]]
 
 
+# ==================== 命令上下文 ====================
+
+@dataclass
+class CommandContext:
+    """一条命令消息的解析结果：由分发器构建一次，传给各命令处理函数复用。"""
+
+    cmd: str                 # 命中的命令名（如 "牛老婆"）
+    args: str                # 命令名之后的参数文本（已 strip）
+    gid: str
+    uid: str
+    nick: str
+    today: str
+    at_targets: list[str] = field(default_factory=list)  # 消息链中的 @ 目标（按出现顺序）
+    plain_text: str = ""     # 消息链中 Plain 段拼接（/发老婆 关键词兜底）
+    tokens: list[str] = field(default_factory=list)
+    numbers: list[int] = field(default_factory=list)     # args 中的纯数字 token（按出现顺序）
+
+    @property
+    def at_target(self) -> str | None:
+        return self.at_targets[0] if self.at_targets else None
+
+
+def parse_command(
+    text: str,
+    commands,
+    *,
+    gid: str,
+    uid: str,
+    nick: str,
+    today: str,
+    at_targets: list[str] | None = None,
+    plain_text: str = "",
+) -> CommandContext | None:
+    """
+    解析命令文本（纯函数，不依赖 AstrBot）：按 commands 的顺序做前缀匹配，
+    命中则返回 CommandContext，否则返回 None。
+    """
+    msg = normalize_cmd_text(text)
+    for cmd in commands:
+        if not msg.startswith(cmd):
+            continue
+        args = msg[len(cmd):].strip()
+        tokens = args.split()
+        numbers: list[int] = []
+        for t in tokens:
+            if t.isdigit():
+                try:
+                    numbers.append(int(t))
+                except Exception:
+                    pass
+        return CommandContext(
+            cmd=cmd,
+            args=args,
+            gid=str(gid),
+            uid=str(uid),
+            nick=nick,
+            today=today,
+            at_targets=[str(x) for x in (at_targets or [])],
+            plain_text=plain_text or "",
+            tokens=tokens,
+            numbers=numbers,
+        )
+    return None
+
+
+def split_send_args(tokens: list[str]) -> tuple[list[str], list[str]]:
+    """
+    拆分 /发老婆 的参数，返回 (QQ 号列表, 关键词 token)：
+    只有写在关键词之前、单独成词的 5 位以上数字才是目标 QQ 号；@ 片段不计入关键词。
+    关键词之中或之后的数字（年份、候选序号等）原样保留在关键词里。
+    """
+    qq: list[str] = []
+    rest: list[str] = []
+    for t in tokens:
+        if t.startswith("@"):
+            continue
+        if not rest and len(t) >= 5 and t.isascii() and t.isdigit():
+            qq.append(t)
+        else:
+            rest.append(t)
+    return qq, rest
+
+
 def load_ntr_statuses():
-    """加载 NTR 开关状态"""
-    raw = load_json(NTR_STATUS_FILE)
+    """加载 NTR 开关状态（文件损坏时隔离后按空数据处理）"""
+    if redis_store is not None:
+        raw = redis_store.load_ntr()
+        ntr_statuses.clear()
+        ntr_statuses.update(raw)
+        return
+    version = shared_lock.version(NTR_STATUS_FILE)
+    raw, err = decode_data_payload(read_file_bytes(NTR_STATUS_FILE))
+    if err is not None:
+        quarantine_file(NTR_STATUS_FILE, err)
+        raw = {}
+        version = shared_lock.version(NTR_STATUS_FILE)
+    shared_lock.note(NTR_STATUS_FILE, version)
     ntr_statuses.clear()
     ntr_statuses.update(raw)
 
 
+def refresh_ntr_statuses():
+    """跨进程模式：NTR 状态文件被其他进程改写过则重新加载（Redis 后端总是重新读取）"""
+    if redis_store is not None:
+        load_ntr_statuses()
+    elif shared_lock.changed(NTR_STATUS_FILE):
+        metrics.inc("shared_reloads", data="ntr")
+        load_ntr_statuses()
+
+
 def save_ntr_statuses():
     """保存 NTR 开关状态"""
+    if redis_store is not None:
+        redis_store.save_ntr(ntr_statuses)
+        return
     save_json(NTR_STATUS_FILE, ntr_statuses)
 
 
-# ==================== 数据加载和保存函数 ====================
+# ==================== 限流 ====================
 
-def load_records():
-    """加载所有记录数据"""
-    raw = load_json(RECORDS_FILE)
+def parse_throttle_rules(text: str) -> dict[str, tuple[float, float]]:
+    """
+    解析限流规则：``命令=次数/秒数``，逗号/分号/换行分隔；``*`` 表示其余命令的默认规则。
+    例如 ``抽老婆=3/60,老婆背包=5/60,*=10/60``。返回 {命令: (桶容量, 每秒补充令牌数)}。
+    """
+    rules: dict[str, tuple[float, float]] = {}
+    for part in re.split(r"[,，;；\n]+", text or ""):
+        part = part.strip()
+        if not part or "=" not in part:
+            continue
+        cmd, spec = part.split("=", 1)
+        cmd = cmd.strip()
+        try:
+            burst, _, period = spec.strip().partition("/")
+            capacity = float(burst)
+            seconds = float(period) if period else 60.0
+        except ValueError:
+            continue
+        if cmd and capacity > 0 and seconds > 0:
+            rules[cmd] = (capacity, capacity / seconds)
+    return rules
+
+
+class CommandThrottle:
+    """
+    按（群, 用户, 命令）的令牌桶限流：纯内存判断，拒绝路径不触碰任何存储。
+    shed / passed 记录各命令被丢弃 / 放行的次数。
+    """
+
+    # 桶数量超过该值时清理已回满的空闲桶
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self, rules: dict[str, tuple[float, float]]):
+        self.rules = dict(rules)
+        self._buckets: dict[tuple[str, str, str], list[float]] = {}
+        self.shed: dict[str, int] = {}
+        self.passed: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rules)
+
+    def allow(self, gid: str, uid: str, cmd: str, now: float | None = None) -> bool:
+        rule = self.rules.get(cmd) or self.rules.get("*")
+        if rule is None:
+            return True
+        capacity, rate = rule
+        now = time.monotonic() if now is None else now
+        key = (gid, uid, cmd)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.PRUNE_THRESHOLD:
+                self._prune(now)
+            bucket = self._buckets[key] = [capacity, now]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            self.shed[cmd] = self.shed.get(cmd, 0) + 1
+            return False
+        bucket[0] -= 1.0
+        self.passed[cmd] = self.passed.get(cmd, 0) + 1
+        return True
+
+    def _prune(self, now: float) -> None:
+        """丢弃已回满的桶（与新建桶等价），控制内存占用。"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            rule = self.rules.get(key[2]) or self.rules.get("*")
+            if rule is None or tokens + (now - updated) * rule[1] >= rule[0]:
+                del self._buckets[key]
+
+
+# ==================== 随机数 ====================
+
+class RngService:
+    """
+    可注入的随机数服务：每个群一条独立的 random.Random 流，种子由 (配置种子, 群号) 派生，
+    因此同一群内的抽取/牛老婆/重置结果只取决于该群自身的消息顺序，与其它群的交错无关。
+    未配置种子时使用系统熵（与原先的全局 random 行为一致）。
+    random()/choice() 消耗的 [0, 1) 浮点数按 RNG_BATCH_SIZE 批量预生成，热路径只做一次 pop。
+    """
+
+    def __init__(self, seed: str | None = None, batch_size: int = RNG_BATCH_SIZE):
+        self.batch_size = max(1, int(batch_size))
+        self.reseed(seed)
+
+    def reseed(self, seed: str | None) -> None:
+        """重新设置种子并丢弃所有流与预生成的随机数。"""
+        self.seed = None if seed is None or str(seed).strip() == "" else str(seed).strip()
+        self._streams: dict[str, random.Random] = {}
+        self._pools: dict[str, list[float]] = {}
+
+    def stream(self, gid: str) -> random.Random:
+        gid = str(gid)
+        rng = self._streams.get(gid)
+        if rng is None:
+            if self.seed is None:
+                rng = random.Random()
+            else:
+                digest = hashlib.sha256(f"{self.seed}:{gid}".encode("utf-8")).digest()
+                rng = random.Random(int.from_bytes(digest[:8], "big"))
+            self._streams[gid] = rng
+        return rng
+
+    def random(self, gid: str) -> float:
+        gid = str(gid)
+        pool = self._pools.get(gid)
+        if not pool:
+            rng = self.stream(gid)
+            pool = [rng.random() for _ in range(self.batch_size)]
+            pool.reverse()  # 从尾部 pop，保持生成顺序
+            self._pools[gid] = pool
+        return pool.pop()
+
+    def choice(self, gid: str, seq):
+        if not seq:
+            raise IndexError("cannot choose from an empty sequence")
+        return seq[min(len(seq) - 1, int(self.random(gid) * len(seq)))]
+
+    def sample(self, gid: str, seq, k: int) -> list:
+        return self.stream(gid).sample(seq, k)
+
+
+rng = RngService()  # 随机数服务（种子在插件初始化时由配置 rng_seed 设置）
+
+
+# ==================== 数据加载和保存函数 ====================
+
+def load_records():
+    """加载所有记录数据（文件损坏时隔离后按空数据处理；Redis 后端的次数在计数器中，不加载）"""
+    raw: dict = {}
+    if redis_store is None:
+        version = shared_lock.version(RECORDS_FILE)
+        raw, err = decode_data_payload(read_file_bytes(RECORDS_FILE))
+        if err is not None:
+            quarantine_file(RECORDS_FILE, err)
+            raw = {}
+            version = shared_lock.version(RECORDS_FILE)
+        shared_lock.note(RECORDS_FILE, version)
     records.clear()
     records.update({
         "ntr": raw.get("ntr", {}),
@@ -786,42 +1967,2031 @@ def load_records():
     })
 
 
+def committed_records() -> dict:
+    """
+    次数记录的已提交视图（只读，不持锁）：records.json 当前的内容。
+    文件整体原子替换，事务中的修改只存在于内存的 records 里，因此读不到未提交的次数。
+    文件无法解析时抛 ValueError（不隔离，隔离由持锁的加载路径负责）。
+    """
+    raw, err = decode_data_payload(read_file_bytes(RECORDS_FILE))
+    if err is not None:
+        raise ValueError(f"records.json 无法解析：{err}")
+    return raw
+
+
 def save_records():
     """保存所有记录数据"""
-    save_json(RECORDS_FILE, records)
+    with metrics.timer("storage_latency_ms", op="save_records"):
+        save_json(RECORDS_FILE, records)
 
 
-def load_swap_requests():
-    """加载交换请求并清理过期数据"""
-    raw = load_json(SWAP_REQUESTS_FILE)
-    today = get_today()
-    cleaned = {}
-    
-    if not isinstance(raw, dict):
-        raw = {}
+def refresh_records():
+    """跨进程模式：记录文件被其他进程改写过则重新加载（需持有 records 锁文件）"""
+    if shared_lock.changed(RECORDS_FILE):
+        metrics.inc("shared_reloads", data="records")
+        load_records()
+
+
+class SwapRequestStore:
+    """
+    按群划分的交换请求存储：
+    - 数据：{gid: {发起者uid: {"target", "date", "offer_slot", "want_slot"}}}
+    - 反向索引：{gid: {目标uid: {发起者uid, ...}}}，查询/取消只触及相关请求
+    - 每群一把锁、一个文件（SWAP_REQUESTS_DIR/<gid>.json），写入只重写受影响的群
+    - 过期堆：[(expires_at, gid, uid)]，由后台任务按到期时间批量清理（惰性删除失效条目）
+    - 已提交视图：{gid: {uid: rec}}，保存/加载时整体替换（不原地修改），供只读命令无锁读取
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._groups: dict[str, dict[str, dict]] = {}
+        self._by_target: dict[str, dict[str, set[str]]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._heap: list[tuple[float, str, str]] = []
+        self._committed: dict[str, dict[str, dict]] = {}
+        # Redis 后端：各群读取时的版本号（保存时 WATCH 核对）
+        self._redis_versions: dict[str, str | None] = {}
+        # 新请求比堆顶更早过期时唤醒后台清理任务
+        self.wakeup = asyncio.Event()
+
+    def _path(self, gid: str) -> str:
+        return os.path.join(self.base_dir, f"{gid}.json")
+
+    def lock(self, gid: str) -> asyncio.Lock:
+        """获取或创建群交换请求锁"""
+        gid = str(gid)
+        if gid not in self._locks:
+            self._locks[gid] = make_lock("swap", gid)
+        return self._locks[gid]
+
+    def profile_locks(self) -> None:
+        """把现有的空闲群锁替换为 ProfiledLock（见 enable_lock_profiling）。"""
+        for gid, lock in list(self._locks.items()):
+            if not lock.locked():
+                self._locks[gid] = ProfiledLock("swap", gid)
+
+    # ---------- 查询 ----------
+
+    def get(self, gid: str, uid: str) -> dict | None:
+        return self._groups.get(str(gid), {}).get(str(uid))
+
+    def received_by(self, gid: str, target: str) -> list[tuple[str, dict]]:
+        """目标用户收到的请求 [(发起者uid, rec)]。"""
+        grp = self._groups.get(str(gid), {})
+        return [(u, grp[u]) for u in self._by_target.get(str(gid), {}).get(str(target), ()) if u in grp]
+
+    def related(self, gid: str, user_ids) -> list[str]:
+        """与指定用户相关（发起或被请求）的请求发起者列表。"""
+        gid = str(gid)
+        grp = self._groups.get(gid, {})
+        index = self._by_target.get(gid, {})
+        out: dict[str, None] = {}
+        for uid in user_ids:
+            uid = str(uid)
+            if uid in grp:
+                out[uid] = None
+            for from_uid in index.get(uid, ()):
+                out[from_uid] = None
+        return list(out)
+
+    def group(self, gid: str) -> dict[str, dict]:
+        """群请求的浅拷贝（用于快照/展示）。"""
+        return {u: dict(rec) for u, rec in self._groups.get(str(gid), {}).items()}
+
+    def group_ids(self) -> list[str]:
+        return list(self._groups)
+
+    def committed(self, gid: str) -> dict[str, dict]:
+        """
+        群请求的已提交视图（只读，不持锁）：事务中尚未提交的修改不可见。
+        返回的 dict 不会再被修改，调用方也不应修改它。
+        """
+        metrics.inc("lock_free_reads", data="swap")
+        return self._committed.get(str(gid), {})
+
+    def _publish(self, gid: str) -> None:
+        grp = self._groups.get(gid)
+        if grp:
+            self._committed[gid] = {u: dict(rec) for u, rec in grp.items()}
+        else:
+            self._committed.pop(gid, None)
+
+    # ---------- 修改 ----------
+
+    def put(self, gid: str, uid: str, rec: dict) -> None:
+        gid, uid = str(gid), str(uid)
+        self.pop(gid, uid)
+        self._groups.setdefault(gid, {})[uid] = rec
+        self._by_target.setdefault(gid, {}).setdefault(str(rec.get("target")), set()).add(uid)
+        expires_at = rec.get("expires_at")
+        if isinstance(expires_at, (int, float)):
+            if not self._heap or expires_at < self._heap[0][0]:
+                self.wakeup.set()
+            heapq.heappush(self._heap, (float(expires_at), gid, uid))
+
+    def pop(self, gid: str, uid: str) -> dict | None:
+        gid, uid = str(gid), str(uid)
+        grp = self._groups.get(gid)
+        if not grp or uid not in grp:
+            return None
+        rec = grp.pop(uid)
+        index = self._by_target.get(gid, {})
+        target = str(rec.get("target"))
+        senders = index.get(target)
+        if senders is not None:
+            senders.discard(uid)
+            if not senders:
+                del index[target]
+        if not grp:
+            self._groups.pop(gid, None)
+            self._by_target.pop(gid, None)
+        return rec
+
+    def next_expiry(self) -> float | None:
+        """最早的过期时间（可能是已失效的堆条目，仅用于决定休眠时长）。"""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[tuple[str, str, float]]:
+        """弹出所有到期的堆条目 [(gid, uid, expires_at)]；调用方需在群锁内确认请求仍有效。"""
+        due: list[tuple[str, str, float]] = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, gid, uid = heapq.heappop(self._heap)
+            due.append((gid, uid, expires_at))
+        return due
+
+    def replace_group(self, gid: str, data: dict | None) -> None:
+        """整体替换某群请求（事务回滚用），同时重建该群索引。"""
+        gid = str(gid)
+        self._groups.pop(gid, None)
+        self._by_target.pop(gid, None)
+        for uid, rec in (data or {}).items():
+            if isinstance(rec, dict):
+                self.put(gid, uid, rec)
+
+    def refresh(self, gid: str) -> bool:
+        """
+        跨进程模式：该群请求文件被其他进程改写过则重新加载（需持有 swap-<gid> 锁文件）；Redis 后端总是重新读取。
+        请求原样载入：是否有效由 swap_request_alive 判断，到期的交给后台清理返还次数。
+        """
+        gid = str(gid)
+        if redis_store is not None:
+            raw, self._redis_versions[gid] = redis_store.load_swaps(gid)
+            self.replace_group(gid, raw)
+            self._publish(gid)
+            return True
+        path = self._path(gid)
+        if not shared_lock.changed(path):
+            return False
+        version = shared_lock.version(path)
+        raw = load_json(path)
+        if not isinstance(raw, dict):
+            raw = {}
+        self.replace_group(gid, raw)
+        self._publish(gid)
+        shared_lock.note(path, version)
+        metrics.inc("shared_reloads", data="swap")
+        return True
+
+    # ---------- 持久化 ----------
+
+    def save(self, gid: str) -> None:
+        """只重写该群的请求文件；无请求时删除文件。"""
+        gid = str(gid)
+        grp = self._groups.get(gid)
+        if redis_store is not None:
+            reqs, checked, version = self.redis_pending(gid)
+            self.redis_saved(gid, redis_store.save_swaps(gid, reqs, check=checked, version=version))
+            return
+        path = self._path(gid)
+        if grp:
+            save_json(path, grp)
+        elif os.path.exists(path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            shared_lock.note(path, None)
+        self._publish(gid)
+
+    def redis_pending(self, gid: str) -> tuple[dict, bool, str | None]:
+        """Redis 后端待写入的内容：(该群全部请求, 是否核对版本, 读取时的版本号)，见 RedisStore.commit_group。"""
+        gid = str(gid)
+        return self._groups.get(gid) or {}, gid in self._redis_versions, self._redis_versions.get(gid)
+
+    def redis_saved(self, gid: str, version: str | None) -> None:
+        """Redis 后端写入成功后记录新版本号并发布已提交视图。"""
+        self._redis_versions[str(gid)] = version
+        self._publish(str(gid))
+
+    def load(self, today: str) -> None:
+        """加载全部群请求并清理过期数据；兼容迁移旧版全局 swap_requests.json。"""
+        self._groups.clear()
+        self._by_target.clear()
+        self._heap.clear()
+        self._committed.clear()
+        self._redis_versions.clear()
+        now = time.time()
+        midnight = next_midnight_ts(now)
+
+        def alive(rec: object) -> bool:
+            if not isinstance(rec, dict) or rec.get("date") != today:
+                return False
+            # 旧数据没有 expires_at：按当天零点失效补齐
+            if not isinstance(rec.get("expires_at"), (int, float)):
+                rec["expires_at"] = midnight
+            return rec["expires_at"] > now
+
+        dirty: set[str] = set()
+        if redis_store is not None:
+            for gid in redis_store.swap_groups():
+                raw, self._redis_versions[gid] = redis_store.load_swaps(gid)
+                for uid, rec in raw.items():
+                    if alive(rec):
+                        self.put(gid, uid, rec)
+                    else:
+                        dirty.add(gid)
+            for gid in dirty:
+                self.save(gid)
+            for gid in self._groups:
+                self._publish(gid)
+            return
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        for name in os.listdir(self.base_dir):
+            if not name.endswith(".json"):
+                continue
+            gid = name[: -len(".json")]
+            path = os.path.join(self.base_dir, name)
+            version = shared_lock.version(path)
+            raw = load_json(path)
+            shared_lock.note(path, version)
+            if not isinstance(raw, dict):
+                raw = {}
+            for uid, rec in raw.items():
+                if alive(rec):
+                    self.put(gid, uid, rec)
+                else:
+                    dirty.add(gid)
+            if not raw:
+                dirty.add(gid)
+
+        # 迁移旧版全局文件：拆分为每群一个文件后改名保留
+        if os.path.exists(SWAP_REQUESTS_FILE):
+            legacy = load_json(SWAP_REQUESTS_FILE)
+            if isinstance(legacy, dict):
+                for gid, reqs in legacy.items():
+                    if not isinstance(reqs, dict):
+                        continue
+                    for uid, rec in reqs.items():
+                        if alive(rec) and self.get(gid, uid) is None:
+                            self.put(gid, uid, rec)
+                            dirty.add(str(gid))
+            try:
+                os.replace(SWAP_REQUESTS_FILE, SWAP_REQUESTS_FILE + ".migrated")
+            except Exception:
+                pass
+
+        for gid in dirty:
+            self.save(gid)
+        for gid in self._groups:
+            self._publish(gid)
+
+    def clear(self) -> None:
+        self._groups.clear()
+        self._by_target.clear()
+        self._locks.clear()
+        self._heap.clear()
+        self._committed.clear()
+        self._redis_versions.clear()
+        # 插件重新启用时可能运行在新的事件循环中，Event 不能跨循环复用
+        self.wakeup = asyncio.Event()
+
+
+swap_store = SwapRequestStore(SWAP_REQUESTS_DIR)  # 交换请求数据
+
+
+def swap_request_alive(rec: object, today: str, now: float | None = None) -> bool:
+    """交换请求是否仍有效：当天发起且未超过 expires_at（后台清理可能稍有延迟）。"""
+    if not isinstance(rec, dict) or rec.get("date") != today:
+        return False
+    expires_at = rec.get("expires_at")
+    if isinstance(expires_at, (int, float)):
+        return expires_at > (time.time() if now is None else now)
+    return True
+
+
+# ==================== Redis 存储后端 ====================
+
+class StorageConflict(RuntimeError):
+    """乐观并发检查失败：数据在本事务读取之后被其他节点改写。"""
+
+
+def make_redis_client(url: str):
+    """按 URL（redis:// / rediss:// / unix://）创建同步 Redis 客户端。"""
+    import redis
 
-    for gid, reqs in raw.items():
-        if not isinstance(reqs, dict):
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class RedisStore:
+    """
+    Redis 存储后端（多个机器人节点共享状态），键布局（p 为 redis_prefix）：
+    - p:g:<gid> / p:bp:<gid>  群配置哈希：背包按 uid 单独存放在 bp，其余顶层键在 g，字段值为 JSON
+    - p:sw:<gid>              交换请求哈希，字段为发起者 uid
+    - p:v:g:<gid> / p:v:s:<gid>  群配置 / 交换请求的版本号：提交时 WATCH 核对读取时的版本，写入后 +1
+    - p:cnt:<kind>:<date>:<gid>:<uid>  每日次数计数器（INCR，EXPIREAT 上海时区零点）
+    - p:ntr                   NTR 开关哈希，字段为 gid
+    - p:prov:<gid> / p:prov_n:<gid>  老婆来历列表（只保留最近的记录）/ 累计追加条数（即记录序号）
+    - p:lock:<name>           跨节点锁（见 RedisDataLock）
+    使用同步客户端，与文件后端一样在事件循环中直接读写；写入只提交变化的字段。
+    """
+
+    def __init__(self, client, prefix: str = "animewife"):
+        from redis.exceptions import WatchError
+
+        self.client = client
+        self.prefix = prefix.rstrip(":") or "animewife"
+        self._watch_error = WatchError
+
+    def key(self, *parts) -> str:
+        return ":".join((self.prefix, *map(str, parts)))
+
+    def _transact(self, build, *, bump: list[str], expected: dict[str, str | None] | None = None, data: str = "") -> list:
+        """
+        在 MULTI 中执行 build(pipe) 并把 bump 中的版本号 +1，返回 EXEC 结果（版本号在最后）；
+        给出 expected 时先 WATCH 这些版本号键并核对读取时的值，不一致或 EXEC 失败时抛 StorageConflict。
+        """
+        with self.client.pipeline() as pipe:
+            try:
+                if expected:
+                    pipe.watch(*expected)
+                    for key, value in expected.items():
+                        if pipe.get(key) != value:
+                            raise StorageConflict(f"{key} 已被其他节点修改")
+                pipe.multi()
+                build(pipe)
+                for key in bump:
+                    pipe.incr(key)
+                return pipe.execute()
+            except self._watch_error as e:
+                metrics.inc("storage_conflicts", data=data)
+                raise StorageConflict("提交时数据已被其他节点修改") from e
+            except StorageConflict:
+                metrics.inc("storage_conflicts", data=data)
+                raise
+
+    @staticmethod
+    def _write_hash(pipe, key: str, new: dict[str, str], old: dict[str, str] | None) -> None:
+        """old 为读取时的字段：只写入变化的字段、删除消失的字段；old 为 None 时整体重写。"""
+        if old is None:
+            pipe.delete(key)
+            changed, removed = new, []
+        else:
+            changed = {k: v for k, v in new.items() if old.get(k) != v}
+            removed = [k for k in old if k not in new]
+        if changed:
+            pipe.hset(key, mapping=changed)
+        if removed:
+            pipe.hdel(key, *removed)
+
+    # ---------- 群配置 ----------
+
+    def load_group(self, gid: str) -> tuple[dict, dict]:
+        """读取群配置，返回 (配置, 基线)；基线记录各字段原始 JSON 与版本号，供 save_group 比较。"""
+        with metrics.timer("storage_latency_ms", op="redis_load_group"):
+            # MULTI 读取：与 save_group 的事务写入互斥，两个哈希与版本号来自同一次提交
+            pipe = self.client.pipeline(transaction=True)
+            pipe.hgetall(self.key("g", gid))
+            pipe.hgetall(self.key("bp", gid))
+            pipe.get(self.key("v", "g", gid))
+            fields, bp_fields, version = pipe.execute()
+        cfg = {k: json.loads(v) for k, v in fields.items()}
+        if bp_fields:
+            cfg[BACKPACKS_KEY] = {u: json.loads(v) for u, v in bp_fields.items()}
+        return cfg, {"fields": fields, "bp": bp_fields, "version": version}
+
+    def group_version(self, gid: str) -> str | None:
+        return self.client.get(self.key("v", "g", gid))
+
+    def _group_write(self, gid: str, cfg: dict, base: dict | None):
+        """群配置的写入计划：(build, 版本号键, 需核对的版本 {键: 值}, 写入后的基线（不含版本号）)。"""
+        backpacks = cfg.get(BACKPACKS_KEY)
+        split = isinstance(backpacks, dict)
+        fields = {
+            k: json.dumps(v, ensure_ascii=False)
+            for k, v in cfg.items() if not (split and k == BACKPACKS_KEY)
+        }
+        bp_fields = {u: json.dumps(v, ensure_ascii=False) for u, v in backpacks.items()} if split else {}
+
+        def build(pipe) -> None:
+            self._write_hash(pipe, self.key("g", gid), fields, base and base["fields"])
+            self._write_hash(pipe, self.key("bp", gid), bp_fields, base and base["bp"])
+
+        version_key = self.key("v", "g", gid)
+        expected = {} if base is None else {version_key: base["version"]}
+        return build, version_key, expected, {"fields": fields, "bp": bp_fields}
+
+    def save_group(self, gid: str, cfg: dict, base: dict | None = None) -> dict:
+        """
+        写入群配置；给出基线时只写变化的字段，且版本号与读取时不一致则抛 StorageConflict。
+        返回写入后的基线（可直接作为下一次 save_group 的 base）。
+        """
+        build, version_key, expected, new_base = self._group_write(gid, cfg, base)
+        with metrics.timer("storage_latency_ms", op="redis_save_group"):
+            result = self._transact(build, bump=[version_key], expected=expected or None, data="group")
+        return {**new_base, "version": str(result[-1])}
+
+    def commit_group(
+        self, gid: str, *, cfg: dict | None = None, base: dict | None = None,
+        swaps: tuple[dict, bool, str | None] | None = None,
+    ) -> tuple[dict | None, str | None]:
+        """
+        事务提交：群配置（cfg 非 None 时）与交换请求（swaps 为 (请求, 是否核对, 读取时的版本号)）在同一个
+        MULTI 中写入，同时 WATCH 两者的版本号，任一被其他节点改写则都不写入并抛 StorageConflict。
+        返回 (写入后的群配置基线, 交换请求的新版本号)，未写入的一项为 None。
+        """
+        builds, bump, expected = [], [], {}
+        new_base = None
+        if cfg is not None:
+            build, version_key, check, new_base = self._group_write(gid, cfg, base)
+            builds.append(build)
+            bump.append(version_key)
+            expected.update(check)
+        if swaps is not None:
+            build, version_key, check = self._swaps_write(gid, *swaps)
+            builds.append(build)
+            bump.append(version_key)
+            expected.update(check)
+        if not builds:
+            return None, None
+
+        def build_all(pipe) -> None:
+            for build in builds:
+                build(pipe)
+
+        with metrics.timer("storage_latency_ms", op="redis_commit_group"):
+            result = self._transact(build_all, bump=bump, expected=expected or None, data="group" if cfg is not None else "swap")
+        versions = [str(v) for v in result[-len(bump):]]
+        if new_base is not None:
+            new_base["version"] = versions[0]
+        return new_base, versions[-1] if swaps is not None else None
+
+    # ---------- 交换请求 ----------
+
+    def swap_groups(self) -> list[str]:
+        prefix = self.key("sw", "")
+        return [k[len(prefix):] for k in self.client.scan_iter(match=prefix + "*", count=500)]
+
+    def load_swaps(self, gid: str) -> tuple[dict, str | None]:
+        """读取某群交换请求，返回 ({uid: rec}, 版本号)。"""
+        with metrics.timer("storage_latency_ms", op="redis_load_swaps"):
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hgetall(self.key("sw", gid))
+            pipe.get(self.key("v", "s", gid))
+            raw, version = pipe.execute()
+        return {u: json.loads(v) for u, v in raw.items()}, version
+
+    def _swaps_write(self, gid: str, reqs: dict, check: bool, version: str | None):
+        """交换请求的写入计划：(build, 版本号键, 需核对的版本 {键: 值})。"""
+        key, version_key = self.key("sw", gid), self.key("v", "s", gid)
+        payload = {u: json.dumps(rec, ensure_ascii=False) for u, rec in reqs.items()}
+
+        def build(pipe) -> None:
+            self._write_hash(pipe, key, payload, None)
+
+        return build, version_key, {version_key: version} if check else {}
+
+    def save_swaps(self, gid: str, reqs: dict, *, check: bool = False, version: str | None = None) -> str | None:
+        """整体重写某群交换请求，返回新版本号；check 为 True 时核对 version（读取时的版本号）。"""
+        build, version_key, expected = self._swaps_write(gid, reqs, check, version)
+        with metrics.timer("storage_latency_ms", op="redis_save_swaps"):
+            result = self._transact(build, bump=[version_key], expected=expected or None, data="swap")
+        return str(result[-1])
+
+    # ---------- 次数计数器 ----------
+
+    def _count_key(self, kind: str, gid: str, uid: str, today: str) -> str:
+        return self.key("cnt", kind, today, gid, uid)
+
+    def get_count(self, kind: str, gid: str, uid: str, today: str) -> int:
+        return int(self.client.get(self._count_key(kind, gid, uid, today)) or 0)
+
+    def add_count(self, kind: str, gid: str, uid: str, today: str, delta: int = 1) -> int:
+        """原子加减计数并设置零点过期，返回新值。"""
+        key = self._count_key(kind, gid, uid, today)
+        pipe = self.client.pipeline()
+        pipe.incrby(key, delta)
+        pipe.expireat(key, int(next_midnight_ts()))
+        value, _ = pipe.execute()
+        return int(value)
+
+    def refund_count(self, kind: str, gid: str, uid: str, today: str) -> bool:
+        """计数大于 0 时减一（WATCH 重试，避免并发返还减到负数）。"""
+        key = self._count_key(kind, gid, uid, today)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if int(pipe.get(key) or 0) <= 0:
+                        pipe.reset()
+                        return False
+                    pipe.multi()
+                    pipe.decr(key)
+                    pipe.execute()
+                    return True
+                except self._watch_error:
+                    metrics.inc("storage_retries", op="refund")
+
+    def clear_count(self, kind: str, gid: str, uid: str, today: str) -> int | None:
+        """删除计数，返回删除前的值（不存在时为 None）。"""
+        pipe = self.client.pipeline()
+        key = self._count_key(kind, gid, uid, today)
+        pipe.get(key)
+        pipe.delete(key)
+        value, _ = pipe.execute()
+        return None if value is None else int(value)
+
+    def today_counts(self, today: str) -> dict[str, dict[str, dict[str, int]]]:
+        """当天全部计数 {kind: {gid: {uid: count}}}（一次 SCAN，供导出使用）。"""
+        out: dict[str, dict[str, dict[str, int]]] = {}
+        prefix = self.key("cnt", "")
+        keys = list(self.client.scan_iter(match=self.key("cnt", "*", today, "*"), count=500))
+        for key, value in zip(keys, self.client.mget(keys) if keys else []):
+            if value is not None:
+                kind, _, gid, uid = key[len(prefix):].split(":", 3)
+                out.setdefault(kind, {}).setdefault(gid, {})[uid] = int(value)
+        return out
+
+    def set_counts(self, kind: str, gid: str, today: str, counts: dict[str, int]) -> None:
+        """写入某群当天计数（导入用，覆盖同名用户，零点过期）。"""
+        if not counts:
+            return
+        expire_at = int(next_midnight_ts())
+        pipe = self.client.pipeline()
+        for uid, n in counts.items():
+            pipe.set(self._count_key(kind, gid, uid, today), int(n), exat=expire_at)
+        pipe.execute()
+
+    def group_ids(self) -> list[str]:
+        """有群配置或交换请求的群号。"""
+        gids = set(self.swap_groups())
+        prefix = self.key("g", "")
+        gids.update(k[len(prefix):] for k in self.client.scan_iter(match=prefix + "*", count=500))
+        return list(gids)
+
+    def export_records(self) -> dict:
+        """按 records.json 的格式导出计数（每个用户取最近日期的计数）。"""
+        out: dict[str, dict] = {kind: {} for kind in ("ntr", "change", "reset", "swap")}
+        prefix = self.key("cnt", "")
+        keys = list(self.client.scan_iter(match=prefix + "*", count=500))
+        values = self.client.mget(keys) if keys else []
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            kind, date, gid, uid = key[len(prefix):].split(":", 3)
+            grp = out.setdefault(kind, {}).setdefault(gid, {})
+            if uid not in grp or grp[uid]["date"] < date:
+                grp[uid] = {"date": date, "count": int(value)}
+        return out
+
+    # ---------- 图库编号 ----------
+
+    def catalog_names(self, start: int = 0) -> list[str]:
+        return self.client.lrange(self.key("catalog"), start, -1)
+
+    def catalog_extend(self, known: int, names: list[str]) -> list[str]:
+        """追加图库编号（WATCH 核对，多个节点不会重复追加），返回第 known 个之后的全部名字。"""
+        key = self.key("catalog")
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    tail = pipe.lrange(key, known, -1)
+                    seen = set(tail)
+                    new = [n for n in names if n not in seen]
+                    if not new:
+                        pipe.reset()
+                        return tail
+                    pipe.multi()
+                    pipe.rpush(key, *new)
+                    pipe.execute()
+                    return tail + new
+                except self._watch_error:
+                    continue
+
+    # ---------- 老婆来历 ----------
+
+    def provenance_append(self, gid: str, lines: list[str], cap: int) -> int:
+        """追加来历记录并裁剪到最近 cap 条，返回该群累计追加的条数（即最后一条的序号）。"""
+        key = self.key("prov", gid)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, *lines)
+        pipe.ltrim(key, -cap, -1)
+        pipe.incrby(self.key("prov_n", gid), len(lines))
+        return int(pipe.execute()[-1])
+
+    def provenance_tail(self, gid: str, since: int) -> tuple[int, list[str]]:
+        """序号 since 之后追加的记录，返回 (累计条数, [行])；已被裁剪掉的不返回（WATCH 累计条数，与追加互斥）。"""
+        key, n_key = self.key("prov", gid), self.key("prov_n", gid)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(n_key)
+                    total = int(pipe.get(n_key) or 0)
+                    if total <= since:
+                        pipe.reset()
+                        return total, []
+                    pipe.multi()
+                    pipe.lrange(key, since - total, -1)
+                    return total, pipe.execute()[0]
+                except self._watch_error:
+                    continue
+
+    def provenance_read(self, gid: str, seqs: list[int]) -> list[str | None]:
+        """按序号读取来历记录（与 seqs 对齐，已被裁剪的为 None）。"""
+        key, n_key = self.key("prov", gid), self.key("prov_n", gid)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(n_key)
+                    total = int(pipe.get(n_key) or 0)
+                    first = total - pipe.llen(key) + 1  # 列表中第一条的序号
+                    kept = [seq for seq in seqs if first <= seq <= total]
+                    pipe.multi()
+                    for seq in kept:
+                        pipe.lindex(key, seq - first)
+                    found = dict(zip(kept, pipe.execute()))
+                    return [found.get(seq) for seq in seqs]
+                except self._watch_error:
+                    continue
+
+    # ---------- NTR 开关 ----------
+
+    def load_ntr(self) -> dict:
+        return {gid: json.loads(v) for gid, v in self.client.hgetall(self.key("ntr")).items()}
+
+    def save_ntr(self, statuses: dict) -> None:
+        def build(pipe) -> None:
+            self._write_hash(pipe, self.key("ntr"), {g: json.dumps(v) for g, v in statuses.items()}, None)
+
+        self._transact(build, bump=[], data="ntr")
+
+
+class RedisDataLock(SharedDataLock):
+    """
+    跨节点锁（Redis 后端时替代 SharedDataLock）：SET NX PX 加锁，轮询退避与文件锁相同；
+    释放时 WATCH 核对令牌，只删除自己持有的锁（锁过期后被他人获得时不误删）。
+    数据直接从 Redis 读取，不需要文件版本检查。
+    """
+
+    metric = "redis_lock"
+
+    def __init__(self, store: RedisStore, ttl_ms: int = 30000):
+        super().__init__()
+        self.store = store
+        self.ttl_ms = ttl_ms
+        self.enabled = True
+        self._tokens: dict[str, str] = {}
+
+    def enable(self) -> bool:
+        return True
+
+    def _try_acquire(self, name: str) -> bool:
+        token = self._tokens.get(name) or f"{os.getpid()}:{os.urandom(8).hex()}"
+        if not self.store.client.set(self.store.key("lock", name), token, nx=True, px=self.ttl_ms):
+            return False
+        self._tokens[name] = token
+        return True
+
+    def release(self, name: str) -> None:
+        token = self._tokens.pop(name, None)
+        key = self.store.key("lock", name)
+        with self.store.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) == token:
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+            except self.store._watch_error:
+                # 锁已过期并被其他节点获得
+                pass
+
+    def version(self, path: str) -> tuple | None:
+        return None
+
+    def note(self, path: str, version: object = SharedDataLock._UNSEEN) -> None:
+        pass
+
+    def changed(self, path: str) -> bool:
+        return False
+
+    def close(self) -> None:
+        self._tokens.clear()
+        self.enabled = False
+
+
+redis_store: RedisStore | None = None  # 非 None 时使用 Redis 后端（由配置 storage_backend 设置）
+
+
+def use_redis_backend(client, prefix: str = "animewife") -> None:
+    """切换到 Redis 后端：数据读写走 Redis，跨节点锁替代文件锁（应在加载数据前调用）。"""
+    global redis_store, shared_lock
+    shared_lock.close()
+    redis_store = RedisStore(client, prefix)
+    shared_lock = RedisDataLock(redis_store)
+
+
+def use_file_backend() -> None:
+    """恢复默认的文件后端（插件卸载时调用）。"""
+    global redis_store, shared_lock
+    shared_lock.close()
+    redis_store = None
+    shared_lock = SharedDataLock()
+
+
+def export_records() -> dict:
+    """次数记录的统一视图（与存储后端无关，格式同 records.json）。"""
+    if redis_store is not None:
+        return redis_store.export_records()
+    return records
+
+
+async def expire_swap_requests(now: float, today: str) -> int:
+    """
+    批量清理到期的交换请求：按群分组，每群一次落盘，次数记录整体一次落盘。
+    返还规则与“自动取消”一致：仅返还发起者当天的交换次数（零点过期时次数本就已重置）。
+    锁顺序：records_lock -> 各群交换请求锁（按 gid 排序），与 GroupTransaction 一致；
+    跨进程模式下同时持有对应的锁文件，并先重新加载其他进程改写过的数据。
+    """
+    due = swap_store.pop_due(now)
+    if not due:
+        return 0
+    by_gid: dict[str, list[tuple[str, float]]] = {}
+    for gid, uid, expires_at in due:
+        by_gid.setdefault(gid, []).append((uid, expires_at))
+
+    expired = 0
+    records_dirty = False
+    async with records_lock, shared_lock.hold("records"):
+        refresh_records()
+        for gid in sorted(by_gid):
+            async with swap_store.lock(gid), shared_lock.hold(f"swap-{gid}"):
+                swap_store.refresh(gid)
+                removed = False
+                for uid, expires_at in by_gid[gid]:
+                    rec = swap_store.get(gid, uid)
+                    # 惰性删除：请求已被处理/重新发起（expires_at 不同）则跳过
+                    if rec is None or rec.get("expires_at") != expires_at:
+                        continue
+                    swap_store.pop(gid, uid)
+                    removed = True
+                    expired += 1
+                    if redis_store is not None:
+                        redis_store.refund_count("swap", gid, uid, today)
+                        continue
+                    grp_limit = records["swap"].get(gid, {})
+                    rec_lim = grp_limit.get(uid)
+                    if isinstance(rec_lim, dict) and rec_lim.get("date") == today and int(rec_lim.get("count", 0) or 0) > 0:
+                        rec_lim["count"] = int(rec_lim.get("count", 0)) - 1
+                        records_dirty = True
+                if removed:
+                    swap_store.save(gid)
+        if records_dirty:
+            save_records()
+    metrics.inc("swap_requests_expired", expired)
+    return expired
+
+
+# ==================== 图鉴 ====================
+
+def encode_bitset(bits: int) -> str:
+    """
+    位图编码为短字符串（base64）：稠密时存原始字节（前缀 b），
+    稀疏时存序号差值的 varint（前缀 s），取较短者；空集为 ""。
+    """
+    if not bits:
+        return ""
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    if bits.bit_count() * 3 < len(raw):
+        out = bytearray()
+        prev = -1
+        for idx in iter_bits(bits):
+            d = idx - prev
+            prev = idx
+            while d >= 0x80:
+                out.append(d & 0x7F | 0x80)
+                d >>= 7
+            out.append(d)
+        if len(out) < len(raw):
+            return "s" + base64.b64encode(out).decode("ascii")
+    return "b" + base64.b64encode(raw).decode("ascii")
+
+
+def decode_bitset(text: object) -> int:
+    """encode_bitset 的逆运算；无法解析时按空集处理。"""
+    if not isinstance(text, str) or len(text) < 2:
+        return 0
+    try:
+        payload = base64.b64decode(text[1:])
+    except ValueError:
+        return 0
+    if text[0] == "b":
+        return int.from_bytes(payload, "little")
+    if text[0] != "s":
+        return 0
+    marks: list[int] = []
+    idx, d, shift = -1, 0, 0
+    for byte in payload:
+        d |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
             continue
-        valid = {uid: rec for uid, rec in reqs.items() if isinstance(rec, dict) and rec.get("date") == today}
-        if valid:
-            cleaned[gid] = valid
-    
-    swap_requests.clear()
-    swap_requests.update(cleaned)
-    if raw != cleaned:
-        save_json(SWAP_REQUESTS_FILE, cleaned)
+        idx += d
+        marks.append(idx)
+        d, shift = 0, 0
+    return bitset_from(marks)
+
+
+def bitset_from(indexes: list[int]) -> int:
+    """由序号列表构造位图（一次性填充字节，避免逐位对大整数做或运算）。"""
+    if not indexes:
+        return 0
+    buf = bytearray(max(indexes) // 8 + 1)
+    for i in indexes:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def iter_bits(bits: int):
+    """按从小到大产出位图中的序号。"""
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for i, byte in enumerate(raw):
+        while byte:
+            low = byte & -byte
+            yield i * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def wife_source(img: str) -> str:
+    """图片所属作品（出处）；文件名不带出处时为“其他”。"""
+    name = os.path.splitext(img)[0].split("/")[-1]
+    return name.split("!", 1)[0] if "!" in name else "其他"
 
 
-def save_swap_requests():
-    """保存交换请求"""
-    save_json(SWAP_REQUESTS_FILE, swap_requests)
+class CatalogIndex:
+    """
+    图库的稳定编号（图片名 -> 序号），图鉴位图按序号记录：
+    - 只追加，不复用、不重排：图片从图库移除后序号保留，新图片追加在末尾
+    - 文件后端存为 CATALOG_INDEX_FILE（{"names": [...]}，位置即序号）；Redis 后端为列表 <前缀>:catalog（WATCH 追加）
+    - 图库刷新时 sync() 为新图片编号；查不到的图片先重新读取一次（可能是其他进程/节点刚追加的）
+    - 序号 -> 作品的对照表随图库列表缓存，用于计算各作品的收集进度
+    - 编号文件损坏时不隔离、不重新编号（否则全部已存的位图都会指向别的图片）：
+      记下 error 并停用图鉴（不编号、不记录、不导出编号），等文件修复或从备份恢复后重载插件
+    """
+
+    def __init__(self):
+        self.names: list[str] = []
+        self._index: dict[str, int] = {}
+        self.error: str | None = None
+        # (图库列表, 序号 -> 作品编号, 作品名, 各作品图片数)
+        self._sources: tuple[list[str], array, list[str], list[int]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def clear(self) -> None:
+        self._set([])
+        self._sources = None
+        self.error = None
+
+    def _set(self, names: list[str]) -> None:
+        self.names = []
+        self._index = {}
+        self._extend(names)
+
+    def _extend(self, names: list[str]) -> None:
+        for name in names:
+            if name not in self._index:
+                self._index[name] = len(self.names)
+                self.names.append(name)
+
+    def load(self) -> None:
+        if redis_store is not None:
+            self._set(redis_store.catalog_names())
+            return
+        version = shared_lock.version(CATALOG_INDEX_FILE)
+        raw, err = decode_data_payload(read_file_bytes(CATALOG_INDEX_FILE))
+        shared_lock.note(CATALOG_INDEX_FILE, version)
+        if err is not None:
+            if self.error is None:
+                logger.error(
+                    f"[animewife] 图库编号文件 {CATALOG_INDEX_FILE} 损坏（{err}），图鉴已停用；"
+                    "请修复该文件或从备份恢复后重载插件"
+                )
+            self.error = err
+            return
+        self.error = None
+        names = raw.get("names")
+        self._set([n for n in names if isinstance(n, str)] if isinstance(names, list) else [])
+
+    def refresh(self) -> None:
+        """其他进程/节点追加过编号则读入（Redis 只读新增的部分）。"""
+        if redis_store is not None:
+            self._extend(redis_store.catalog_names(len(self.names)))
+        elif shared_lock.changed(CATALOG_INDEX_FILE):
+            self.load()
+
+    def index_of(self, img: str) -> int | None:
+        if self.error is not None:
+            return None
+        idx = self._index.get(img)
+        if idx is None and isinstance(img, str) and img and not img.startswith(MEMBER_ID_PREFIX):
+            self.refresh()
+            idx = self._index.get(img)
+        return idx
+
+    async def sync(self, imgs: list[str]) -> int:
+        """为图库中尚未编号的图片追加编号，返回新增数量（编号文件损坏时不编号）。"""
+        if self.error is not None or all(x in self._index for x in imgs):
+            return 0
+        async with catalog_lock, shared_lock.hold("catalog"):
+            self.refresh()
+            new = [x for x in dict.fromkeys(imgs) if x not in self._index]
+            if self.error is not None or not new:
+                return 0
+            if redis_store is not None:
+                self._extend(redis_store.catalog_extend(len(self.names), new))
+            else:
+                self._extend(new)
+                save_json(CATALOG_INDEX_FILE, {"names": self.names})
+        metrics.inc("catalog_indexed", len(new))
+        return len(new)
+
+    def remap_table(self, names: list[str]) -> list[int] | None:
+        """另一份编号（位置即序号）到本地序号的映射表；两者一致时返回 None。需先 sync(names)。"""
+        table = [self._index[n] for n in names]
+        if all(i == j for i, j in enumerate(table)):
+            return None
+        return table
+
+    def completion(self, bits: int, catalog: list[str]) -> dict[str, tuple[int, int]]:
+        """
+        位图在当前图库中按作品的收集进度 {作品: (已收集, 图片数)}（只含当前图库中有的作品）。
+        序号 -> 作品的对照表随图库列表缓存；统计只遍历位图中置位的序号。
+        """
+        cached = self._sources
+        if cached is None or cached[0] is not catalog:
+            names: list[str] = []
+            ids: dict[str, int] = {}
+            totals: list[int] = []
+            src_of = array("i", [-1]) * len(self.names)
+            for img in catalog:
+                idx = self._index.get(img)
+                if idx is None or src_of[idx] >= 0:
+                    continue
+                src = wife_source(img)
+                sid = ids.get(src)
+                if sid is None:
+                    sid = ids[src] = len(names)
+                    names.append(src)
+                    totals.append(0)
+                src_of[idx] = sid
+                totals[sid] += 1
+            cached = self._sources = (catalog, src_of, names, totals)
+        _, src_of, names, totals = cached
+        got = [0] * len(names)
+        for idx in iter_bits(bits):
+            if idx < len(src_of) and src_of[idx] >= 0:
+                got[src_of[idx]] += 1
+        return {src: (got[i], totals[i]) for i, src in enumerate(names)}
+
+
+catalog_index = CatalogIndex()  # 图库编号（启动加载时读取）
+
+
+def remap_bitset(bits: int, table: list[int]) -> int:
+    """按序号映射表（旧序号 -> 新序号）换算位图；超出映射表的序号丢弃。"""
+    return bitset_from([table[i] for i in iter_bits(bits) if i < len(table)])
+
+
+def collect_wife(cfg: dict, uid: str, img: str) -> bool:
+    """把 img 记入用户图鉴（未编号的图片，如群成员老婆，不计入），返回是否新收集。"""
+    idx = catalog_index.index_of(img)
+    if idx is None:
+        return False
+    col = cfg.get(COLLECTION_KEY)
+    if not isinstance(col, dict):
+        col = cfg[COLLECTION_KEY] = {}
+    bits = decode_bitset(col.get(uid))
+    if bits >> idx & 1:
+        return False
+    col[uid] = encode_bitset(bits | 1 << idx)
+    return True
+
+
+def user_collection(cfg: dict, uid: str, size: int, today: str) -> int:
+    """用户图鉴位图：已记录的收集历史，并入当前背包与今日老婆（图鉴上线前就持有的老婆）。"""
+    col = cfg.get(COLLECTION_KEY)
+    bits = decode_bitset(col.get(uid)) if isinstance(col, dict) else 0
+    _, items = get_user_backpack(cfg, uid, size)
+    held = _backpack_imgs(items)
+    img = resolve_today_entity(cfg, uid, today, size)[0]
+    if img:
+        held.append(img)
+    for x in held:
+        idx = catalog_index.index_of(x)
+        if idx is not None:
+            bits |= 1 << idx
+    return bits
+
+
+# ==================== 老婆来历 ====================
+
+@dataclass
+class ProvenanceIndex:
+    """某群来历日志的内存索引：图片 -> 记录位置（文件后端为字节偏移，Redis 后端为序号），升序。"""
+    gen: object = None  # 文件后端为日志文件的 inode（压缩重写后变化，索引随之重建）
+    end: int = 0        # 已索引到的位置：文件的字节偏移 / Redis 的累计条数
+    by_img: dict[str, list[int]] = field(default_factory=dict)
+
+
+class ProvenanceLog:
+    """
+    老婆来历：每群一个只追加的日志，记录老婆经牛老婆/交换/发老婆的转移，超过容量时丢弃最旧的记录。
+    - 文件后端：PROVENANCE_DIR/<群号>.jsonl，一行一条；超过 PROVENANCE_MAX_BYTES 时保留较新的约 3/4 原子重写
+    - Redis 后端：<前缀>:prov:<群号> 列表（只保留 PROVENANCE_MAX_ENTRIES 条），累计条数作为记录序号
+    - 查询走内存索引：某群首次查询时建立，之后只读取新追加的部分（其他进程/节点追加的也能读到），
+      再按位置只读取命中的记录，不扫描整个日志
+    追加在群事务提交时进行（持有群锁），同一群的追加与压缩不会交错。
+    """
+
+    def __init__(self, max_groups: int = PROVENANCE_INDEX_GROUPS):
+        self.max_groups = max_groups
+        self._indexes: OrderedDict[str, ProvenanceIndex] = OrderedDict()
+
+    def clear(self) -> None:
+        self._indexes.clear()
+
+    @staticmethod
+    def path(gid: str) -> str:
+        return os.path.join(PROVENANCE_DIR, f"{gid}.jsonl")
+
+    def append(self, gid: str, entries: list[dict]) -> None:
+        lines = [json.dumps(e, ensure_ascii=False, separators=(",", ":")) for e in entries]
+        if redis_store is not None:
+            redis_store.provenance_append(gid, lines, PROVENANCE_MAX_ENTRIES)
+            return
+        payload = "".join(line + "\n" for line in lines).encode("utf-8")
+        os.makedirs(PROVENANCE_DIR, exist_ok=True)
+        path = self.path(gid)
+        with open(path, "ab") as f:
+            f.write(payload)
+            size = f.tell()
+        metrics.inc("file_writes")
+        metrics.inc("bytes_written", len(payload))
+        if size > PROVENANCE_MAX_BYTES:
+            self._compact(gid, path, size)
+
+    def _compact(self, gid: str, path: str, size: int) -> None:
+        """只保留较新的约 3/4 容量的记录（从整行开始），原子重写。"""
+        start = size - PROVENANCE_MAX_BYTES * 3 // 4
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        write_file_atomic(path, data[data.find(b"\n") + 1:])
+        self._indexes.pop(gid, None)
+        metrics.inc("provenance_compactions")
+
+    @staticmethod
+    def _add(index: ProvenanceIndex, pos: int, line: bytes | str) -> None:
+        try:
+            img = json.loads(line).get("img")
+        except (ValueError, AttributeError):
+            return
+        if isinstance(img, str) and img:
+            index.by_img.setdefault(img, []).append(pos)
+
+    def _remember(self, gid: str, index: ProvenanceIndex) -> None:
+        self._indexes[gid] = index
+        self._indexes.move_to_end(gid)
+        while len(self._indexes) > self.max_groups:
+            self._indexes.popitem(last=False)
+
+    def _sync_file(self, gid: str, f) -> ProvenanceIndex:
+        """用已打开的日志文件更新索引：文件被重写过则重建，否则只索引新追加的完整行。"""
+        st = os.fstat(f.fileno())
+        index = self._indexes.get(gid)
+        if index is None or index.gen != st.st_ino or st.st_size < index.end:
+            index = ProvenanceIndex(gen=st.st_ino)
+        if st.st_size > index.end:
+            f.seek(index.end)
+            data = f.read(st.st_size - index.end)
+            data = data[: data.rfind(b"\n") + 1]  # 其他进程正在写的半行留到下次
+            pos = index.end
+            for line in data.splitlines(keepends=True):
+                self._add(index, pos, line)
+                pos += len(line)
+            index.end = pos
+        self._remember(gid, index)
+        return index
+
+    def _sync_redis(self, gid: str) -> ProvenanceIndex:
+        index = self._indexes.get(gid) or ProvenanceIndex()
+        total, lines = redis_store.provenance_tail(gid, index.end)
+        if total < index.end:  # 日志被清空过（如导入覆盖），重建
+            index = ProvenanceIndex()
+            total, lines = redis_store.provenance_tail(gid, 0)
+        first = total - len(lines) + 1
+        for i, line in enumerate(lines):
+            self._add(index, first + i, line)
+        index.end = total
+        self._remember(gid, index)
+        return index
+
+    def entries(self, gid: str, img: str) -> list[dict]:
+        """img 在本群的全部转移记录（从旧到新），只读取索引命中的记录。"""
+        if redis_store is not None:
+            index = self._sync_redis(gid)
+            positions = index.by_img.get(img) or []
+            lines = redis_store.provenance_read(gid, positions) if positions else []
+            if None in lines:
+                # 已被裁剪的记录不会再出现，从索引中去掉
+                index.by_img[img] = [p for p, line in zip(positions, lines) if line is not None]
+        else:
+            try:
+                f = open(self.path(gid), "rb")
+            except FileNotFoundError:
+                return []
+            with f:
+                positions = self._sync_file(gid, f).by_img.get(img) or []
+                lines = []
+                for pos in positions:
+                    f.seek(pos)
+                    lines.append(f.readline())
+        out: list[dict] = []
+        for line in lines:
+            try:
+                entry = json.loads(line) if line else None
+            except ValueError:
+                continue
+            if isinstance(entry, dict):
+                out.append(entry)
+        return out
+
+
+provenance = ProvenanceLog()
+
+
+def provenance_chain(entries: list[dict], uid: str, limit: int = PROVENANCE_CHAIN_MAX) -> list[dict]:
+    """
+    从当前持有者 uid 往前追溯转手链（从新到旧）：找最近一条转给当前持有者的记录，
+    再从它的来源继续往前，直到来源为空（管理员发放）或达到 limit。
+    """
+    chain: list[dict] = []
+    holder = uid
+    for entry in reversed(entries):
+        if entry.get("to") != holder:
+            continue
+        chain.append(entry)
+        holder = entry.get("from")
+        if not holder or len(chain) >= limit:
+            break
+    return chain
+
+
+def format_provenance_entry(cfg: dict, entry: dict) -> str:
+    ts = entry.get("t")
+    when = (datetime.utcfromtimestamp(ts) + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M") if isinstance(ts, (int, float)) else "时间未知"
+    to = get_cfg_nick(cfg, str(entry.get("to")), str(entry.get("to")))
+    src = entry.get("from")
+    src = get_cfg_nick(cfg, str(src), str(src)) if src else None
+    via = entry.get("via")
+    if via == "ntr":
+        return f"{when} {to} 从 {src} 那里牛走"
+    if via == "swap":
+        return f"{when} {to} 与 {src} 交换得到"
+    by = entry.get("by")
+    by = get_cfg_nick(cfg, str(by), str(by)) if by else "管理员"
+    return f"{when} {by} 发给 {to}"
+
+
+# ==================== 事务（工作单元） ====================
+
+@dataclass
+class GroupSnapshot:
+    """事务结束时的群配置及其版本号：同一命令的下一阶段在版本未变时直接复用，不必重新加载与解析。"""
+    version: object
+    cfg: dict
+    base: dict | None = None  # Redis 后端的字段基线
+
+
+class GroupTransaction:
+    """
+    群组工作单元：按固定顺序（群配置锁 -> 记录锁 -> 交换请求锁）持锁，
+    在内存中修改群配置 / 次数记录 / 交换请求，退出时每类数据至多落盘一次。
+    - 块内抛出异常或调用 rollback()：丢弃全部内存修改，不写盘
+    - 提交失败（StorageConflict、写盘 OSError 等）：同样恢复内存中的次数记录与交换请求后重新抛出；
+      文件后端按 群配置 -> records.json -> 交换请求 的顺序写入，失败前已写入的文件不会撤销
+      （例如 save_records 失败时群配置文件已是新内容）；Redis 后端的群配置与交换请求在同一事务内写入，不会只写入一半
+    - 群配置懒加载：只访问次数/交换请求时不读群文件
+    - 跨进程模式：持有进程内锁后再按同样顺序持有锁文件，并重新加载其他进程改写过的数据
+    - Redis 后端：次数直接用原子计数器增减（回滚时反向补偿），不持有全局记录锁；
+      群配置与交换请求在同一个 MULTI 中提交，并核对两者读取时的版本号，被其他节点改写过则回滚并抛 StorageConflict
+    - reuse：上一阶段 snapshot() 的结果；群配置版本未变时直接复用（reused 为 True），
+      否则重新加载，调用方需重新解析
+    - 群配置当天首次加载时做一致性修复（见 ConsistencyRepairer），修复内容在 repairs 中，随本次提交写回
+    - log_transfer 记录的老婆转移在提交成功后追加到来历日志，回滚时丢弃
+    """
+
+    def __init__(
+        self, gid: str, today: str, *, records: bool = False, swaps: bool = False,
+        reuse: GroupSnapshot | None = None,
+    ):
+        self.gid = str(gid)
+        self.today = today
+        self._use_records = records
+        self._use_swaps = swaps
+        self._reuse = reuse
+        self._version: object = None
+        self.reused = False
+        self.repairs: list[tuple[str, str]] = []
+        self._locks: list[asyncio.Lock] = []
+        self._file_locks: list[str] = []
+        self._cfg: dict | None = None
+        self._cfg_base: dict | None = None
+        self._cfg_dirty = False
+        self._records_snapshot: dict[str, object] = {}
+        self._swaps_snapshot: dict | None = None
+        self._swaps_touched = False
+        self._rolled_back = False
+        # Redis 后端：已生效的计数增减 {(kind, uid): delta} 与被清空的计数 {(kind, uid): 原值}
+        self._count_deltas: dict[tuple[str, str], int] = {}
+        self._count_cleared: dict[tuple[str, str], int] = {}
+        self._transfers: list[dict] = []
+
+    async def __aenter__(self) -> "GroupTransaction":
+        # Redis 后端的次数是原子计数器，不需要全局记录锁
+        use_records_lock = self._use_records and redis_store is None
+        locks = [get_config_lock(self.gid)]
+        if use_records_lock:
+            locks.append(records_lock)
+        if self._use_swaps:
+            locks.append(swap_store.lock(self.gid))
+        try:
+            for lock in locks:
+                await lock.acquire()
+                self._locks.append(lock)
+            if shared_lock.enabled:
+                names = [f"group-{self.gid}"]
+                if use_records_lock:
+                    names.append("records")
+                if self._use_swaps:
+                    names.append(f"swap-{self.gid}")
+                for name in names:
+                    await shared_lock.acquire(name)
+                    self._file_locks.append(name)
+                # 群配置的版本在 load_group_config 中检查
+                if self._use_records:
+                    refresh_records()
+                if self._use_swaps:
+                    swap_store.refresh(self.gid)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if exc_type is not None or self._rolled_back:
+                self._restore()
+            else:
+                try:
+                    self._commit()
+                except Exception:
+                    self._restore()
+                    raise
+        finally:
+            self._release()
+        return False
+
+    def _release(self) -> None:
+        while self._file_locks:
+            shared_lock.release(self._file_locks.pop())
+        while self._locks:
+            self._locks.pop().release()
+
+    # ---------- 群配置 ----------
+
+    @property
+    def cfg(self) -> dict:
+        if self._cfg is None:
+            reuse, self._reuse = self._reuse, None
+            if reuse is not None:
+                if group_version(self.gid) == reuse.version:
+                    metrics.inc("group_state_reuse", result="hit")
+                    self._cfg, self._cfg_base, self._version = reuse.cfg, reuse.base, reuse.version
+                    self.reused = True
+                    return self._cfg
+                metrics.inc("group_state_reuse", result="conflict")
+            if redis_store is not None:
+                self._cfg, self._cfg_base = redis_store.load_group(self.gid)
+                self._version = self._cfg_base["version"]
+            else:
+                self._cfg = load_group_config(self.gid)
+                self._version = group_version(self.gid)
+            if repairer.needs_check(self.gid, self.today):
+                self.repairs = repairer.check(self.gid, self._cfg, self.today)
+                if self.repairs:
+                    self._cfg_dirty = True
+        return self._cfg
+
+    def snapshot(self) -> GroupSnapshot | None:
+        """事务退出后调用：已提交的群配置及其版本号；未读取群配置或已回滚时为 None。"""
+        if self._cfg is None or self._rolled_back:
+            return None
+        return GroupSnapshot(self._version, self._cfg, self._cfg_base)
+
+    def mark_dirty(self) -> None:
+        """标记群配置已修改，提交时落盘。"""
+        self._cfg_dirty = True
+
+    def rollback(self) -> None:
+        """放弃本事务的全部修改（退出时不写盘）。"""
+        self._rolled_back = True
+
+    # ---------- 次数记录 ----------
+
+    def _require_records(self) -> None:
+        if not self._use_records:
+            raise RuntimeError("GroupTransaction opened without records=True")
+
+    def _records_group(self, kind: str) -> dict:
+        self._require_records()
+        if kind not in self._records_snapshot:
+            grp = records[kind].get(self.gid)
+            self._records_snapshot[kind] = copy.deepcopy(grp)
+        return records[kind].setdefault(self.gid, {})
+
+    def _add_count(self, kind: str, uid: str, delta: int) -> int:
+        value = redis_store.add_count(kind, self.gid, uid, self.today, delta)
+        self._count_deltas[(kind, uid)] = self._count_deltas.get((kind, uid), 0) + delta
+        return value
+
+    def count(self, kind: str, uid: str) -> int:
+        """读取今日已用次数。"""
+        if redis_store is not None:
+            return redis_store.get_count(kind, self.gid, str(uid), self.today)
+        rec = records[kind].get(self.gid, {}).get(str(uid))
+        if isinstance(rec, dict) and rec.get("date") == self.today:
+            return int(rec.get("count", 0) or 0)
+        return 0
+
+    def consume(self, kind: str, uid: str, limit: int) -> tuple[bool, int]:
+        """原子 check+increment：未达上限则 +1，返回 (是否成功, 当前次数)。"""
+        if redis_store is not None:
+            # 先 INCR 再判断，超限时减回：多个节点并发也不会超过上限
+            self._require_records()
+            used = self._add_count(kind, str(uid), 1)
+            if used > limit:
+                return False, self._add_count(kind, str(uid), -1)
+            return True, used
+        used = self.count(kind, uid)
+        if used >= limit:
+            return False, used
+        self._records_group(kind)[str(uid)] = {"date": self.today, "count": used + 1}
+        return True, used + 1
+
+    def refund(self, kind: str, uid: str) -> bool:
+        """返还一次今日次数（仅当今日有记录且次数 > 0）。"""
+        if redis_store is not None:
+            self._require_records()
+            if not redis_store.refund_count(kind, self.gid, str(uid), self.today):
+                return False
+            self._count_deltas[(kind, str(uid))] = self._count_deltas.get((kind, str(uid)), 0) - 1
+            return True
+        used = self.count(kind, uid)
+        if used <= 0:
+            return False
+        self._records_group(kind)[str(uid)] = {"date": self.today, "count": used - 1}
+        return True
+
+    def clear_count(self, kind: str, uid: str) -> bool:
+        """清空某用户的次数记录。"""
+        if redis_store is not None:
+            self._require_records()
+            old = redis_store.clear_count(kind, self.gid, str(uid), self.today)
+            if old is None:
+                return False
+            self._count_cleared.setdefault((kind, str(uid)), old)
+            return True
+        if str(uid) not in records[kind].get(self.gid, {}):
+            return False
+        del self._records_group(kind)[str(uid)]
+        return True
+
+    # ---------- 交换请求 ----------
+
+    def _touch_swaps(self) -> None:
+        if not self._use_swaps:
+            raise RuntimeError("GroupTransaction opened without swaps=True")
+        if not self._swaps_touched:
+            self._swaps_snapshot = swap_store.group(self.gid)
+            self._swaps_touched = True
+
+    def get_swap(self, uid: str) -> dict | None:
+        rec = swap_store.get(self.gid, uid)
+        return rec if isinstance(rec, dict) else None
+
+    def put_swap(self, uid: str, rec: dict) -> None:
+        self._touch_swaps()
+        swap_store.put(self.gid, uid, rec)
+
+    def pop_swap(self, uid: str) -> dict | None:
+        if swap_store.get(self.gid, uid) is None:
+            return None
+        self._touch_swaps()
+        return swap_store.pop(self.gid, uid)
+
+    def cancel_swaps_for(self, user_ids: list) -> list[str]:
+        """取消与指定用户相关（发起或被请求）的交换请求，并返还发起者的交换次数。"""
+        to_cancel = swap_store.related(self.gid, user_ids)
+        for req_uid in to_cancel:
+            self.pop_swap(req_uid)
+            if self._use_records:
+                self.refund("swap", req_uid)
+        return to_cancel
+
+    # ---------- 老婆来历 ----------
+
+    def log_transfer(self, img: str, from_uid: str | None, to_uid: str, via: str, *, by: str | None = None) -> None:
+        """记录一次老婆转移（via: ntr / swap / send；发放时 from_uid 为 None、by 为发放的管理员）。"""
+        entry = {"t": int(time.time()), "img": normalize_img_id(img) or img, "from": from_uid, "to": to_uid, "via": via}
+        if by:
+            entry["by"] = by
+        self._transfers.append(entry)
+
+    # ---------- 提交 / 回滚 ----------
+
+    def _commit(self) -> None:
+        cfg_dirty = self._cfg is not None and self._cfg_dirty
+        if redis_store is not None:
+            # 群配置与交换请求在同一个 MULTI 中写入：任一版本号冲突则两者都不写（次数是计数器，已即时生效）
+            swaps = swap_store.redis_pending(self.gid) if self._swaps_touched else None
+            base, swaps_version = redis_store.commit_group(
+                self.gid, cfg=self._cfg if cfg_dirty else None, base=self._cfg_base, swaps=swaps,
+            )
+            if cfg_dirty:
+                self._cfg_base = base
+                self._version = base["version"]
+            if swaps is not None:
+                swap_store.redis_saved(self.gid, swaps_version)
+        else:
+            if cfg_dirty:
+                save_group_config(self.gid, self._cfg)
+                self._version = group_version(self.gid)
+            if self._records_snapshot:
+                save_records()
+            if self._swaps_touched:
+                swap_store.save(self.gid)
+        if cfg_dirty and self.repairs:
+            repairer.committed(self.gid, self.today, self.repairs)
+        if self._transfers:
+            transfers, self._transfers = self._transfers, []
+            try:
+                provenance.append(self.gid, transfers)
+            except Exception as e:
+                # 来历日志只是辅助记录：写入失败不影响已经提交的数据
+                logger.warning(f"[animewife] 老婆来历写入失败（群 {self.gid}）：{e}")
+
+    def _restore(self) -> None:
+        # Redis 计数器已经生效，按相反方向补偿（清空的计数加回原值）
+        for (kind, uid), delta in self._count_deltas.items():
+            if delta:
+                redis_store.add_count(kind, self.gid, uid, self.today, -delta)
+        for (kind, uid), old in self._count_cleared.items():
+            redis_store.add_count(kind, self.gid, uid, self.today, old)
+        self._count_deltas = {}
+        self._count_cleared = {}
+        self._transfers = []
+        for kind, snap in self._records_snapshot.items():
+            if snap is None:
+                records[kind].pop(self.gid, None)
+            else:
+                records[kind][self.gid] = snap
+        if self._swaps_touched:
+            swap_store.replace_group(self.gid, self._swaps_snapshot)
+        self._records_snapshot = {}
+        self._swaps_touched = False
+        self._cfg = None
+        self.repairs = []
+
+
+def format_swap_cancel_msg(cancelled: list[str]) -> str | None:
+    """交换请求被自动取消时的提示。"""
+    if not cancelled:
+        return None
+    return f"已自动取消 {len(cancelled)} 条相关的交换请求并返还次数~"
+
+
+# ==================== 后台修复 ====================
+
+class ConsistencyRepairer:
+    """
+    今日老婆记录的一致性修复（旧格式、槽位与临时态重复存储、悬挂绑定）：
+    - 每个群每天在首次加载时检查一次（repair_group_config）；解析路径 resolve_today_entity 只做查询
+    - 事务加载时直接在事务内修复，随本次提交写回；提交成功后才记为已检查
+    - 只读命令在私有副本上检查，发现问题则把群交给后台任务，由其开事务加载（即触发修复）并写回
+    """
+
+    def __init__(self):
+        self.backpack_size = 7  # 插件初始化时按配置 backpack_size 设置
+        self._checked: dict[str, str] = {}  # {gid: 已检查的日期}
+        self._pending: set[str] = set()
+        self.wakeup = asyncio.Event()
+
+    def needs_check(self, gid: str, today: str) -> bool:
+        return self._checked.get(gid) != today
+
+    def check(self, gid: str, cfg: dict, today: str) -> list[tuple[str, str]]:
+        """检查并就地修复 cfg，返回 [(uid, 修复说明)]；没有问题时直接记为已检查。"""
+        fixes = repair_group_config(cfg, today, self.backpack_size)
+        if not fixes:
+            self._checked[gid] = today
+        return fixes
+
+    def committed(self, gid: str, today: str, fixes: list[tuple[str, str]]) -> None:
+        """修复随事务提交后调用：记为已检查并记录修复内容。"""
+        self._checked[gid] = today
+        metrics.inc("repairs_applied", len(fixes))
+        detail = "；".join(f"{uid}：{fix}" for uid, fix in fixes[:20])
+        more = f" 等 {len(fixes)} 条" if len(fixes) > 20 else ""
+        logger.info(f"[animewife] 群 {gid} 修复今日老婆记录 {detail}{more}")
+
+    def forget(self, gid: str) -> None:
+        """群数据被整体替换（导入）：下次加载时重新检查。"""
+        self._checked.pop(gid, None)
+
+    def request(self, gid: str) -> None:
+        """只读命令发现问题：交给后台任务修复（同一群合并）。"""
+        if gid not in self._pending:
+            self._pending.add(gid)
+            metrics.inc("repairs_queued")
+        self.wakeup.set()
+
+    def take(self) -> list[str]:
+        pending, self._pending = self._pending, set()
+        return sorted(pending)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def clear(self) -> None:
+        self._checked.clear()
+        self._pending.clear()
+        self.wakeup = asyncio.Event()
+
+
+repairer = ConsistencyRepairer()
+
+
+async def run_repairs(gids: list[str], today: str) -> int:
+    """后台修复：逐群开事务加载群配置（加载时检查并修复，随提交写回），返回修复的记录数。"""
+    fixed = 0
+    for gid in gids:
+        async with GroupTransaction(gid, today) as txn:
+            txn.cfg
+            fixed += len(txn.repairs)
+    return fixed
+
+
+# ==================== 启动加载 ====================
+
+# 数据不在导入时加载：首次使用（或插件启动后的后台任务）时在线程中加载，不阻塞 AstrBot 启动
+state_loaded = False
+_state_task: asyncio.Task | None = None
+_preload_task: asyncio.Task | None = None
+
+# CONFIG_DIR 下不是群配置的数据文件
+NON_GROUP_FILES = {
+    os.path.basename(RECORDS_FILE),
+    os.path.basename(SWAP_REQUESTS_FILE),
+    os.path.basename(NTR_STATUS_FILE),
+    os.path.basename(CATALOG_INDEX_FILE),
+}
+
+
+def _load_state_sync() -> None:
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    os.makedirs(IMG_DIR, exist_ok=True)
+    load_records()
+    # 此时后台清理任务尚未等待 wakeup（见 ensure_state_loaded），在线程中 put/set 是安全的
+    swap_store.load(get_today())
+    load_ntr_statuses()
+    catalog_index.load()
+
+
+async def _load_state() -> None:
+    global state_loaded
+    with metrics.timer("storage_latency_ms", op="startup_load"):
+        await asyncio.to_thread(_load_state_sync)
+    state_loaded = True
+
+
+async def _preload_groups(limit: int) -> None:
+    try:
+        await preload_recent_groups(limit)
+    except Exception:
+        # 预加载只是优化，失败时按需加载即可
+        pass
 
 
-# 初始加载所有数据
-load_records()
-load_swap_requests()
-load_ntr_statuses()
+def start_state_loading(preload: int = 0) -> asyncio.Task:
+    """
+    启动（或返回已启动的）后台加载任务；需在事件循环中调用。
+    preload > 0 时同时并发预加载最近活跃的群配置（不阻塞命令处理）。
+    """
+    global _state_task, _preload_task
+    # 上次加载失败则重新加载
+    if _state_task is None or (_state_task.done() and not state_loaded):
+        loop = asyncio.get_running_loop()
+        _state_task = loop.create_task(_load_state())
+        if preload > 0 and _preload_task is None:
+            _preload_task = loop.create_task(_preload_groups(preload))
+    return _state_task
+
+
+async def ensure_state_loaded() -> None:
+    """等待记录/交换请求/NTR 状态加载完成（加载完成后只是一次布尔判断）。"""
+    if state_loaded:
+        return
+    # 上次加载失败时 start_state_loading 会重新发起加载；
+    # shield：单个命令被取消不应取消共享的加载任务
+    await asyncio.shield(start_state_loading())
+
+
+async def wait_state_loaded() -> None:
+    """后台任务用：等到数据加载成功为止（加载失败时隔一段时间重试，而不是让任务退出）。"""
+    while True:
+        try:
+            await ensure_state_loaded()
+            return
+        except Exception:
+            await asyncio.sleep(STATE_LOAD_RETRY_DELAY)
+
+
+async def preload_recent_groups(limit: int) -> int:
+    """按文件修改时间挑选最近活跃的群，并发读取其配置放入缓存；返回预加载的群数。"""
+    limit = min(int(limit), group_cache.capacity)
+    # Redis 后端不使用本地群配置缓存
+    if limit <= 0 or redis_store is not None:
+        return 0
+
+    def scan() -> list[str]:
+        entries = []
+        with os.scandir(CONFIG_DIR) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith(".json") or name in NON_GROUP_FILES or not entry.is_file():
+                    continue
+                entries.append((entry.stat().st_mtime, name[: -len(".json")]))
+        return [gid for _, gid in heapq.nlargest(limit, entries)]
+
+    gids = await asyncio.to_thread(scan)
+
+    async def one(gid: str) -> bool:
+        payload = await asyncio.to_thread(read_file_bytes, os.path.join(CONFIG_DIR, f"{gid}.json"))
+        # 损坏的文件不进缓存，留给 load_group_config 隔离
+        if decode_data_payload(payload)[1] is not None:
+            return False
+        return group_cache.fill(gid, payload)
+
+    loaded = sum(await asyncio.gather(*(one(g) for g in gids)))
+    metrics.inc("group_cache_preloaded", loaded)
+    return loaded
+
+
+# ==================== 数据体检 ====================
+
+def scan_data_files(paths: list[str]) -> list[dict]:
+    """
+    校验一批数据文件，返回逐文件报告 {file, size, parse_ms, ok, error}。
+    在进程池中运行（模块级函数，可被 pickle），只读不写。
+    """
+    reports = []
+    for path in paths:
+        payload = read_file_bytes(path)
+        t0 = time.perf_counter()
+        _, err = decode_data_payload(payload)
+        reports.append({
+            "file": os.path.basename(path),
+            "size": len(payload),
+            "parse_ms": round((time.perf_counter() - t0) * 1000.0, 3),
+            "ok": err is None,
+            "error": err,
+        })
+    return reports
+
+
+def _data_file_lock(name: str):
+    """隔离某个数据文件前需要持有的锁（与正常读写该文件时相同）：(进程内锁, 跨进程锁文件名)。"""
+    if name == os.path.basename(RECORDS_FILE):
+        return records_lock, "records"
+    if name == os.path.basename(NTR_STATUS_FILE):
+        return ntr_lock, "ntr"
+    if name == os.path.basename(CATALOG_INDEX_FILE):
+        return catalog_lock, "catalog"
+    gid = name[: -len(".json")]
+    return get_config_lock(gid), f"group-{gid}"
+
+
+async def run_integrity_scan(workers: int = 0) -> dict:
+    """
+    用进程池并行校验 CONFIG_DIR 下全部 *.json，隔离无法解析的文件，并把逐文件报告写入 INTEGRITY_REPORT_FILE。
+    进程池不可用（受限环境、无法 pickle 等）时退回线程中顺序校验。返回汇总。
+    """
+    t_start = time.perf_counter()
+
+    def list_files() -> list[str]:
+        if not os.path.isdir(CONFIG_DIR):
+            return []
+        with os.scandir(CONFIG_DIR) as it:
+            return sorted(e.path for e in it if e.name.endswith(".json") and e.is_file())
+
+    paths = await asyncio.to_thread(list_files)
+    workers = workers if workers > 0 else min(4, os.cpu_count() or 1)
+    mode = "process"
+    reports: list[dict] = []
+    if paths:
+        # 小文件很多，按批提交以摊薄进程间通信开销
+        batch = max(1, -(-len(paths) // (workers * 4)))
+        batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+        try:
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = await asyncio.gather(*(loop.run_in_executor(pool, scan_data_files, b) for b in batches))
+            reports = [r for chunk in results for r in chunk]
+        except Exception:
+            mode = "thread"
+            reports = await asyncio.to_thread(scan_data_files, paths)
+
+    # 隔离：持有该文件的读写锁并复核（扫描期间文件可能已被正常保存覆盖）
+    quarantined = []
+    for rep in reports:
+        if rep["ok"]:
+            continue
+        name = rep["file"]
+        path = os.path.join(CONFIG_DIR, name)
+        lock, shared_name = _data_file_lock(name)
+        async with lock, shared_lock.hold(shared_name):
+            _, err = decode_data_payload(read_file_bytes(path))
+            if err is None:
+                rep["ok"], rep["error"] = True, None
+                continue
+            if name == os.path.basename(CATALOG_INDEX_FILE):
+                # 图库编号不隔离：移走后会从空表重新编号，已存的图鉴位图全部错位（见 CatalogIndex）
+                rep["quarantined"] = None
+                continue
+            dest = quarantine_file(path, err)
+            group_cache.discard(name[: -len(".json")])
+            bump_group_version(name[: -len(".json")])
+        rep["quarantined"] = dest
+        if dest:
+            quarantined.append(name)
+
+    def write_report() -> None:
+        os.makedirs(os.path.dirname(INTEGRITY_REPORT_FILE), exist_ok=True)
+        with open(INTEGRITY_REPORT_FILE, "w", encoding="utf-8") as f:
+            for rep in reports:
+                f.write(json.dumps(rep, ensure_ascii=False) + "\n")
+
+    await asyncio.to_thread(write_report)
+    elapsed_ms = (time.perf_counter() - t_start) * 1000.0
+    metrics.observe_ms("storage_latency_ms", elapsed_ms, op="integrity_scan")
+    return {
+        "files": len(reports),
+        "bytes": sum(r["size"] for r in reports),
+        "parse_ms": round(sum(r["parse_ms"] for r in reports), 3),
+        "elapsed_ms": round(elapsed_ms, 3),
+        "mode": mode,
+        "workers": workers if mode == "process" else 1,
+        "bad": [r for r in reports if not r["ok"]],
+        "quarantined": quarantined,
+        "slowest": sorted(reports, key=lambda r: -r["parse_ms"])[:5],
+        "largest": sorted(reports, key=lambda r: -r["size"])[:5],
+    }
+
+
+def format_integrity_report(summary: dict) -> str:
+    lines = [
+        f"【数据体检】共 {summary['files']} 个文件，{summary['bytes'] / 1024:.1f} KB，"
+        f"解析合计 {summary['parse_ms']:.1f}ms，耗时 {summary['elapsed_ms']:.0f}ms"
+        f"（{'进程池' if summary['mode'] == 'process' else '线程'} ×{summary['workers']}）",
+    ]
+    if summary["bad"]:
+        lines.append(f"损坏文件 {len(summary['bad'])} 个：")
+        for rep in summary["bad"][:10]:
+            if rep.get("quarantined"):
+                moved = "已隔离"
+            elif rep["file"] == os.path.basename(CATALOG_INDEX_FILE):
+                moved = "保留原处，图鉴已停用"
+            else:
+                moved = "隔离失败"
+            lines.append(f"• {rep['file']}（{moved}）：{rep['error']}")
+    else:
+        lines.append("未发现损坏文件。")
+    if summary["slowest"]:
+        lines.append("解析最慢：" + "，".join(f"{r['file']} {r['parse_ms']:.1f}ms" for r in summary["slowest"]))
+        lines.append("体积最大：" + "，".join(f"{r['file']} {r['size'] / 1024:.1f}KB" for r in summary["largest"]))
+    lines.append(f"逐文件报告：{INTEGRITY_REPORT_FILE}")
+    return "\n".join(lines)
+
+# ==================== 数据导出 / 导入 ====================
+
+def list_group_ids() -> list[str]:
+    """全部有数据的群号（群配置、次数记录或交换请求任一存在即算）。"""
+    gids = set(swap_store.group_ids())
+    if redis_store is not None:
+        gids.update(redis_store.group_ids())
+    else:
+        if os.path.isdir(CONFIG_DIR):
+            with os.scandir(CONFIG_DIR) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.endswith(".json") and name not in NON_GROUP_FILES and entry.is_file():
+                        gids.add(name[: -len(".json")])
+        for grp in records.values():
+            gids.update(grp)
+    return sorted(gids)
+
+
+def open_backup(path: str, mode: str):
+    """按扩展名打开导出文件（.gz 为 gzip 压缩），文本模式、UTF-8。"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+async def export_data(path: str, today: str):
+    """
+    逐群导出全部数据为 JSONL（异步生成器，每导出一个群产出 (已完成, 总数)）。
+    - 第一行为 meta，第二行为图库编号，之后每群一行：群配置、次数记录、交换请求、NTR 开关
+    - 只读：不持有群锁/记录锁/交换请求锁，也不写任何数据，导出期间命令照常处理。
+      群配置取最近一次提交的版本（read_group_snapshot），交换请求取已提交视图，
+      次数记录在导出开始时读取一次已提交的内容；事务中尚未提交的修改不会被导出
+      （Redis 后端的次数是即时生效的计数器，事务中的增减会被读到）
+    - 不是全局一致的快照：各群的读取时刻不同，同一群的配置、次数与交换请求也可能分属先后相邻的提交
+    - 同一时刻只有一个群的数据在内存中；先写临时文件，完成后原子替换
+    - Redis 后端的次数是当天的计数器，导出为当天日期的记录
+    """
+    gids = await asyncio.to_thread(list_group_ids)
+    total = len(gids)
+    async with ntr_lock, shared_lock.hold("ntr"):
+        refresh_ntr_statuses()
+    if redis_store is not None:
+        counts, committed = redis_store.today_counts(today), None
+    else:
+        counts, committed = None, await asyncio.to_thread(committed_records)
+    # 临时文件保留扩展名（决定是否压缩），以点开头，不会被当作导出文件导入
+    tmp = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+    try:
+        with open_backup(tmp, "w") as f:
+            meta = {
+                "type": "meta", "version": EXPORT_FORMAT_VERSION,
+                "exported_at": int(time.time()), "today": today, "groups": total,
+            }
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+            catalog_index.refresh()
+            if catalog_index.error is not None:
+                raise ValueError(f"图库编号文件损坏，无法导出图鉴：{catalog_index.error}")
+            f.write(json.dumps({"type": "catalog", "names": catalog_index.names}, ensure_ascii=False) + "\n")
+            for done, gid in enumerate(gids, 1):
+                if counts is not None:
+                    recs = {
+                        kind: {uid: {"date": today, "count": n} for uid, n in grp[gid].items()}
+                        for kind, grp in counts.items() if gid in grp
+                    }
+                else:
+                    recs = {kind: grp[gid] for kind, grp in committed.items() if isinstance(grp, dict) and grp.get(gid)}
+                line = {
+                    "type": "group", "gid": gid, "config": read_group_snapshot(gid, today), "records": recs,
+                    "swaps": swap_store.committed(gid), "ntr": ntr_statuses.get(gid),
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                yield done, total
+                await asyncio.sleep(0)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def read_backup_lines(path: str):
+    """逐行读取导出文件，产出 (行号, dict)；无法解析的行抛 ValueError。"""
+    with open_backup(path, "r") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"第 {lineno} 行不是有效的 JSON：{e}") from None
+            if not isinstance(item, dict):
+                raise ValueError(f"第 {lineno} 行不是对象")
+            yield lineno, item
+
+
+async def _import_batch(batch: list[dict], today: str) -> None:
+    """导入一批群：群配置与交换请求逐群各一个事务，次数记录与 NTR 开关整批各落盘一次。"""
+    for item in batch:
+        async with GroupTransaction(item["gid"], today, swaps=True) as txn:
+            cfg = txn.cfg
+            cfg.clear()
+            cfg.update(item.get("config") or {})
+            txn.mark_dirty()
+            txn.repairs = []  # 针对旧数据的修复已被覆盖，导入的数据原样写回
+            for uid in list(swap_store.group(item["gid"])):
+                txn.pop_swap(uid)
+            for uid, rec in (item.get("swaps") or {}).items():
+                if isinstance(rec, dict):
+                    txn.put_swap(uid, rec)
+        repairer.forget(item["gid"])  # 导入的数据在下次加载时重新检查
+    if redis_store is not None:
+        # 计数器只有当天的有意义，其余日期的记录跳过
+        for item in batch:
+            for kind, grp in (item.get("records") or {}).items():
+                redis_store.set_counts(kind, item["gid"], today, {
+                    uid: int(rec.get("count", 0) or 0) for uid, rec in grp.items()
+                    if isinstance(rec, dict) and rec.get("date") == today
+                })
+    else:
+        async with records_lock, shared_lock.hold("records"):
+            refresh_records()
+            for item in batch:
+                recs = item.get("records") or {}
+                for kind in records:
+                    if recs.get(kind):
+                        records[kind][item["gid"]] = recs[kind]
+                    else:
+                        records[kind].pop(item["gid"], None)
+            save_records()
+    flags = {item["gid"]: item["ntr"] for item in batch if isinstance(item.get("ntr"), bool)}
+    if flags:
+        async with ntr_lock, shared_lock.hold("ntr"):
+            refresh_ntr_statuses()
+            ntr_statuses.update(flags)
+            save_ntr_statuses()
+
+
+async def import_data(path: str, today: str, *, batch_size: int = 50):
+    """
+    流式导入 export_data 生成的文件（异步生成器，每导入一批产出 (已完成, 总数)）。
+    逐行读取，每 batch_size 个群导入一次；文件中出现的群整体覆盖，未出现的群不受影响。
+    格式错误时抛 ValueError，此前的批次已经生效。
+    """
+    total = 0
+    done = 0
+    remap: list[int] | None = None
+    batch: list[dict] = []
+    for lineno, item in read_backup_lines(path):
+        kind = item.get("type")
+        if kind == "meta":
+            if item.get("version") not in (1, EXPORT_FORMAT_VERSION):
+                raise ValueError(f"不支持的导出格式版本：{item.get('version')}")
+            total = int(item.get("groups") or 0)
+            continue
+        if kind == "catalog":
+            # 导出方的编号与本地不同时，把图鉴位图换算为本地序号
+            names = item.get("names")
+            if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+                raise ValueError(f"第 {lineno} 行不是有效的图库编号")
+            if catalog_index.error is not None:
+                raise ValueError(f"图库编号文件损坏，无法换算图鉴：{catalog_index.error}")
+            await catalog_index.sync(names)
+            remap = catalog_index.remap_table(names)
+            continue
+        if kind != "group" or not str(item.get("gid") or "").isdigit() or not isinstance(item.get("config") or {}, dict):
+            raise ValueError(f"第 {lineno} 行不是有效的群数据")
+        item["gid"] = str(item["gid"])
+        col = (item.get("config") or {}).get(COLLECTION_KEY)
+        if remap is not None and isinstance(col, dict):
+            item["config"][COLLECTION_KEY] = {
+                uid: encode_bitset(remap_bitset(decode_bitset(v), remap)) for uid, v in col.items()
+            }
+        batch.append(item)
+        if len(batch) >= batch_size:
+            await _import_batch(batch, today)
+            done += len(batch)
+            batch = []
+            yield done, max(total, done)
+    if batch:
+        await _import_batch(batch, today)
+        done += len(batch)
+        yield done, max(total, done)
+
 
 # ==================== 主插件类 ====================
 
@@ -841,9 +4011,14 @@ class WifePlugin(Star):
         self.config = config
         self._member_cache: dict[str, tuple[float, list[str]]] = {}
         self._member_cache_lock = asyncio.Lock()
+        self._catalog_cache: tuple[float, list[str]] | None = None
+        self._integrity_lock = asyncio.Lock()
+        self._backup_lock = asyncio.Lock()
         self._init_config()
         self._init_commands()
         self.admins = self.load_admins()
+        self._bg_tasks: list[asyncio.Task] = []
+        self._ensure_background_tasks()
 
     def _init_config(self):
         """初始化配置参数"""
@@ -861,6 +4036,12 @@ class WifePlugin(Star):
             self.backpack_size = max(1, int(self.config.get("backpack_size") or 7))
         except Exception:
             self.backpack_size = 7
+        repairer.backpack_size = self.backpack_size
+        try:
+            self.backpack_page_size = max(1, int(self.config.get("backpack_page_size") or 20))
+        except Exception:
+            self.backpack_page_size = 20
+        self.backpack_forward = bool(self.config.get("backpack_forward") or False)
 
         # 群成员头像注入抽取池（仅影响 /抽老婆 与 /换老婆 的随机抽取）
         self.include_group_members = bool(self.config.get("include_group_members") or False)
@@ -878,6 +4059,66 @@ class WifePlugin(Star):
         except Exception:
             self.group_member_pool_ttl_sec = 600
 
+        # 图库列表缓存时间（秒），0 表示每次都重新读取
+        try:
+            raw_ttl = self.config.get("catalog_cache_ttl_sec")
+            self.catalog_cache_ttl_sec = max(0, int(300 if raw_ttl is None else raw_ttl))
+        except Exception:
+            self.catalog_cache_ttl_sec = 300
+
+        # 指标导出间隔（秒），0 表示不导出
+        try:
+            self.metrics_dump_interval_sec = max(0, int(self.config.get("metrics_dump_interval_sec") or 0))
+        except Exception:
+            self.metrics_dump_interval_sec = 0
+
+        # 群配置缓存容量（群数，0 表示不缓存）与启动时预加载的最近活跃群数
+        try:
+            raw_size = self.config.get("group_cache_size")
+            group_cache.resize(1000 if raw_size is None else max(0, int(raw_size)))
+        except Exception:
+            group_cache.resize(1000)
+        try:
+            raw_preload = self.config.get("preload_recent_groups")
+            self.preload_recent_groups = 100 if raw_preload is None else max(0, int(raw_preload))
+        except Exception:
+            self.preload_recent_groups = 100
+
+        # 随机数种子：为空时使用系统熵；设置后每个群的随机结果可复现
+        rng.reseed(self.config.get("rng_seed"))
+
+        # 存储后端：file（默认，数据目录下的 JSON 文件）或 redis（多个节点共享状态）
+        self.storage_backend = str(self.config.get("storage_backend") or "file").strip().lower()
+        if self.storage_backend == "redis":
+            # 依赖 redis 包；连接参数错误或未安装时让插件加载失败，避免各节点悄悄各用各的本地文件
+            use_redis_backend(
+                make_redis_client(str(self.config.get("redis_url") or "redis://localhost:6379/0")),
+                str(self.config.get("redis_prefix") or "animewife"),
+            )
+        # 跨进程锁（多个进程共享数据目录时开启；仅 POSIX）
+        elif bool(self.config.get("shared_data_lock") or False):
+            shared_lock.enable()
+
+        # 锁竞争分析（默认关闭，关闭时零开销）
+        if bool(self.config.get("lock_profiling") or False):
+            enable_lock_profiling()
+
+        # 命令限流（令牌桶），空字符串表示不限流
+        self.throttle = CommandThrottle(parse_throttle_rules(self.config.get("throttle_rules") or ""))
+
+        # 交换请求有效期（分钟）；0 表示当天有效，零点失效
+        try:
+            self.swap_request_ttl_min = max(0, int(self.config.get("swap_request_ttl_min") or 0))
+        except Exception:
+            self.swap_request_ttl_min = 0
+
+        # 数据体检：启动时是否自动体检、进程池大小（0 表示自动）
+        self.integrity_scan_on_startup = bool(self.config.get("integrity_scan_on_startup") or False)
+        try:
+            self.integrity_scan_workers = max(0, int(self.config.get("integrity_scan_workers") or 0))
+        except Exception:
+            self.integrity_scan_workers = 0
+
     def _init_commands(self):
         """初始化命令映射表"""
         self.commands = {
@@ -896,6 +4137,14 @@ class WifePlugin(Star):
             "同意交换": self.agree_swap_wife,
             "拒绝交换": self.reject_swap_wife,
             "查看交换请求": self.view_swap_requests,
+            "老婆排行": self.show_leaderboard,
+            "我的图鉴": self.show_collection,
+            "谁有老婆": self.show_owners,
+            "老婆来历": self.show_provenance,
+            "老婆统计": self.show_stats,
+            "老婆体检": self.check_data_integrity,
+            "老婆导出": self.export_all_data,
+            "老婆导入": self.import_all_data,
         }
 
     def load_admins(self) -> list:
@@ -919,43 +4168,164 @@ class WifePlugin(Star):
         except Exception:
             return []
 
+    def parse_at_targets(self, event: AstrMessageEvent) -> list[str]:
+        """解析消息中的全部@目标用户（按出现顺序）"""
+        if not event.message_obj or not hasattr(event.message_obj, "message"):
+            return []
+        return [str(comp.qq) for comp in event.message_obj.message if isinstance(comp, At)]
+
     def parse_at_target(self, event: AstrMessageEvent) -> str | None:
         """解析消息中的@目标用户"""
-        if not event.message_obj or not hasattr(event.message_obj, "message"):
+        targets = self.parse_at_targets(event)
+        return targets[0] if targets else None
+
+    def build_context(self, event: AstrMessageEvent) -> CommandContext | None:
+        """从事件构建命令上下文；未命中任何命令时返回 None。"""
+        # 非命令消息占群聊绝大多数：先做廉价的前缀判断，避免解析消息链
+        text = normalize_cmd_text(event.message_str)
+        if not any(text.startswith(cmd) for cmd in self.commands):
             return None
-        for comp in event.message_obj.message:
-            if isinstance(comp, At):
-                return str(comp.qq)
-        return None
+        plain_text = ""
+        if event.message_obj and hasattr(event.message_obj, "message"):
+            plain_text = "".join(
+                seg.text for seg in event.message_obj.message if isinstance(seg, Plain)
+            ).strip()
+        return parse_command(
+            event.message_str,
+            self.commands,
+            gid=str(event.message_obj.group_id),
+            uid=str(event.get_sender_id()),
+            nick=event.get_sender_name(),
+            today=get_today(),
+            at_targets=self.parse_at_targets(event),
+            plain_text=plain_text,
+        )
 
-    def parse_target(self, event: AstrMessageEvent) -> str | None:
+    def parse_target(self, ctx: CommandContext) -> str | None:
         """解析命令目标用户"""
-        target = self.parse_at_target(event)
-        if target:
-            return target
-        
-        msg = normalize_cmd_text(event.message_str)
+        if ctx.at_target:
+            return ctx.at_target
+
         # 兼容“昵称 + 额外参数”的用法，例如：
         # - /牛老婆 昵称 3
         # - /查老婆 昵称
-        for cmd in ("牛老婆", "查老婆"):
-            if msg.startswith(cmd):
-                rest = msg[len(cmd):].strip()
-                if not rest:
-                    return None
-                first = rest.split()[0].strip()
-                # 如果第一个参数是数字，通常是编号参数，不当作昵称匹配
-                if first.isdigit():
-                    return None
-                group_id = str(event.message_obj.group_id)
-                cfg = load_group_config(group_id)
-                for uid, data in cfg.items():
-                    if isinstance(data, list) and len(data) > 2 and data[2] == first:
-                        return uid
-                    if isinstance(data, dict) and data.get("nick") == first:
-                        return uid
+        if ctx.cmd in ("牛老婆", "查老婆"):
+            if not ctx.tokens:
+                return None
+            first = ctx.tokens[0].strip()
+            # 如果第一个参数是数字，通常是编号参数，不当作昵称匹配
+            if first.isdigit():
+                return None
+            cfg = load_group_config(ctx.gid)
+            for uid, data in cfg.items():
+                if isinstance(data, list) and len(data) > 2 and data[2] == first:
+                    return uid
+                if isinstance(data, dict) and data.get("nick") == first:
+                    return uid
         return None
 
+    # ==================== 后台任务 ====================
+
+    def _ensure_background_tasks(self) -> None:
+        """启动后台任务（数据加载、交换请求过期清理）；构造时若无运行中的事件循环，则在首条消息时启动。"""
+        if self._bg_tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        start_state_loading(self.preload_recent_groups)
+        self._bg_tasks.append(loop.create_task(self._swap_expiry_loop()))
+        self._bg_tasks.append(loop.create_task(self._repair_loop()))
+        if self.metrics_dump_interval_sec > 0:
+            self._bg_tasks.append(loop.create_task(self._metrics_dump_loop()))
+        if self.integrity_scan_on_startup:
+            self._bg_tasks.append(loop.create_task(self._startup_integrity_scan()))
+
+    async def _startup_integrity_scan(self) -> None:
+        """启动后在后台体检一次全部数据文件（不阻塞命令处理）。"""
+        await wait_state_loaded()
+        try:
+            async with self._integrity_lock:
+                await run_integrity_scan(self.integrity_scan_workers)
+        except Exception:
+            # 体检失败不影响主流程，可用 /老婆体检 手动重试
+            pass
+
+    async def _swap_expiry_loop(self) -> None:
+        """按过期堆的最早到期时间休眠，到期后批量清理交换请求。"""
+        await wait_state_loaded()
+        while True:
+            try:
+                next_at = swap_store.next_expiry()
+                delay = SWAP_EXPIRY_MAX_SLEEP if next_at is None else max(0.0, next_at - time.time())
+                # 不用 wait_for：3.11 下唤醒与取消同时发生时 wait_for 会吞掉取消，导致插件卸载时卡住
+                waiter = asyncio.ensure_future(swap_store.wakeup.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=min(delay, SWAP_EXPIRY_MAX_SLEEP))
+                finally:
+                    waiter.cancel()
+                swap_store.wakeup.clear()
+                await expire_swap_requests(time.time(), get_today())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 清理失败不影响主流程，下轮重试
+                await asyncio.sleep(5)
+
+    async def _repair_loop(self) -> None:
+        """把只读命令发现不一致的群合并后修复写回（读命令本身不持锁、不写盘）。"""
+        await wait_state_loaded()
+        while True:
+            await repairer.wakeup.wait()
+            # 稍等片刻，让同一时段的请求合并为每群一次事务
+            await asyncio.sleep(REPAIR_BATCH_DELAY)
+            repairer.wakeup.clear()
+            try:
+                await run_repairs(repairer.take(), get_today())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 修复失败的群在下次读取时重新入队
+                pass
+
+    async def _metrics_dump_loop(self) -> None:
+        """定期把运行指标以 Prometheus 文本格式写到 METRICS_FILE。"""
+        while True:
+            await asyncio.sleep(self.metrics_dump_interval_sec)
+            try:
+                text = self._render_metrics()
+                await asyncio.to_thread(self._write_metrics_file, text)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+    @staticmethod
+    def _write_metrics_file(text: str) -> None:
+        tmp_path = METRICS_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, METRICS_FILE)
+
+    def _render_metrics(self) -> str:
+        """全局指标 + 限流计数（限流器计数保存在插件实例上）。"""
+        text = metrics.render_prometheus()
+        lines = []
+        for cmd, n in sorted(self.throttle.shed.items()):
+            lines.append(f'animewife_throttle_shed_total{{cmd="{cmd}"}} {n}')
+        if lines:
+            text += "# TYPE animewife_throttle_shed_total counter\n" + "\n".join(lines) + "\n"
+        return text
+
+    def swap_request_expires_at(self, now: float | None = None) -> float:
+        """新交换请求的过期时间：当天零点与（可选）有效期取较早者。"""
+        now = time.time() if now is None else now
+        expires_at = next_midnight_ts(now)
+        if self.swap_request_ttl_min > 0:
+            expires_at = min(expires_at, now + self.swap_request_ttl_min * 60)
+        return expires_at
+
     # ==================== 消息处理 ====================
 
     @event_message_type(EventMessageType.GROUP_MESSAGE)
@@ -963,64 +4333,89 @@ class WifePlugin(Star):
         """消息分发处理（仅群聊监听）"""
         if not event.message_obj or not hasattr(event.message_obj, "group_id"):
             return
-        
+
         # 检查是否需要前缀唤醒
         if self.need_prefix and not event.is_at_or_wake_command:
             return
-        
-        text = normalize_cmd_text(event.message_str)
-        for cmd, func in self.commands.items():
-            if text.startswith(cmd):
-                async for res in func(event):
-                    yield res
-                break
+
+        self._ensure_background_tasks()
+        ctx = self.build_context(event)
+        if ctx is None:
+            return
+        # 刷屏限流：超额直接丢弃，不读写任何数据文件
+        if self.throttle.enabled and not self.throttle.allow(ctx.gid, ctx.uid, ctx.cmd):
+            return
+        await ensure_state_loaded()
+
+        # 只统计处理函数自身耗时（不含框架消费 yield 结果的时间）
+        gen = self.commands[ctx.cmd](event, ctx)
+        profiling = lock_profiler.enabled
+        spent = 0.0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                # 命令名只在处理函数执行期间设置（不跨 yield），供锁竞争分析归因
+                token = current_command.set(ctx.cmd) if profiling else None
+                conflicted = False
+                try:
+                    res = await gen.__anext__()
+                except StopAsyncIteration:
+                    spent += time.perf_counter() - t0
+                    break
+                except StorageConflict:
+                    # Redis 后端：提交时数据已被其他节点改写，事务已回滚
+                    conflicted = True
+                    res = event.plain_result(f"{ctx.nick}，操作冲突，本次没有生效，请稍后再试~")
+                finally:
+                    if token is not None:
+                        current_command.reset(token)
+                spent += time.perf_counter() - t0
+                yield res
+                if conflicted:
+                    break
+        finally:
+            metrics.inc("commands", cmd=ctx.cmd)
+            metrics.observe_ms("command_latency_ms", spent * 1000.0, cmd=ctx.cmd)
 
     # ==================== 抽老婆相关 ====================
 
-    async def animewife(self, event: AstrMessageEvent, *, record_to_backpack: bool = True):
+    async def animewife(self, event: AstrMessageEvent, ctx: CommandContext, *, record_to_backpack: bool = True):
         """抽老婆"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        today = get_today()
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
 
         new_draw = False
         auto_slot: int | None = None
         backpack_full = False
-        backpack_items: list | None = None
+        backpack_items: Backpack | None = None
 
         img: str | None = None
 
         # 先在锁内检查是否已有今日老婆，避免无谓的外部请求
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            img, _, _, _, changed = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
-            if changed:
-                save_group_config(gid, cfg)
+        async with GroupTransaction(gid, today) as txn:
+            img = resolve_today_entity(txn.cfg, uid, today, size, nick_default=nick)[0]
+        snapshot = txn.snapshot()
 
         fetched_img: str | None = None
         if not img:
-            fetched_img = await self._fetch_wife_image_for_event(event)
+            fetched_img = await self._fetch_wife_image_for_event(event, gid)
             if not fetched_img:
                 yield event.plain_result("抱歉，今天的老婆获取失败了，请稍后再试~")
                 return
         
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            # 二次检查：并发下可能已被其他协程写入
-            img2, _, _, _, changed2 = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
+        async with GroupTransaction(gid, today, reuse=snapshot) as txn:
+            cfg = txn.cfg
+            # 二次检查：群配置版本未变时沿用第一阶段的解析结果，否则重新解析（并发下可能已被其他协程写入）
+            img2 = img if txn.reused else resolve_today_entity(cfg, uid, today, size, nick_default=nick)[0]
             if img2:
                 img = img2
-                if changed2:
-                    save_group_config(gid, cfg)
             else:
                 img = fetched_img
 
                 # 抽老婆：实体 w 优先落入背包空槽位并绑定今日槽位；否则作为临时态保留（不重复存储）
                 if record_to_backpack:
                     backpacks, items = get_user_backpack(cfg, uid, size)
-                    slot = first_empty_slot(items)
+                    slot = items.first_empty()
                     if slot is not None:
                         auto_slot = slot
                         set_today_entity_slot(cfg, uid, today, nick, size, slot, img)
@@ -1032,7 +4427,7 @@ class WifePlugin(Star):
                     set_today_entity_unsaved(cfg, uid, today, nick, img)
 
                 new_draw = True
-                save_group_config(gid, cfg)
+                txn.mark_dirty()
         
         extra_lines: list[str] = []
         if new_draw and record_to_backpack:
@@ -1042,34 +4437,36 @@ class WifePlugin(Star):
                 extra_lines.append(f"你的老婆背包已满（{size}/{size}），今天抽到的老婆不会自动保存。")
                 extra_lines.append(f"如需保存，请发送 /替换老婆 <1-{size}> 选择一个位置替换；否则明天刷新后将消失。")
                 if backpack_items is not None:
+                    # 只附上第一页，容量很大时不把整个背包塞进同一条消息
                     lines = []
-                    for i, x in enumerate(backpack_items, start=1):
+                    for i, x in backpack_items.page(1, self.backpack_page_size):
                         lines.append(f"{i}. {format_backpack_item(x)}")
+                    if backpack_items.pages(self.backpack_page_size) > 1:
+                        lines.append("……其余槽位请用 /老婆背包 <页码> 查看")
                     extra_lines.append("当前背包：\n" + "\n".join(lines))
 
         # 生成并发送消息
         yield event.chain_result(self._build_wife_message(img, nick, extra_lines=extra_lines or None))
 
-    async def _fetch_wife_image(self) -> str | None:
-        """获取老婆图片"""
+    async def _fetch_wife_image(self, gid: str) -> str | None:
+        """获取老婆图片（使用该群的随机数流）"""
         # Deprecated: keep for backward compatibility (should not be called after v1.9.3 changes)
         imgs = await self._list_wife_images()
-        return random.choice(imgs) if imgs else None
+        return rng.choice(gid, imgs) if imgs else None
 
-    async def _fetch_wife_image_for_event(self, event: AstrMessageEvent, *, allow_members: bool = True) -> str | None:
+    async def _fetch_wife_image_for_event(self, event: AstrMessageEvent, gid: str, *, allow_members: bool = True) -> str | None:
         """按事件上下文抽取“老婆实体”：图片老婆或群成员头像老婆。"""
         if allow_members and self.include_group_members and self.group_member_draw_probability > 0:
             try:
-                if random.random() < self.group_member_draw_probability:
-                    gid = str(event.message_obj.group_id)
+                if rng.random(gid) < self.group_member_draw_probability:
                     member_ids = await self._list_group_member_ids(event, gid)
                     if member_ids:
-                        return random.choice(member_ids)
+                        return rng.choice(gid, member_ids)
             except Exception:
                 pass
 
         imgs = await self._list_wife_images()
-        return random.choice(imgs) if imgs else None
+        return rng.choice(gid, imgs) if imgs else None
 
     async def _list_group_member_ids(self, event: AstrMessageEvent, gid: str) -> list[str]:
         """获取群成员列表并转换为“群成员老婆”ID；带 TTL 缓存，避免频繁请求平台。"""
@@ -1081,7 +4478,9 @@ class WifePlugin(Star):
             if cached:
                 ts, ids = cached
                 if (now - ts) <= float(self.group_member_pool_ttl_sec) and ids:
+                    metrics.inc("member_cache", result="hit")
                     return list(ids)
+        metrics.inc("member_cache", result="miss")
 
         bot = getattr(event, "bot", None)
         if not bot or not hasattr(bot, "get_group_member_list"):
@@ -1110,14 +4509,32 @@ class WifePlugin(Star):
         # 控制最大池大小，避免超大群导致抽取池过重
         max_n = int(self.group_member_pool_max or 0)
         if max_n > 0 and len(ids) > max_n:
-            ids = random.sample(ids, k=max_n)
+            ids = rng.sample(gid, ids, k=max_n)
 
         async with self._member_cache_lock:
             self._member_cache[gid] = (now, list(ids))
         return ids
 
     async def _list_wife_images(self) -> list[str]:
-        """获取老婆图片文件名列表（本地优先，其次网络）。"""
+        """获取老婆图片文件名列表；结果按 catalog_cache_ttl_sec 缓存（返回值只读）。"""
+        now = time.monotonic()
+        cached = self._catalog_cache
+        if cached is not None and cached[1] and (now - cached[0]) <= self.catalog_cache_ttl_sec:
+            metrics.inc("catalog_cache", result="hit")
+            return cached[1]
+        metrics.inc("catalog_cache", result="miss")
+        imgs = await self._load_wife_images()
+        if imgs:
+            self._catalog_cache = (now, imgs)
+            try:
+                await catalog_index.sync(imgs)
+            except Exception as e:
+                # 编号只影响图鉴，失败时不影响抽取，下次刷新图库时重试
+                logger.warning(f"[animewife] 图库编号失败：{e}")
+        return imgs
+
+    async def _load_wife_images(self) -> list[str]:
+        """读取老婆图片文件名列表（本地优先，其次网络）。"""
         try:
             local_imgs = [
                 normalize_img_id(x)
@@ -1135,9 +4552,12 @@ class WifePlugin(Star):
         if not url:
             return []
 
+        t0 = time.perf_counter()
+        status = "error"
         try:
             async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as session:
                 async with session.get(url) as resp:
+                    status = str(resp.status)
                     if resp.status != 200:
                         return []
                     text = await resp.text()
@@ -1152,6 +4572,8 @@ class WifePlugin(Star):
                     return out
         except Exception:
             return []
+        finally:
+            metrics.observe_ms("http_fetch_latency_ms", (time.perf_counter() - t0) * 1000.0, status=status)
 
     def _build_wife_message(self, img: str, nick: str, *, extra_lines: list[str] | None = None):
         """构建老婆消息链"""
@@ -1179,15 +4601,19 @@ class WifePlugin(Star):
 
     # ==================== 帮助命令 ====================
 
-    async def wife_help(self, event: AstrMessageEvent):
+    async def wife_help(self, event: AstrMessageEvent, ctx: CommandContext):
         """显示帮助信息"""
         help_text = """
 【基础命令】
 • 抽老婆 - 每天抽取一个二次元老婆
-• 老婆背包 - 查看自己的老婆背包列表
+• 老婆背包 [@用户] [页码] - 查看自己(或别人)的老婆背包列表，只列出有老婆的槽位，多页时按页码翻页
 • 查老婆 <编号> - 查看自己的背包老婆(带图)
 • 查老婆 [@用户] - 查看别人的老婆
 • 替换老婆 <编号> - 用“今天的老婆”替换背包指定位置
+• 老婆排行 [老婆|背包|牛] - 本群最受欢迎的老婆、背包最满、牛老婆成功最多的用户
+• 我的图鉴 - 曾经获得过的老婆占图库的比例(按作品列出收集进度)
+• 谁有老婆 <关键词> - 查看本群谁的背包/今日老婆位里有匹配的老婆
+• 老婆来历 [@用户] <编号> - 查看该槽位老婆经牛老婆/交换/发老婆的转手记录
 
 【牛老婆功能】(概率较低😭)
 • 牛老婆 [@用户] - 有概率抢走别人的今日老婆(额外入库到背包，不顶掉今日老婆位)
@@ -1206,63 +4632,53 @@ class WifePlugin(Star):
 
 【管理员命令】
 • 切换ntr开关状态 - 开启/关闭NTR功能
+• 老婆统计 - 查看插件运行统计(命令耗时、存储、缓存命中率等)
+• 老婆统计 锁 [重置] - 查看锁竞争报告(需开启锁竞争分析)
+• 老婆体检 - 并行校验全部数据文件，隔离无法解析的文件
+• 老婆排行 重建 - 扫描全部背包重建本群排行统计
+• 老婆导出 [gz] - 把全部群的数据导出为 JSONL 文件(可选 gzip 压缩)
+• 老婆导入 <文件名> - 从 backups 目录下的导出文件恢复数据
 • 发老婆 @用户 <关键词> - 按关键词发一个老婆给对方(覆盖对方今日老婆，优先入库)
+• 发老婆 @用户1 @用户2 ... <关键词|随机> - 批量发放(每人同一关键词或各自随机)
 
 💡 提示：部分命令有每日使用次数限制
 """
         yield event.plain_result(help_text.strip())
 
-    async def search_wife(self, event: AstrMessageEvent):
+    async def search_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """查老婆"""
-        uid = str(event.get_sender_id())
-
-        msg = normalize_cmd_text(event.message_str)
-        rest = msg[len("查老婆"):].strip() if msg.startswith("查老婆") else ""
-
         # 解析目标用户：优先 @，其次昵称/uid 兼容
-        tid = self.parse_at_target(event)
+        tid = ctx.at_target
         if not tid:
-            toks = rest.split()
-            if toks and toks[0].startswith("@") and toks[0][1:].isdigit():
-                tid = toks[0][1:]
+            if ctx.tokens and ctx.tokens[0].startswith("@") and ctx.tokens[0][1:].isdigit():
+                tid = ctx.tokens[0][1:]
             else:
-                tid = self.parse_target(event)
+                tid = self.parse_target(ctx)
         if not tid:
-            tid = uid
+            tid = ctx.uid
 
         # 解析可选编号：/查老婆 [@用户] <编号>
-        slot: int | None = None
-        toks = rest.split()
-        nums = [t for t in toks if t.isdigit()]
-        if len(nums) >= 2:
+        if len(ctx.numbers) >= 2:
             yield event.plain_result("用法：/查老婆 [@用户] [编号]（编号可省略，省略则查看背包列表）")
             return
-        if len(nums) == 1:
-            try:
-                slot = int(nums[0])
-            except Exception:
-                slot = None
+        slot: int | None = ctx.numbers[0] if ctx.numbers else None
 
         if slot is not None:
-            async for res in self.view_user_backpack_wife(event, str(tid), slot):
+            async for res in self.view_user_backpack_wife(event, ctx, str(tid), slot):
                 yield res
             return
 
-        async for res in self.show_user_backpack(event, str(tid)):
+        async for res in self.show_user_backpack(event, ctx, str(tid)):
             yield res
 
-    async def view_backpack_wife(self, event: AstrMessageEvent, slot: int):
+    async def view_backpack_wife(self, event: AstrMessageEvent, ctx: CommandContext, slot: int):
         """查自己的背包老婆（编号槽位）。"""
-        uid = str(event.get_sender_id())
-        async for res in self.view_user_backpack_wife(event, uid, slot):
+        async for res in self.view_user_backpack_wife(event, ctx, ctx.uid, slot):
             yield res
 
-    async def view_user_backpack_wife(self, event: AstrMessageEvent, owner_uid: str, slot: int):
+    async def view_user_backpack_wife(self, event: AstrMessageEvent, ctx: CommandContext, owner_uid: str, slot: int):
         """查任意用户的背包老婆（编号槽位，含临时位）。"""
-        gid = str(event.message_obj.group_id)
-        viewer_uid = str(event.get_sender_id())
-        viewer_nick = event.get_sender_name()
-        today = get_today()
+        gid, viewer_uid, viewer_nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
 
         if slot < 1 or slot > size + 1:
@@ -1274,16 +4690,13 @@ class WifePlugin(Star):
         img: str | None = None
         note: str | None = None
         owner_nick: str = owner_uid
-        changed = False
 
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            owner_nick = get_cfg_nick(cfg, str(owner_uid), str(owner_uid))
-            img, note, _, changed = get_slot_entry(
-                cfg, str(owner_uid), today, size, slot, nick_default=owner_nick
-            )
-            if changed:
-                save_group_config(gid, cfg)
+        # 只读：无锁读取已提交的群配置副本
+        cfg = read_group_snapshot(gid, today)
+        owner_nick = get_cfg_nick(cfg, str(owner_uid), str(owner_uid))
+        img, note, _ = get_slot_entry(
+            cfg, str(owner_uid), today, size, slot, nick_default=owner_nick
+        )
 
         if not img:
             slot_name = "临时" if slot == size + 1 else str(slot)
@@ -1319,23 +4732,17 @@ class WifePlugin(Star):
         except Exception:
             yield event.plain_result(text)
 
-    async def replace_wife(self, event: AstrMessageEvent):
+    async def replace_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """用今天的老婆替换背包指定槽位。"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        today = get_today()
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
 
-        msg = event.message_str.strip()
-        msg = normalize_cmd_text(msg)
-        arg = msg[len("替换老婆"):].strip() if msg.startswith("替换老婆") else ""
-        if not arg:
+        if not ctx.tokens:
             yield event.plain_result(f"{nick}，用法：/替换老婆 <1-{size}>")
             return
 
         try:
-            slot = int(arg.split()[0])
+            slot = int(ctx.tokens[0])
         except Exception:
             yield event.plain_result(f"{nick}，用法：/替换老婆 <1-{size}>")
             return
@@ -1346,12 +4753,9 @@ class WifePlugin(Star):
 
         err: str | None = None
         img: str | None = None
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            img, prev_slot, _, note, changed = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
-            if changed:
-                # 仅迁移/修复也要落盘，避免后续一致性问题
-                save_group_config(gid, cfg)
+        async with GroupTransaction(gid, today) as txn:
+            cfg = txn.cfg
+            img, prev_slot, _, note = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
             if not img:
                 err = f"{nick}，你今天还没有老婆，先 /抽老婆 再来替换吧~"
 
@@ -1359,12 +4763,11 @@ class WifePlugin(Star):
                 # “替换老婆”语义调整为移动实体 w：w 在总记录中只存在一处
                 backpacks, items = get_user_backpack(cfg, uid, size)
                 if prev_slot is not None and 1 <= prev_slot <= size and prev_slot != slot:
-                    items[prev_slot - 1] = None
-                backpacks[uid] = items
-                cfg[BACKPACKS_KEY] = backpacks
+                    items.set(prev_slot, None)
+                store_user_backpack(cfg, uid, backpacks, items)
 
                 set_today_entity_slot(cfg, uid, today, nick, size, slot, img, note=note)
-                save_group_config(gid, cfg)
+                txn.mark_dirty()
 
         if err:
             yield event.plain_result(err)
@@ -1375,42 +4778,45 @@ class WifePlugin(Star):
 
         yield event.plain_result(f"{nick}，已将今天的老婆存入{slot}号背包位：{format_wife_name(img)}")
 
-    async def show_backpack(self, event: AstrMessageEvent):
-        """显示自己的老婆背包列表。"""
-        uid = str(event.get_sender_id())
-        async for res in self.show_user_backpack(event, uid):
+    async def show_backpack(self, event: AstrMessageEvent, ctx: CommandContext):
+        """老婆背包 [@用户] [页码]：显示自己（或被@用户）的老婆背包列表。"""
+        if len(ctx.numbers) >= 2:
+            yield event.plain_result("用法：/老婆背包 [@用户] [页码]")
+            return
+        page = ctx.numbers[0] if ctx.numbers else None
+        async for res in self.show_user_backpack(event, ctx, ctx.at_target or ctx.uid, page=page):
             yield res
 
-    async def show_user_backpack(self, event: AstrMessageEvent, owner_uid: str):
-        """显示某个用户的背包列表（持久 size + 1 临时位），并标记“今日”。"""
-        gid = str(event.message_obj.group_id)
-        viewer_uid = str(event.get_sender_id())
-        viewer_nick = event.get_sender_name()
-        today = get_today()
+    async def show_user_backpack(self, event: AstrMessageEvent, ctx: CommandContext, owner_uid: str, *, page: int | None = None):
+        """
+        显示某个用户的背包列表（持久 size + 1 临时位），并标记“今日”。
+        只按有老婆的槽位分页（每页 backpack_page_size 个）；开启 backpack_forward 且未指定页码时，
+        多页背包合并成一条转发消息发送。
+        """
+        gid, viewer_uid, viewer_nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
+        per_page = self.backpack_page_size
 
         owner_nick = str(owner_uid)
-        items: list = []
         today_slot: int | None = None
         today_img: str | None = None
         today_note: str | None = None
-        changed = False
-
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            owner_nick = get_cfg_nick(cfg, str(owner_uid), str(owner_uid))
-            _, items = get_user_backpack(cfg, str(owner_uid), size)
-            today_slot, today_img, _, today_note, changed = get_today_slot_number(
-                cfg, str(owner_uid), today, size, nick_default=owner_nick
-            )
-            if changed:
-                save_group_config(gid, cfg)
 
-        used = sum(1 for x in items if backpack_entry_to_img_note(x)[0])
-        lines: list[str] = []
-        for i, x in enumerate(items, start=1):
-            mark = " [今日]" if today_slot == i else ""
-            lines.append(f"{i}. {format_backpack_item(x)}{mark}")
+        # 只读：无锁读取已提交的群配置副本
+        cfg = read_group_snapshot(gid, today)
+        owner_nick = get_cfg_nick(cfg, str(owner_uid), str(owner_uid))
+        _, items = get_user_backpack(cfg, str(owner_uid), size)
+        today_slot, today_img, _, today_note = get_today_slot_number(
+            cfg, str(owner_uid), today, size, nick_default=owner_nick
+        )
+
+        used = items.used
+        pages = items.pages(per_page)
+        if page is not None and not 1 <= page <= pages:
+            yield event.plain_result(f"{viewer_nick}，页码超出范围啦，这个背包共 {pages} 页~")
+            return
+        forward = self.backpack_forward and page is None and pages > 1
+        shown = range(1, min(pages, BACKPACK_FORWARD_MAX_PAGES) + 1) if forward else [page or 1]
 
         # 临时位（仅当今日为临时态时才有内容）
         temp_entry = "(空)"
@@ -1419,134 +4825,133 @@ class WifePlugin(Star):
             if today_note:
                 temp_entry += f"（{today_note}）"
         temp_mark = " [今日]" if today_slot == size + 1 and today_img else ""
-        lines.append(f"{size+1}. {temp_entry}（临时位）{temp_mark}")
+        temp_line = f"{size+1}. {temp_entry}（临时位）{temp_mark}"
+
+        # 只列出有老婆的槽位，空位压缩成区间（放在最后一页），列表长度与容量无关
+        bodies: list[str] = []
+        for p in shown:
+            lines: list[str] = []
+            for i, x in items.page(p, per_page):
+                mark = " [今日]" if today_slot == i else ""
+                lines.append(f"{i}. {format_backpack_item(x)}{mark}")
+            if p == pages and used < size:
+                lines.append(f"空位：{format_empty_slots(items)}号")
+            lines.append(temp_line)
+            if pages > 1:
+                lines.append(f"（第 {p}/{pages} 页）")
+            bodies.append("\n".join(lines))
 
         if str(owner_uid) == viewer_uid:
             header = f"{viewer_nick}，你的老婆背包（{used}/{size}，含临时位）："
             hint = "用 /查老婆 <编号> 查看对应老婆(带图)。"
+            turn = "/老婆背包 <页码>"
         else:
             header = f"{viewer_nick}，{owner_nick}的老婆背包（{used}/{size}，含临时位）："
             hint = "用 /查老婆 @用户 <编号> 查看对方对应老婆(带图)。"
+            turn = "/老婆背包 @用户 <页码>"
 
         tips: list[str] = [hint]
+        if pages > 1 and not (forward and pages <= BACKPACK_FORWARD_MAX_PAGES):
+            tips.append(f"共 {pages} 页，用 {turn} 翻页。")
         if today_slot == size + 1 and today_img:
             tips.append(f"临时位需要 /替换老婆 <1-{size}> 保存，否则明天刷新会消失。")
 
-        text = header + "\n" + "\n".join(lines) + "\n\n" + "\n".join(tips)
+        if forward:
+            texts = [header, *bodies, "\n".join(tips)]
+            nodes = [Node(uin=event.get_self_id(), name="老婆背包", content=[Plain(t)]) for t in texts]
+            yield event.chain_result([Nodes(nodes=nodes)])
+            return
+        text = header + "\n" + bodies[0] + "\n\n" + "\n".join(tips)
         yield event.plain_result(text)
 
-    async def send_wife(self, event: AstrMessageEvent):
-        """按关键词给指定用户发老婆（覆盖今日老婆，并尝试优先入库）。"""
-        gid = str(event.message_obj.group_id)
-        sender_uid = str(event.get_sender_id())
-        sender_nick = event.get_sender_name()
-        today = get_today()
+    async def send_wife(self, event: AstrMessageEvent, ctx: CommandContext):
+        """按关键词给指定用户发老婆（覆盖今日老婆，并尝试优先入库）；@ 多个用户时批量发放。"""
+        gid, sender_uid, sender_nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
 
         if sender_uid not in self.admins:
             yield event.plain_result(f"{sender_nick}，该命令仅管理员可用哦~")
             return
 
-        tid = self.parse_at_target(event)
-        if not tid:
-            yield event.plain_result(f"{sender_nick}，用法：/发老婆 @用户 <关键词>")
+        # 目标：消息中的 @，以及关键词之前直接写出的 QQ 号列表（去重，保持顺序）
+        qq_tokens, keyword_tokens = split_send_args(ctx.tokens)
+        targets = list(dict.fromkeys([*ctx.at_targets, *qq_tokens]))
+        if not targets:
+            yield event.plain_result(f"{sender_nick}，用法：/发老婆 @用户|QQ号 [@用户2|QQ号2 ...] <关键词|随机>")
             return
+        tid = targets[0]
 
-        msg = normalize_cmd_text(event.message_str)
-        rest = msg[len("发老婆"):].strip() if msg.startswith("发老婆") else ""
-        if rest.startswith("@"):
-            parts = rest.split()
-            keyword = " ".join(parts[1:]).strip() if len(parts) > 1 else ""
-        else:
-            keyword = rest.strip()
+        keyword = " ".join(keyword_tokens).strip()
 
         # 兜底：从消息链 Plain 中提取关键词
-        if not keyword and event.message_obj and hasattr(event.message_obj, "message"):
-            plain_text = "".join(
-                seg.text for seg in event.message_obj.message if isinstance(seg, Plain)
-            ).strip()
-            if plain_text.startswith("发老婆"):
-                keyword = plain_text[len("发老婆"):].strip()
+        if not keyword and ctx.plain_text.startswith("发老婆"):
+            keyword = " ".join(split_send_args(ctx.plain_text[len("发老婆"):].split())[1]).strip()
 
         if not keyword:
             yield event.plain_result(f"{sender_nick}，请在命令后提供关键词。例如：/发老婆 @用户 澪")
             return
 
-        # 支持“候选序号”与模糊匹配：/发老婆 @用户 <关键词> [候选序号]
-        pick: int | None = None
-        parts = keyword.split()
-        if len(parts) >= 2 and parts[-1].isdigit():
-            try:
-                pick = int(parts[-1])
-                keyword = " ".join(parts[:-1]).strip()
-            except Exception:
-                pick = None
-
         all_imgs = await self._list_wife_images()
-        candidates = rank_wife_candidates(all_imgs, keyword, limit=8)
-        if not candidates:
-            yield event.plain_result(f"{sender_nick}，没有找到与“{keyword}”相近的老婆图片。")
-            return
-
-        if len(candidates) > 1 and not pick:
-            lines = []
-            for i, cand in enumerate(candidates, start=1):
-                lines.append(f"{i}. {format_wife_name(cand)}（{cand}）")
-            text = (
-                f"{sender_nick}，找到多个候选，请用 /发老婆 @用户 {keyword} <序号> 指定：\n"
-                + "\n".join(lines)
-            )
-            yield event.plain_result(text)
-            return
-
-        if pick is not None:
-            if pick < 1 or pick > len(candidates):
-                yield event.plain_result(f"{sender_nick}，候选序号超出范围：1-{len(candidates)}。")
+        if keyword == "随机":
+            # 每个目标各自随机抽一位（只从图片老婆中抽）
+            pool = [x for x in all_imgs if not x.startswith(MEMBER_ID_PREFIX)]
+            if not pool:
+                yield event.plain_result("抱歉，老婆图库是空的，请稍后再试~")
                 return
-            img = candidates[pick - 1]
+            imgs = [rng.choice(gid, pool) for _ in targets]
         else:
-            img = candidates[0]
-
-        target_name = None
-        try:
-            info = await event.bot.get_group_member_info(
-                group_id=int(gid), user_id=int(tid)
-            )
-            target_name = info.get("card") or info.get("nickname")
-        except Exception:
-            target_name = None
+            # 支持“候选序号”与模糊匹配：/发老婆 @用户 <关键词> [候选序号]
+            pick: int | None = None
+            parts = keyword.split()
+            if len(parts) >= 2 and parts[-1].isdigit():
+                try:
+                    pick = int(parts[-1])
+                    keyword = " ".join(parts[:-1]).strip()
+                except Exception:
+                    pick = None
 
-        stored_slot: int | None = None
-        is_full = False
+            # 批量发放时同一关键词只检索一次图库
+            candidates = rank_wife_candidates(all_imgs, keyword, limit=8)
+            if not candidates:
+                yield event.plain_result(f"{sender_nick}，没有找到与“{keyword}”相近的老婆图片。")
+                return
 
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            if not target_name:
-                target_name = get_cfg_nick(cfg, str(tid), str(tid))
+            if len(candidates) > 1 and not pick:
+                lines = []
+                for i, cand in enumerate(candidates, start=1):
+                    lines.append(f"{i}. {format_wife_name(cand)}（{cand}）")
+                text = (
+                    f"{sender_nick}，找到多个候选，请用 /发老婆 @用户 {keyword} <序号> 指定：\n"
+                    + "\n".join(lines)
+                )
+                yield event.plain_result(text)
+                return
 
-            # 覆盖今日老婆（遵循“实体 w”单一来源模型）：
-            # - 若对方今日老婆已落在背包槽位：覆盖同一槽位（不新增、不复制）
-            # - 若对方今日老婆为临时态：覆盖临时态
-            # - 若对方今日没有老婆：优先入库到空槽位；满则临时态
-            prev_img, prev_slot, _, _, changed = resolve_today_entity(
-                cfg, tid, today, size, nick_default=target_name
-            )
-            if prev_img and prev_slot is not None and 1 <= prev_slot <= size:
-                set_today_entity_slot(cfg, tid, today, target_name, size, prev_slot, img)
-                stored_slot = prev_slot
+            if pick is not None:
+                if pick < 1 or pick > len(candidates):
+                    yield event.plain_result(f"{sender_nick}，候选序号超出范围：1-{len(candidates)}。")
+                    return
+                imgs = [candidates[pick - 1]] * len(targets)
             else:
-                backpacks, items = get_user_backpack(cfg, tid, size)
-                empty = first_empty_slot(items)
-                if empty is not None:
-                    set_today_entity_slot(cfg, tid, today, target_name, size, empty, img)
-                    stored_slot = empty
-                else:
-                    set_today_entity_unsaved(cfg, tid, today, target_name, img)
-                    is_full = True
+                imgs = [candidates[0]] * len(targets)
+
+        if len(targets) > 1:
+            async for res in self._send_wife_bulk(event, ctx, targets, imgs):
+                yield res
+            return
+        img = imgs[0]
 
-            save_group_config(gid, cfg)
+        target_name = (await self._fetch_member_names(event, gid, [tid])).get(tid)
 
-        cancel_msg = await self.cancel_swap_on_wife_change(gid, [tid])
+        async with GroupTransaction(gid, today, records=True, swaps=True) as txn:
+            cfg = txn.cfg
+            if not target_name:
+                target_name = get_cfg_nick(cfg, str(tid), str(tid))
+            stored_slot = give_today_entity(cfg, tid, today, target_name, size, img)
+            is_full = stored_slot is None
+            txn.log_transfer(img, None, tid, "send", by=sender_uid)
+            txn.mark_dirty()
+            cancel_msg = format_swap_cancel_msg(txn.cancel_swaps_for([tid]))
 
         name = format_wife_name(img)
         extra = (
@@ -1583,30 +4988,69 @@ class WifePlugin(Star):
         if cancel_msg:
             yield event.plain_result(cancel_msg)
 
+    async def _send_wife_bulk(self, event: AstrMessageEvent, ctx: CommandContext, targets: list[str], imgs: list[str]):
+        """批量发老婆：并发查询群名片后在同一事务内写入全部目标，只回复一条汇总消息。"""
+        gid, sender_nick, today = ctx.gid, ctx.nick, ctx.today
+        size = self.backpack_size
+
+        names = await self._fetch_member_names(event, gid, targets)
+        results: list[tuple[str, str, int | None]] = []
+        async with GroupTransaction(gid, today, records=True, swaps=True) as txn:
+            cfg = txn.cfg
+            for tid, img in zip(targets, imgs):
+                name = names.get(tid) or get_cfg_nick(cfg, tid, tid)
+                results.append((name, img, give_today_entity(cfg, tid, today, name, size, img)))
+                txn.log_transfer(img, None, tid, "send", by=ctx.uid)
+            txn.mark_dirty()
+            cancel_msg = format_swap_cancel_msg(txn.cancel_swaps_for(targets))
+        metrics.inc("bulk_send_targets", len(targets))
+
+        lines = []
+        for i, (name, img, slot) in enumerate(results, start=1):
+            where = f"存入背包 {slot} 号位" if slot is not None else "背包已满，未自动保存"
+            lines.append(f"{i}. {name}：{format_wife_name(img)}（{where}）")
+        text = f"{sender_nick} 给 {len(results)} 位群友发了老婆：\n" + "\n".join(lines)
+        if any(slot is None for _, _, slot in results):
+            text += f"\n背包已满的群友可用 /替换老婆 <1-{size}> 保存今天的老婆。"
+        yield event.plain_result(text)
+        if cancel_msg:
+            yield event.plain_result(cancel_msg)
+
+    async def _fetch_member_names(self, event: AstrMessageEvent, gid: str, uids: list[str]) -> dict[str, str]:
+        """并发查询群名片/昵称（同时最多 MEMBER_INFO_CONCURRENCY 个请求）；查询失败的用户不在结果中。"""
+        sem = asyncio.Semaphore(MEMBER_INFO_CONCURRENCY)
+
+        async def one(uid: str) -> tuple[str, str | None]:
+            async with sem:
+                try:
+                    info = await event.bot.get_group_member_info(group_id=int(gid), user_id=int(uid))
+                    return uid, info.get("card") or info.get("nickname")
+                except Exception:
+                    return uid, None
+
+        return {uid: name for uid, name in await asyncio.gather(*(one(u) for u in uids)) if name}
+
     # ==================== 牛老婆相关 ====================
 
-    async def ntr_wife(self, event: AstrMessageEvent):
+    async def ntr_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """牛老婆"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+
         # 检查 NTR 功能是否启用
+        refresh_ntr_statuses()
         if not ntr_statuses.get(gid, True):
             yield event.plain_result("牛老婆功能还没开启哦，请联系管理员开启~")
             return
-        
-        today = get_today()
+
         size = self.backpack_size
 
         # 解析可选背包编号：
         # - /牛老婆 @用户 <编号> : 牛走对方背包指定槽位（含临时位 size+1）
         # - /牛老婆 @用户       : 保持旧行为（牛走对方今日老婆）
-        msg = normalize_cmd_text(event.message_str)
-        rest = msg[len("牛老婆"):].strip() if msg.startswith("牛老婆") else ""
+        rest = ctx.args
         slot: int | None = None
         if rest:
-            parts = rest.split()
+            parts = ctx.tokens
             if parts and parts[-1].isdigit():
                 try:
                     slot_arg = int(parts[-1])
@@ -1622,7 +5066,7 @@ class WifePlugin(Star):
                         return
 
         # 获取目标用户
-        tid = self.parse_target(event)
+        tid = self.parse_target(ctx)
         if not tid or tid == uid:
             if not tid:
                 tip = "请@你想牛的对象，或输入完整的昵称哦~"
@@ -1633,158 +5077,89 @@ class WifePlugin(Star):
                 yield event.plain_result(f"{nick}，不能牛自己呀，换个人试试吧~")
             return
 
-        # 预检查：对方是否有可牛对象、自己是否有背包空位（不消耗次数）
-        pre_err: str | None = None
+        # 校验 + 扣次数 + 判定 + 迁移在同一个事务内完成：
+        # 群配置 / 牛老婆次数 / 交换请求各至多落盘一次，不再需要“失败退还次数”的补偿写入
+        err: str | None = None
         target_nick: str | None = None
         src_suffix = ""
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            target_nick = get_cfg_nick(cfg, str(tid), str(tid))
-
-            _, my_items = get_user_backpack(cfg, uid, size)
-            my_empty_slot = first_empty_slot(my_items)
-            if my_empty_slot is None:
-                pre_err = f"{nick}，你的老婆背包已满（{size}/{size}），先清理/替换后再来牛吧~"
-            else:
-                if slot is None:
-                    t_img, _, _, _, changed = resolve_today_entity(
-                        cfg, str(tid), today, size, nick_default=target_nick
-                    )
-                    if changed:
-                        save_group_config(gid, cfg)
-                    if not t_img:
-                        pre_err = "对方今天还没有老婆可牛哦~"
-                else:
-                    if slot == size + 1:
-                        # 临时位仅当对方今日为临时态时存在
-                        tslot, t_img, _, _, changed = get_today_slot_number(
-                            cfg, str(tid), today, size, nick_default=target_nick
-                        )
-                        if changed:
-                            save_group_config(gid, cfg)
-                        if not t_img or tslot != size + 1:
-                            pre_err = "对方的临时老婆位还是空的哦~"
-                        else:
-                            src_suffix = "（来自对方临时位）"
-                    else:
-                        _, t_items = get_user_backpack(cfg, str(tid), size)
-                        entry = t_items[slot - 1] if 0 <= slot - 1 < len(t_items) else None
-                        t_img, _ = backpack_entry_to_img_note(entry)
-                        if not t_img:
-                            pre_err = f"对方背包的{slot}号位还是空的哦~"
-                        else:
-                            src_suffix = f"（来自对方背包{slot}号位）"
-
-        if pre_err:
-            yield event.plain_result(pre_err)
-            return
-
-        # 消耗一次牛老婆次数（原子 check+increment）
-        ntr_err: str | None = None
-        rem: int = 0
-        async with records_lock:
-            grp = records["ntr"].setdefault(gid, {})
-            rec = grp.get(uid, {"date": today, "count": 0})
-            if rec.get("date") != today:
-                rec = {"date": today, "count": 0}
-            if rec["count"] >= self.ntr_max:
-                ntr_err = f"{nick}，你今天已经牛了{self.ntr_max}次啦，明天再来吧~"
-            else:
-                rec["count"] += 1
-                grp[uid] = rec
-                save_records()
-                rem = self.ntr_max - rec["count"]
-        if ntr_err:
-            yield event.plain_result(ntr_err)
-            return
-
-        # 判断牛老婆是否成功
-        if random.random() >= self.ntr_possibility:
-            yield event.plain_result(f"{nick}，很遗憾，牛失败了！你今天还可以再试{rem}次~")
-            return
-
         stolen_img: str | None = None
         stored_slot: int | None = None
-        cancel_ids: list[str] = []
-
-        # 二次校验 + 原子迁移（同一把群配置锁内完成“从对方移除 + 写入自己背包”）
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
+        cancel_msg: str | None = None
+        async with GroupTransaction(gid, today, records=True, swaps=True) as txn:
+            cfg = txn.cfg
             target_nick = get_cfg_nick(cfg, str(tid), str(tid))
 
-            # 再确认自己仍有空位
-            my_backpacks, my_items = get_user_backpack(cfg, uid, size)
-            my_empty_slot = first_empty_slot(my_items)
+            # 预检查：对方是否有可牛对象、自己是否有背包空位（不消耗次数）
+            take_today = False
+            t_img: str | None = None
+            _, my_items = get_user_backpack(cfg, uid, size)
+            my_empty_slot = my_items.first_empty()
             if my_empty_slot is None:
-                stolen_img = None
+                err = f"{nick}，你的老婆背包已满（{size}/{size}），先清理/替换后再来牛吧~"
+            elif slot is None:
+                t_img = resolve_today_entity(cfg, str(tid), today, size, nick_default=target_nick)[0]
+                if not t_img:
+                    err = "对方今天还没有老婆可牛哦~"
+                take_today = True
+            elif slot == size + 1:
+                # 临时位仅当对方今日为临时态时存在
+                tslot, t_img, _, _ = get_today_slot_number(
+                    cfg, str(tid), today, size, nick_default=target_nick
+                )
+                if not t_img or tslot != size + 1:
+                    err = "对方的临时老婆位还是空的哦~"
+                else:
+                    src_suffix = "（来自对方临时位）"
+                take_today = True
             else:
-                if slot is None:
-                    t_img, _, _, _, changed = resolve_today_entity(
+                t_img, _ = backpack_entry_to_img_note(get_backpack_entry(cfg, str(tid), slot, size))
+                if not t_img:
+                    err = f"对方背包的{slot}号位还是空的哦~"
+                else:
+                    src_suffix = f"（来自对方背包{slot}号位）"
+                    # 若该槽位是对方“今日实体 w”，则清空今日位与槽位；否则仅清空该槽位
+                    t_today_slot, _, _, _ = get_today_slot_number(
                         cfg, str(tid), today, size, nick_default=target_nick
                     )
-                    if changed:
-                        save_group_config(gid, cfg)
-                    if not t_img:
-                        stolen_img = None
-                    else:
-                        stolen_img = t_img
-                        # 牛走“今日实体 w”：对方今日位与对应槽位(如有)必须一起消失
-                        remove_today_entity(cfg, str(tid), today, size)
-                        cancel_ids.append(str(tid))
+                    take_today = t_today_slot == slot
+
+            # 消耗一次牛老婆次数（check+increment）
+            rem = 0
+            if not err:
+                ok, used = txn.consume("ntr", uid, self.ntr_max)
+                if not ok:
+                    err = f"{nick}，你今天已经牛了{self.ntr_max}次啦，明天再来吧~"
+                rem = self.ntr_max - used
+
+            # 判断牛老婆是否成功
+            if not err and rng.random(gid) >= self.ntr_possibility:
+                err = f"{nick}，很遗憾，牛失败了！你今天还可以再试{rem}次~"
+
+            if not err:
+                stolen_img = t_img
+                cancel_ids: list[str] = []
+                if take_today:
+                    # 牛走“今日实体 w”：对方今日位与对应槽位(如有)必须一起消失
+                    remove_today_entity(cfg, str(tid), today, size)
+                    cancel_ids.append(str(tid))
                 else:
-                    if slot == size + 1:
-                        # 仅当对方今日为临时态时存在
-                        t_img, t_slot, _, _, _ = resolve_today_entity(
-                            cfg, str(tid), today, size, nick_default=target_nick
-                        )
-                        if not t_img or t_slot is not None:
-                            stolen_img = None
-                        else:
-                            stolen_img = t_img
-                            remove_today_entity(cfg, str(tid), today, size)
-                            cancel_ids.append(str(tid))
-                    else:
-                        t_backpacks, t_items = get_user_backpack(cfg, str(tid), size)
-                        entry = t_items[slot - 1] if 0 <= slot - 1 < len(t_items) else None
-                        t_img, _ = backpack_entry_to_img_note(entry)
-                        if not t_img:
-                            stolen_img = None
-                        else:
-                            stolen_img = t_img
-                            # 若该槽位是对方“今日实体 w”，则清空今日位与槽位；否则仅清空该槽位
-                            t_today_slot, _, _, _, _ = get_today_slot_number(
-                                cfg, str(tid), today, size, nick_default=target_nick
-                            )
-                            if t_today_slot == slot:
-                                remove_today_entity(cfg, str(tid), today, size)
-                                cancel_ids.append(str(tid))
-                            else:
-                                t_items[slot - 1] = None
-                                t_backpacks[str(tid)] = t_items
-                                cfg[BACKPACKS_KEY] = t_backpacks
-
-                if stolen_img:
-                    note = f"牛自用户 {target_nick}" if target_nick else "牛自用户"
-                    my_items[my_empty_slot - 1] = make_backpack_entry(stolen_img, note)
-                    my_backpacks[uid] = my_items
-                    cfg[BACKPACKS_KEY] = my_backpacks
-                    stored_slot = my_empty_slot
-
-                save_group_config(gid, cfg)
-
-        # 二次校验失败：退还次数
-        if not stolen_img or stored_slot is None:
-            async with records_lock:
-                grp = records["ntr"].setdefault(gid, {})
-                rec = grp.get(uid, {"date": today, "count": 0})
-                if rec.get("date") == today and rec.get("count", 0) > 0:
-                    rec["count"] = max(0, rec["count"] - 1)
-                    grp[uid] = rec
-                    save_records()
-            yield event.plain_result(f"{nick}，对方的老婆刚刚溜走了，这次不算次数，再试试吧~")
-            return
-
-        cancel_msg = await self.cancel_swap_on_wife_change(gid, cancel_ids) if cancel_ids else None
+                    t_backpacks, t_items = get_user_backpack(cfg, str(tid), size)
+                    t_items.set(slot, None)
+                    store_user_backpack(cfg, str(tid), t_backpacks, t_items)
+
+                note = f"牛自用户 {target_nick}" if target_nick else "牛自用户"
+                my_backpacks, my_items = get_user_backpack(cfg, uid, size)
+                my_items.set(my_empty_slot, make_backpack_entry(stolen_img, note))
+                store_user_backpack(cfg, uid, my_backpacks, my_items)
+                record_ntr_success(cfg, uid)
+                txn.log_transfer(stolen_img, str(tid), uid, "ntr")
+                stored_slot = my_empty_slot
+                txn.mark_dirty()
+                cancel_msg = format_swap_cancel_msg(txn.cancel_swaps_for(cancel_ids))
+
+        if err or not stolen_img:
+            yield event.plain_result(err or f"{nick}，牛老婆失败，请稍后再试~")
+            return
 
         name = format_wife_name(stolen_img)
         note_suffix = f"（牛自用户 {target_nick}）" if target_nick else ""
@@ -1815,17 +5190,16 @@ class WifePlugin(Star):
         if cancel_msg:
             yield event.plain_result(cancel_msg)
 
-    async def switch_ntr(self, event: AstrMessageEvent):
+    async def switch_ntr(self, event: AstrMessageEvent, ctx: CommandContext):
         """切换 NTR 开关（仅管理员）"""
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        
+        gid, uid, nick = ctx.gid, ctx.uid, ctx.nick
+
         if uid not in self.admins:
             yield event.plain_result(f"{nick}，你没有权限操作哦~")
             return
-        
-        gid = str(event.message_obj.group_id)
-        async with ntr_lock:
+
+        async with ntr_lock, shared_lock.hold("ntr"):
+            refresh_ntr_statuses()
             current_status = ntr_statuses.get(gid, True)
             ntr_statuses[gid] = not current_status
             save_ntr_statuses()
@@ -1835,76 +5209,48 @@ class WifePlugin(Star):
 
     # ==================== 换老婆相关 ====================
 
-    async def change_wife(self, event: AstrMessageEvent):
+    async def change_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """换老婆"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        today = get_today()
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
         size = self.backpack_size
 
-        # 先原子占用一次“换老婆次数”，避免并发下超额；若后续失败再回滚
-        reserved = False
-        limit_err: str | None = None
-        async with records_lock:
-            recs = records["change"].setdefault(gid, {})
-            rec = recs.get(uid, {"date": "", "count": 0})
-            if rec.get("date") != today:
-                rec = {"date": today, "count": 0}
-            if int(rec.get("count", 0)) >= self.change_max_per_day:
-                limit_err = f"{nick}，你今天已经换了{self.change_max_per_day}次老婆啦，明天再来吧~"
+        # 预检查（不占用次数）：次数未用完且有今日老婆；真正扣次数与第二阶段写入在同一事务内完成，
+        # 因此外部请求失败/并发冲突时无需再写盘回滚
+        pre_err: str | None = None
+        async with GroupTransaction(gid, today, records=True) as txn:
+            if txn.count("change", uid) >= self.change_max_per_day:
+                pre_err = f"{nick}，你今天已经换了{self.change_max_per_day}次老婆啦，明天再来吧~"
             else:
-                rec["count"] = int(rec.get("count", 0)) + 1
-                recs[uid] = rec
-                save_records()
-                reserved = True
-
-        if limit_err:
-            yield event.plain_result(limit_err)
-            return
-
-        # 检查是否有今日老婆（不在锁内 yield；若失败则回滚次数）
-        has_today = False
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            cur_img, _, _, _, changed = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
-            if changed:
-                save_group_config(gid, cfg)
-            has_today = bool(cur_img)
+                cur_img, cur_slot, _, _ = resolve_today_entity(txn.cfg, uid, today, size, nick_default=nick)
+                if not cur_img:
+                    pre_err = f"{nick}，你今天还没有老婆，先去抽一个再来换吧~"
+        snapshot = txn.snapshot()
 
-        if not has_today:
-            async with records_lock:
-                recs = records["change"].setdefault(gid, {})
-                rec2 = recs.get(uid, {"date": today, "count": 0})
-                if rec2.get("date") == today and int(rec2.get("count", 0)) > 0:
-                    rec2["count"] = max(0, int(rec2.get("count", 0)) - 1)
-                    recs[uid] = rec2
-                    save_records()
-            yield event.plain_result(f"{nick}，你今天还没有老婆，先去抽一个再来换吧~")
+        if pre_err:
+            yield event.plain_result(pre_err)
             return
 
-        new_img = await self._fetch_wife_image_for_event(event)
+        new_img = await self._fetch_wife_image_for_event(event, gid)
         if not new_img:
-            # 回滚占用次数
-            async with records_lock:
-                recs = records["change"].setdefault(gid, {})
-                rec2 = recs.get(uid, {"date": today, "count": 0})
-                if rec2.get("date") == today and int(rec2.get("count", 0)) > 0:
-                    rec2["count"] = max(0, int(rec2.get("count", 0)) - 1)
-                    recs[uid] = rec2
-                    save_records()
             yield event.plain_result("抱歉，今天的老婆获取失败了，请稍后再试~")
             return
 
         extra_lines: list[str] = []
         wife_chain: list | None = None
-        lost_today = False
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            # 并发二次检查：确保仍有“今日老婆”记录（避免被其他操作清空/跨日）
-            prev_img, prev_slot, _, _, changed2 = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
+        err: str | None = None
+        cancel_msg: str | None = None
+        async with GroupTransaction(gid, today, records=True, swaps=True, reuse=snapshot) as txn:
+            cfg = txn.cfg
+            # 并发二次检查：确保仍有“今日老婆”记录（避免被其他操作清空/跨日）；
+            # 群配置版本未变时直接沿用第一阶段的解析结果
+            if txn.reused:
+                prev_img, prev_slot = cur_img, cur_slot
+            else:
+                prev_img, prev_slot, _, _ = resolve_today_entity(cfg, uid, today, size, nick_default=nick)
             if not prev_img:
-                lost_today = True
+                err = f"{nick}，换老婆失败：你当前没有“今日老婆”记录了，请重新 /抽老婆~"
+            elif not txn.consume("change", uid, self.change_max_per_day)[0]:
+                err = f"{nick}，你今天已经换了{self.change_max_per_day}次老婆啦，明天再来吧~"
             else:
                 # 换老婆默认作用于“今日实体 w”本身：
                 # - 若 w 已落在背包槽位，则覆盖该槽位（不新增、不复制），旧 w 从记录中消失
@@ -1914,27 +5260,19 @@ class WifePlugin(Star):
                     extra_lines.append(f"已同步更新老婆背包：{prev_slot}号位（容量 {size}）")
                 else:
                     set_today_entity_unsaved(cfg, uid, today, nick, new_img)
-                    backpacks, items = get_user_backpack(cfg, uid, size)
-                    if first_empty_slot(items) is None:
+                    if get_user_backpack(cfg, uid, size)[1].first_empty() is None:
                         extra_lines.append(f"你的老婆背包已满（{size}/{size}），今天换到的老婆不会自动保存。")
                     extra_lines.append(f"如需保存，请发送 /替换老婆 <1-{size}> 选择一个位置替换；否则明天刷新后将消失。")
 
-                save_group_config(gid, cfg)
+                txn.mark_dirty()
+                # 取消相关交换请求（确认成功换老婆后再取消，避免“未换成功却取消了请求”）
+                cancel_msg = format_swap_cancel_msg(txn.cancel_swaps_for([uid]))
                 wife_chain = self._build_wife_message(new_img, nick, extra_lines=extra_lines or None)
 
-        if lost_today:
-            async with records_lock:
-                recs = records["change"].setdefault(gid, {})
-                rec2 = recs.get(uid, {"date": today, "count": 0})
-                if rec2.get("date") == today and int(rec2.get("count", 0)) > 0:
-                    rec2["count"] = max(0, int(rec2.get("count", 0)) - 1)
-                    recs[uid] = rec2
-                    save_records()
-            yield event.plain_result(f"{nick}，换老婆失败：你当前没有“今日老婆”记录了，请重新 /抽老婆~")
+        if err:
+            yield event.plain_result(err)
             return
 
-        # 取消相关交换请求（确认成功换老婆后再取消，避免“未换成功却取消了请求”）
-        cancel_msg = await self.cancel_swap_on_wife_change(gid, [uid])
         if cancel_msg:
             yield event.plain_result(cancel_msg)
 
@@ -1947,52 +5285,35 @@ class WifePlugin(Star):
 
     # ==================== 重置相关 ====================
 
-    async def reset_ntr(self, event: AstrMessageEvent):
+    async def reset_ntr(self, event: AstrMessageEvent, ctx: CommandContext):
         """重置牛老婆次数"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        today = get_today()
-        
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        tid = ctx.at_target or uid
+
         # 管理员可直接重置他人
         if uid in self.admins:
-            tid = self.parse_at_target(event) or uid
-            async with records_lock:
-                if gid in records["ntr"] and tid in records["ntr"][gid]:
-                    del records["ntr"][gid][tid]
-                    save_records()
+            async with GroupTransaction(gid, today, records=True) as txn:
+                txn.clear_count("ntr", tid)
             yield event.chain_result([
                 Plain("管理员操作：已重置"), At(qq=int(tid)), Plain("的牛老婆次数。")
             ])
             return
-        
-        # 普通用户使用重置机会
+
+        # 普通用户使用重置机会（扣次数与重置结果同一事务提交）
         reset_err: str | None = None
-        async with records_lock:
-            grp = records["reset"].setdefault(gid, {})
-            rec = grp.get(uid, {"date": today, "count": 0})
-            
-            if rec.get("date") != today:
-                rec = {"date": today, "count": 0}
-            
-            if rec["count"] >= self.reset_max_uses_per_day:
+        success = False
+        async with GroupTransaction(gid, today, records=True) as txn:
+            if not txn.consume("reset", uid, self.reset_max_uses_per_day)[0]:
                 reset_err = f"{nick}，你今天已经用完{self.reset_max_uses_per_day}次重置机会啦，明天再来吧~"
-            else:
-                rec["count"] += 1
-                grp[uid] = rec
-                save_records()
-            
+            elif rng.random(gid) < self.reset_success_rate:
+                success = True
+                txn.clear_count("ntr", tid)
+
         if reset_err:
             yield event.plain_result(reset_err)
             return
-        
-        tid = self.parse_at_target(event) or uid
-        
-        if random.random() < self.reset_success_rate:
-            async with records_lock:
-                if gid in records["ntr"] and tid in records["ntr"][gid]:
-                    del records["ntr"][gid][tid]
-                    save_records()
+
+        if success:
             yield event.chain_result([
                 Plain("已重置"), At(qq=int(tid)), Plain("的牛老婆次数。")
             ])
@@ -2003,54 +5324,35 @@ class WifePlugin(Star):
                 pass
             yield event.plain_result(f"{nick}，重置牛失败，被禁言{self.reset_mute_duration}秒，下次记得再接再厉哦~")
 
-    async def reset_change_wife(self, event: AstrMessageEvent):
+    async def reset_change_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """重置换老婆次数"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        nick = event.get_sender_name()
-        today = get_today()
-        
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        tid = ctx.at_target or uid
+
         # 管理员可直接重置他人
         if uid in self.admins:
-            tid = self.parse_at_target(event) or uid
-            async with records_lock:
-                grp = records["change"].setdefault(gid, {})
-                if tid in grp:
-                    del grp[tid]
-                    save_records()
+            async with GroupTransaction(gid, today, records=True) as txn:
+                txn.clear_count("change", tid)
             yield event.chain_result([
                 Plain("管理员操作：已重置"), At(qq=int(tid)), Plain("的换老婆次数。")
             ])
             return
-        
-        # 普通用户使用重置机会
+
+        # 普通用户使用重置机会（扣次数与重置结果同一事务提交）
         reset_err: str | None = None
-        async with records_lock:
-            grp = records["reset"].setdefault(gid, {})
-            rec = grp.get(uid, {"date": today, "count": 0})
-            
-            if rec.get("date") != today:
-                rec = {"date": today, "count": 0}
-            
-            if rec["count"] >= self.reset_max_uses_per_day:
+        success = False
+        async with GroupTransaction(gid, today, records=True) as txn:
+            if not txn.consume("reset", uid, self.reset_max_uses_per_day)[0]:
                 reset_err = f"{nick}，你今天已经用完{self.reset_max_uses_per_day}次重置机会啦，明天再来吧~"
-            else:
-                rec["count"] += 1
-                grp[uid] = rec
-                save_records()
-            
+            elif rng.random(gid) < self.reset_success_rate:
+                success = True
+                txn.clear_count("change", tid)
+
         if reset_err:
             yield event.plain_result(reset_err)
             return
-        
-        tid = self.parse_at_target(event) or uid
-        
-        if random.random() < self.reset_success_rate:
-            async with records_lock:
-                grp2 = records["change"].setdefault(gid, {})
-                if tid in grp2:
-                    del grp2[tid]
-                    save_records()
+
+        if success:
             yield event.chain_result([
                 Plain("已重置"), At(qq=int(tid)), Plain("的换老婆次数。")
             ])
@@ -2063,22 +5365,17 @@ class WifePlugin(Star):
 
     # ==================== 交换老婆相关 ====================
 
-    async def swap_wife(self, event: AstrMessageEvent):
+    async def swap_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """发起交换老婆请求"""
-        gid = str(event.message_obj.group_id)
-        uid = str(event.get_sender_id())
-        tid = self.parse_at_target(event)
-        nick = event.get_sender_name()
-        today = get_today()
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        tid = ctx.at_target
         size = self.backpack_size
 
         if not tid or tid == uid:
             yield event.plain_result(f"{nick}，请在命令后@你想交换的对象哦~")
             return
 
-        msg = normalize_cmd_text(event.message_str)
-        rest = msg[len("交换老婆"):].strip() if msg.startswith("交换老婆") else ""
-        nums = [t for t in rest.split() if t.isdigit()]
+        nums = ctx.numbers
         if len(nums) == 1:
             yield event.plain_result(f"{nick}，用法：/交换老婆 @用户 [我方编号] [对方编号]（编号可省略，省略则默认双方“今日”）")
             return
@@ -2089,111 +5386,59 @@ class WifePlugin(Star):
         offer_slot: int | None = None
         want_slot: int | None = None
         if len(nums) == 2:
-            try:
-                offer_slot = int(nums[0])
-                want_slot = int(nums[1])
-            except Exception:
-                offer_slot = None
-                want_slot = None
+            offer_slot, want_slot = nums
 
-        pre_err: str | None = None
+        err: str | None = None
         u_nick = nick
         t_nick = "对方"
 
-        # 校验：双方槽位存在且有内容（默认使用“今日槽位”）
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
+        # 校验槽位、查重、扣次数、登记请求在同一事务内完成
+        async with GroupTransaction(gid, today, records=True, swaps=True) as txn:
+            cfg = txn.cfg
             u_nick = get_cfg_nick(cfg, str(uid), nick) or nick
             t_nick = get_cfg_nick(cfg, str(tid), str(tid))
 
-            changed_any = False
+            # 校验：双方槽位存在且有内容（默认使用“今日槽位”）
             if offer_slot is None:
-                u_today_slot, _, _, _, changed_u = get_today_slot_number(
-                    cfg, str(uid), today, size, nick_default=u_nick
-                )
-                changed_any = changed_any or changed_u
-                offer_slot = u_today_slot
+                offer_slot = get_today_slot_number(cfg, str(uid), today, size, nick_default=u_nick)[0]
             if want_slot is None:
-                t_today_slot, _, _, _, changed_t = get_today_slot_number(
-                    cfg, str(tid), today, size, nick_default=t_nick
-                )
-                changed_any = changed_any or changed_t
-                want_slot = t_today_slot
-
-            if changed_any:
-                save_group_config(gid, cfg)
+                want_slot = get_today_slot_number(cfg, str(tid), today, size, nick_default=t_nick)[0]
 
             if offer_slot is None:
-                pre_err = f"{nick}，你今天还没有老婆，无法进行交换哦~"
+                err = f"{nick}，你今天还没有老婆，无法进行交换哦~"
             elif want_slot is None:
-                pre_err = f"{t_nick}，今天还没有老婆，无法进行交换哦~"
+                err = f"{t_nick}，今天还没有老婆，无法进行交换哦~"
+            elif offer_slot < 1 or offer_slot > size + 1 or want_slot < 1 or want_slot > size + 1:
+                err = f"{nick}，编号范围是 1-{size+1}（{size}持久+1临时）。"
             else:
-                if offer_slot < 1 or offer_slot > size + 1 or want_slot < 1 or want_slot > size + 1:
-                    pre_err = f"{nick}，编号范围是 1-{size+1}（{size}持久+1临时）。"
-                else:
-                    u_img, _, _, _ = get_slot_entry(cfg, str(uid), today, size, int(offer_slot), nick_default=u_nick)
-                    t_img, _, _, _ = get_slot_entry(cfg, str(tid), today, size, int(want_slot), nick_default=t_nick)
-                    if not u_img:
-                        pre_err = f"{nick}，你的{offer_slot}号老婆位是空的，无法交换哦~"
-                    elif not t_img:
-                        pre_err = f"{t_nick}的{want_slot}号老婆位是空的，无法交换哦~"
-
-        if pre_err:
-            yield event.plain_result(pre_err)
-            return
-
-        # 防止重复请求（先检查是否已存在）
-        dup_err: str | None = None
-        async with swap_lock:
-            grp = swap_requests.setdefault(gid, {})
-            existing = grp.get(uid)
-            if isinstance(existing, dict) and existing.get("date") == today:
-                dup_err = f"{nick}，你今天已经发起过交换请求了，用“查看交换请求”看看吧~"
-        if dup_err:
-            yield event.plain_result(dup_err)
-            return
-
-        # 记录交换请求次数（原子 check+increment）
-        limit_err: str | None = None
-        async with records_lock:
-            grp_limit = records["swap"].setdefault(gid, {})
-            rec_lim = grp_limit.get(uid, {"date": "", "count": 0})
-            if rec_lim.get("date") != today:
-                rec_lim = {"date": today, "count": 0}
-            if int(rec_lim.get("count", 0)) >= self.swap_max_per_day:
-                limit_err = f"{nick}，你今天已经发起了{self.swap_max_per_day}次交换请求啦，明天再来吧~"
-            else:
-                rec_lim["count"] = int(rec_lim.get("count", 0)) + 1
-                grp_limit[uid] = rec_lim
-                save_records()
-        if limit_err:
-            yield event.plain_result(limit_err)
-            return
-
-        need_rollback = False
-        async with swap_lock:
-            grp = swap_requests.setdefault(gid, {})
-            existing2 = grp.get(uid)
-            if isinstance(existing2, dict) and existing2.get("date") == today:
-                need_rollback = True
-            else:
-                grp[uid] = {
+                u_img = get_slot_entry(cfg, str(uid), today, size, int(offer_slot), nick_default=u_nick)[0]
+                t_img = get_slot_entry(cfg, str(tid), today, size, int(want_slot), nick_default=t_nick)[0]
+                if not u_img:
+                    err = f"{nick}，你的{offer_slot}号老婆位是空的，无法交换哦~"
+                elif not t_img:
+                    err = f"{t_nick}的{want_slot}号老婆位是空的，无法交换哦~"
+
+            # 防止重复请求
+            if not err:
+                existing = txn.get_swap(uid)
+                if swap_request_alive(existing, today):
+                    err = f"{nick}，你今天已经发起过交换请求了，用“查看交换请求”看看吧~"
+
+            # 记录交换请求次数（check+increment）
+            if not err and not txn.consume("swap", uid, self.swap_max_per_day)[0]:
+                err = f"{nick}，你今天已经发起了{self.swap_max_per_day}次交换请求啦，明天再来吧~"
+
+            if not err:
+                txn.put_swap(uid, {
                     "target": str(tid),
                     "date": today,
                     "offer_slot": int(offer_slot),
                     "want_slot": int(want_slot),
-                }
-                save_swap_requests()
+                    "expires_at": self.swap_request_expires_at(),
+                })
 
-        if need_rollback:
-            async with records_lock:
-                grp_limit = records["swap"].setdefault(gid, {})
-                rec_lim = grp_limit.get(uid, {"date": today, "count": 0})
-                if rec_lim.get("date") == today and int(rec_lim.get("count", 0)) > 0:
-                    rec_lim["count"] = max(0, int(rec_lim.get("count", 0)) - 1)
-                    grp_limit[uid] = rec_lim
-                    save_records()
-            yield event.plain_result(f"{nick}，你今天已经发起过交换请求了，用“查看交换请求”看看吧~")
+        if err:
+            yield event.plain_result(err)
             return
 
         yield event.chain_result(
@@ -2206,28 +5451,24 @@ class WifePlugin(Star):
             ]
         )
 
-    async def agree_swap_wife(self, event: AstrMessageEvent):
+    async def agree_swap_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """同意交换老婆"""
-        gid = str(event.message_obj.group_id)
-        tid = str(event.get_sender_id())
-        uid = self.parse_at_target(event)
-        nick = event.get_sender_name()
-        today = get_today()
+        gid, tid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        uid = ctx.at_target
         size = self.backpack_size
 
         if not uid:
             yield event.plain_result(f"{nick}，请在命令后@发起者，或用\"查看交换请求\"命令查看当前请求哦~")
             return
 
-        offer_slot: int | None = None
-        want_slot: int | None = None
         req_err: str | None = None
+        swapped = False
+        cancel_msg: str | None = None
 
-        # 检查和删除交换请求（原子操作）
-        async with swap_lock:
-            grp = swap_requests.get(gid, {})
-            rec = grp.get(uid)
-            if not isinstance(rec, dict) or rec.get("target") != tid or rec.get("date") != today:
+        # 取出请求、按槽位交换、失败返还次数、取消相关请求：同一事务内完成
+        async with GroupTransaction(gid, today, records=True, swaps=True) as txn:
+            rec = txn.get_swap(uid)
+            if not rec or rec.get("target") != tid or not swap_request_alive(rec, today):
                 req_err = f"{nick}，请在命令后@发起者，或用\"查看交换请求\"命令查看当前请求哦~"
             else:
                 try:
@@ -2236,83 +5477,61 @@ class WifePlugin(Star):
                 except Exception:
                     offer_slot = None
                     want_slot = None
-                del grp[uid]
-                save_swap_requests()
+                txn.pop_swap(uid)
+
+                cfg = txn.cfg
+                u_nick = get_cfg_nick(cfg, str(uid), str(uid))
+                t_nick = get_cfg_nick(cfg, str(tid), str(tid))
+
+                if offer_slot is None:
+                    offer_slot = get_today_slot_number(cfg, str(uid), today, size, nick_default=u_nick)[0]
+                if want_slot is None:
+                    want_slot = get_today_slot_number(cfg, str(tid), today, size, nick_default=t_nick)[0]
+
+                u_img, u_note, t_img, t_note = None, None, None, None
+                if offer_slot is not None:
+                    u_img, u_note, _ = get_slot_entry(cfg, str(uid), today, size, int(offer_slot), nick_default=u_nick)
+                if want_slot is not None:
+                    t_img, t_note, _ = get_slot_entry(cfg, str(tid), today, size, int(want_slot), nick_default=t_nick)
+
+                if not u_img or not t_img or offer_slot is None or want_slot is None:
+                    # 交换失败：返还发起者次数（请求已删除）
+                    txn.refund("swap", uid)
+                else:
+                    # 交换按槽位写回（含临时位）
+                    set_slot_entry(cfg, str(uid), today, size, int(offer_slot), t_img, note=t_note, nick_default=u_nick)
+                    set_slot_entry(cfg, str(tid), today, size, int(want_slot), u_img, note=u_note, nick_default=t_nick)
+                    txn.log_transfer(t_img, str(tid), str(uid), "swap")
+                    txn.log_transfer(u_img, str(uid), str(tid), "swap")
+                    txn.mark_dirty()
+                    swapped = True
+                    # 取消相关交换请求
+                    cancel_msg = format_swap_cancel_msg(txn.cancel_swaps_for([uid, tid]))
 
         if req_err:
             yield event.plain_result(req_err)
             return
 
-        # 执行交换（按编号槽位）
-        swapped = False
-        async with get_config_lock(gid):
-            cfg = load_group_config(gid)
-            u_nick = get_cfg_nick(cfg, str(uid), str(uid))
-            t_nick = get_cfg_nick(cfg, str(tid), str(tid))
-
-            changed_any = False
-            if offer_slot is None:
-                s, _, _, _, ch = get_today_slot_number(cfg, str(uid), today, size, nick_default=u_nick)
-                offer_slot = s
-                changed_any = changed_any or ch
-            if want_slot is None:
-                s, _, _, _, ch = get_today_slot_number(cfg, str(tid), today, size, nick_default=t_nick)
-                want_slot = s
-                changed_any = changed_any or ch
-            if changed_any:
-                save_group_config(gid, cfg)
-
-            u_img, u_note, _, _ = (None, None, False, False)
-            t_img, t_note, _, _ = (None, None, False, False)
-            if offer_slot is not None:
-                u_img, u_note, _, _ = get_slot_entry(cfg, str(uid), today, size, int(offer_slot), nick_default=u_nick)
-            if want_slot is not None:
-                t_img, t_note, _, _ = get_slot_entry(cfg, str(tid), today, size, int(want_slot), nick_default=t_nick)
-
-            if not u_img or not t_img or offer_slot is None or want_slot is None:
-                swapped = False
-            else:
-                # 交换按槽位写回（含临时位）
-                set_slot_entry(cfg, str(uid), today, size, int(offer_slot), t_img, note=t_note, nick_default=u_nick)
-                set_slot_entry(cfg, str(tid), today, size, int(want_slot), u_img, note=u_note, nick_default=t_nick)
-                save_group_config(gid, cfg)
-                swapped = True
-
         if not swapped:
-            # 交换失败：返还发起者次数（请求已删除）
-            async with records_lock:
-                grp_limit = records["swap"].setdefault(gid, {})
-                rec_lim = grp_limit.get(uid, {"date": today, "count": 0})
-                if rec_lim.get("date") == today and rec_lim.get("count", 0) > 0:
-                    rec_lim["count"] = max(0, int(rec_lim.get("count", 0)) - 1)
-                    grp_limit[uid] = rec_lim
-                    save_records()
             yield event.plain_result("交换失败：你们其中一方的今日老婆已变更/消失，本次请求已取消并返还次数~")
             return
-        
-        # 取消相关交换请求
-        cancel_msg = await self.cancel_swap_on_wife_change(gid, [uid, tid])
-        
+
         yield event.plain_result("交换成功！你们的老婆已经互换啦，祝幸福~")
         if cancel_msg:
             yield event.plain_result(cancel_msg)
 
-    async def reject_swap_wife(self, event: AstrMessageEvent):
+    async def reject_swap_wife(self, event: AstrMessageEvent, ctx: CommandContext):
         """拒绝交换老婆"""
-        gid = str(event.message_obj.group_id)
-        tid = str(event.get_sender_id())
-        uid = self.parse_at_target(event)
-        nick = event.get_sender_name()
+        gid, tid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        uid = ctx.at_target
 
         err: str | None = None
-        async with swap_lock:
-            grp = swap_requests.get(gid, {})
-            rec = grp.get(uid)
-            if not isinstance(rec, dict) or rec.get("target") != tid:
+        async with GroupTransaction(gid, today, swaps=True) as txn:
+            rec = txn.get_swap(uid) if uid else None
+            if not rec or rec.get("target") != tid:
                 err = f"{nick}，请在命令后@发起者，或用\"查看交换请求\"命令查看当前请求哦~"
             else:
-                del grp[uid]
-                save_swap_requests()
+                txn.pop_swap(uid)
         if err:
             yield event.plain_result(err)
             return
@@ -2321,18 +5540,19 @@ class WifePlugin(Star):
             At(qq=int(uid)), Plain("，对方婉拒了你的交换请求，下次加油吧~")
         ])
 
-    async def view_swap_requests(self, event: AstrMessageEvent):
+    async def view_swap_requests(self, event: AstrMessageEvent, ctx: CommandContext):
         """查看当前交换请求"""
-        gid = str(event.message_obj.group_id)
-        me = str(event.get_sender_id())
-
-        async with swap_lock:
-            grp = dict(swap_requests.get(gid, {}) or {})
-        cfg = load_group_config(gid)
-        
-        # 获取发起的和收到的请求（带编号）
-        sent = [(uid, rec) for uid, rec in grp.items() if uid == me and isinstance(rec, dict)]
-        received = [(uid, rec) for uid, rec in grp.items() if isinstance(rec, dict) and rec.get("target") == me]
+        gid, me = ctx.gid, ctx.uid
+
+        # 获取发起的和收到的请求：只读已提交视图，不持交换请求锁
+        reqs = swap_store.committed(gid)
+        mine = reqs.get(me)
+        sent = [(me, mine)] if swap_request_alive(mine, ctx.today) else []
+        received = [
+            (uid, rec) for uid, rec in reqs.items()
+            if str(rec.get("target")) == me and swap_request_alive(rec, ctx.today)
+        ]
+        cfg = read_group_snapshot(gid, ctx.today) if (sent or received) else {}
         
         if not sent and not received:
             yield event.plain_result("你当前没有任何交换请求哦~")
@@ -2361,51 +5581,317 @@ class WifePlugin(Star):
         text = "当前交换请求如下：\n" + "\n".join(parts) + "\n请在\"同意交换\"或\"拒绝交换\"命令后@发起者进行操作~"
         yield event.plain_result(text)
 
-    # ==================== 辅助方法 ====================
+    # ==================== 统计相关 ====================
+
+    async def show_leaderboard(self, event: AstrMessageEvent, ctx: CommandContext):
+        """老婆排行 [老婆|背包|牛|重建]：读取随背包写入增量维护的群统计，不扫描背包"""
+        gid, nick, today = ctx.gid, ctx.nick, ctx.today
+        size = self.backpack_size
+        arg = ctx.tokens[0] if ctx.tokens else ""
+        if arg and arg not in LEADERBOARD_KINDS and arg != "重建":
+            yield event.plain_result(f"{nick}，用法：/老婆排行 [{'|'.join(LEADERBOARD_KINDS)}]")
+            return
 
-    async def cancel_swap_on_wife_change(self, gid: str, user_ids: list) -> str | None:
-        """检查并取消与指定用户相关的交换请求"""
-        today = get_today()
-        to_cancel: list[str] = []
+        if arg == "重建":
+            if ctx.uid not in self.admins:
+                yield event.plain_result(f"{nick}，该命令仅管理员可用哦~")
+                return
+            async with GroupTransaction(gid, today) as txn:
+                stats = rebuild_wife_stats(txn.cfg, size, today)
+                txn.mark_dirty()
+            metrics.inc("wife_stats_rebuilds")
+            yield event.plain_result(f"已重建本群统计：{len(stats['filled'])} 个背包，{len(stats['owned'])} 种老婆。")
+            return
 
-        # 先在 swap_lock 下原子删除请求并落盘，避免并发丢写
-        async with swap_lock:
-            grp = swap_requests.get(gid, {})
-            if not isinstance(grp, dict):
-                return None
-            for req_uid, req in list(grp.items()):
-                if req_uid in user_ids or (isinstance(req, dict) and req.get("target") in user_ids):
-                    to_cancel.append(req_uid)
-                    try:
-                        del grp[req_uid]
-                    except KeyError:
-                        pass
-            if to_cancel:
-                save_swap_requests()
-
-        if not to_cancel:
-            return None
+        cfg = await self._wife_stats_cfg(gid, today)
+        stats = cfg[WIFE_STATS_KEY]
+
+        kinds = [arg] if arg else list(LEADERBOARD_KINDS)
+        limit = 10 if arg else 5
+        parts: list[str] = []
+        for kind in kinds:
+            field_name, title, unit = LEADERBOARD_KINDS[kind]
+            rows = top_entries(stats.get(field_name) or {}, limit)
+            lines = [f"【{title}】"]
+            for i, (key, n) in enumerate(rows, start=1):
+                name = format_wife_name(key) if field_name == "owned" else get_cfg_nick(cfg, key, key)
+                lines.append(f"{i}. {name} - {n}{unit}")
+            if not rows:
+                lines.append("暂无数据")
+            parts.append("\n".join(lines))
+        yield event.plain_result("\n\n".join(parts))
+
+    async def show_owners(self, event: AstrMessageEvent, ctx: CommandContext):
+        """谁有老婆 <关键词>：经反向索引查出持有匹配老婆的群友与槽位，只核对命中的条目"""
+        gid, nick, today = ctx.gid, ctx.nick, ctx.today
+        size = self.backpack_size
+        # 像聊天的消息（没有关键词，或命令后没有空格，如“谁有老婆吗”）不回复，也不读取群数据
+        rest = normalize_cmd_text(event.message_str)[len(ctx.cmd):]
+        keyword = " ".join(ctx.tokens).strip()
+        if not keyword or not rest[:1].isspace():
+            return
+        cfg = await self._wife_stats_cfg(gid, today)
+        # 关键词只在本群当前被持有的老婆中匹配
+        candidates = rank_wife_candidates(list(cfg[WIFE_STATS_KEY]["owners"]), keyword, limit=5)
+        lines: list[str] = []
+        for img in candidates:
+            holders = wife_owners(cfg, img, size, today)
+            if not holders:
+                continue
+            names = [
+                f"{get_cfg_nick(cfg, uid, uid)}（{'临时位' if slot > size else f'{slot}号位'}）"
+                for uid, slot in holders
+            ]
+            lines.append(f"• {format_wife_name(img)}：" + "、".join(names))
+        if not lines:
+            yield event.plain_result(f"{nick}，本群暂时没有人拥有与“{keyword}”匹配的老婆哦~")
+            return
+        yield event.plain_result(f"与“{keyword}”匹配的老婆持有情况：\n" + "\n".join(lines))
 
-        # 返还次数（records_lock）
-        async with records_lock:
-            grp_limit = records["swap"].setdefault(gid, {})
-            for req_uid in to_cancel:
-                rec_lim = grp_limit.get(req_uid, {"date": "", "count": 0})
-                if rec_lim.get("date") == today and rec_lim.get("count", 0) > 0:
-                    rec_lim["count"] = max(0, int(rec_lim.get("count", 0)) - 1)
-                    grp_limit[req_uid] = rec_lim
-            save_records()
+    async def _wife_stats_cfg(self, gid: str, today: str) -> dict:
+        """
+        返回统计可用的群配置：先无锁读取已提交的副本；
+        统计尚未建立（首次查询/背包容量变化）时在事务内重建一次。
+        """
+        size = self.backpack_size
+        cfg = read_group_snapshot(gid, today)
+        if not wife_stats_ready(cfg, size):
+            async with GroupTransaction(gid, today) as txn:
+                cfg = txn.cfg
+                if not wife_stats_ready(cfg, size):
+                    rebuild_wife_stats(cfg, size, today)
+                    txn.mark_dirty()
+                    metrics.inc("wife_stats_rebuilds")
+        return cfg
+
+    async def show_collection(self, event: AstrMessageEvent, ctx: CommandContext):
+        """我的图鉴：曾经获得过的老婆（位图）占当前图库的比例，按作品列出进度"""
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        if catalog_index.error is not None:
+            yield event.plain_result(f"{nick}，图鉴数据需要管理员修复，暂时无法查看哦~")
+            return
+        imgs = await self._list_wife_images()
+        if not imgs:
+            yield event.plain_result(f"{nick}，图库还是空的，暂时没有图鉴哦~")
+            return
+        # 只读：无锁读取已提交的群配置副本
+        cfg = read_group_snapshot(gid, today)
+        bits = user_collection(cfg, uid, self.backpack_size, today)
+        progress = catalog_index.completion(bits, imgs)
+        total = sum(m for _, m in progress.values())
+        got = sum(n for n, _ in progress.values())
+        rows = [(src, n, m) for src, (n, m) in progress.items()]
+        rows = sorted((r for r in rows if r[1]), key=lambda r: (-r[1] / r[2], -r[1], r[0]))
+
+        lines = [f"{nick}的图鉴：已收集 {got}/{total}（{got / total:.2%}）" if total else f"{nick}的图鉴："]
+        if not rows:
+            lines.append("还没有收集到图库中的老婆，快去 /抽老婆 吧~")
+        else:
+            lines.append("按作品（收集进度最高的 10 部）：")
+            for src, n, m in rows[:10]:
+                name = src if src == "其他" else f"《{src}》"
+                lines.append(f"• {name} {n}/{m}（{n / m:.1%}）")
+            if len(rows) > 10:
+                lines.append(f"……共涉及 {len(rows)} 部作品")
+        yield event.plain_result("\n".join(lines))
+
+    async def show_provenance(self, event: AstrMessageEvent, ctx: CommandContext):
+        """老婆来历 [@用户] <编号>：按来历日志的索引追溯该槽位老婆的转手链"""
+        gid, uid, nick, today = ctx.gid, ctx.uid, ctx.nick, ctx.today
+        size = self.backpack_size
+        owner = ctx.at_target or uid
+        if len(ctx.numbers) != 1 or not 1 <= ctx.numbers[0] <= size + 1:
+            yield event.plain_result(f"{nick}，用法：/老婆来历 [@用户] <编号>（编号 1-{size + 1}，{size + 1} 为临时位）")
+            return
+        slot = ctx.numbers[0]
+        slot_name = "临时" if slot == size + 1 else str(slot)
+
+        # 只读：无锁读取已提交的群配置副本
+        cfg = read_group_snapshot(gid, today)
+        owner_nick = get_cfg_nick(cfg, str(owner), str(owner))
+        who = "你" if owner == uid else owner_nick
+        img = get_slot_entry(cfg, str(owner), today, size, slot, nick_default=owner_nick)[0]
+        if not img:
+            yield event.plain_result(f"{nick}，{who}的{slot_name}号老婆位还是空的哦~")
+            return
+        chain = provenance_chain(provenance.entries(gid, normalize_img_id(img) or img), str(owner))
+        name = format_wife_name(img)
+        if not chain:
+            yield event.plain_result(f"{nick}，{who}的{slot_name}号老婆 {name} 没有转手记录（抽到/换到的老婆不记录来历）。")
+            return
+        lines = [f"{nick}，{who}的{slot_name}号老婆 {name} 的来历（从早到晚）："]
+        lines += [f"{i}. {format_provenance_entry(cfg, e)}" for i, e in enumerate(reversed(chain), start=1)]
+        if len(chain) >= PROVENANCE_CHAIN_MAX:
+            lines.append(f"（只显示最近 {PROVENANCE_CHAIN_MAX} 次转手）")
+        yield event.plain_result("\n".join(lines))
+
+    async def check_data_integrity(self, event: AstrMessageEvent, ctx: CommandContext):
+        """并行体检全部数据文件，隔离损坏文件（仅管理员）"""
+        if ctx.uid not in self.admins:
+            yield event.plain_result(f"{ctx.nick}，该命令仅管理员可用哦~")
+            return
+        if self._integrity_lock.locked():
+            yield event.plain_result("数据体检正在进行中，请稍后再试~")
+            return
+        async with self._integrity_lock:
+            summary = await run_integrity_scan(self.integrity_scan_workers)
+        yield event.plain_result(format_integrity_report(summary))
+
+    async def export_all_data(self, event: AstrMessageEvent, ctx: CommandContext):
+        """逐群导出全部数据为 JSONL（仅管理员）；带 gz 参数时 gzip 压缩"""
+        if ctx.uid not in self.admins:
+            yield event.plain_result(f"{ctx.nick}，该命令仅管理员可用哦~")
+            return
+        if self._backup_lock.locked():
+            yield event.plain_result("数据导出/导入正在进行中，请稍后再试~")
+            return
+        ext = ".jsonl.gz" if "gz" in ctx.tokens else ".jsonl"
+        name = f"animewife-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        path = os.path.join(BACKUP_DIR, name)
+        started = time.perf_counter()
+        async with self._backup_lock:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            done = 0
+            try:
+                async for done, _ in export_data(path, ctx.today):
+                    pass
+            except (OSError, ValueError) as e:
+                yield event.plain_result(f"导出失败：{e}")
+                return
+        size_kb = os.path.getsize(path) / 1024
+        elapsed = time.perf_counter() - started
+        yield event.plain_result(f"已导出 {done} 个群的数据（{size_kb:.1f} KB，耗时 {elapsed:.1f} 秒）：{name}")
+
+    async def import_all_data(self, event: AstrMessageEvent, ctx: CommandContext):
+        """从 backups 目录下的导出文件流式导入数据（仅管理员），按批报告进度"""
+        if ctx.uid not in self.admins:
+            yield event.plain_result(f"{ctx.nick}，该命令仅管理员可用哦~")
+            return
+        # 只接受 BACKUP_DIR 下的文件名，不接受路径
+        name = ctx.tokens[0] if ctx.tokens else ""
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            yield event.plain_result("请指定 backups 目录下的导出文件名，例如：老婆导入 animewife-20250101-120000.jsonl")
+            return
+        path = os.path.join(BACKUP_DIR, name)
+        if not os.path.isfile(path):
+            yield event.plain_result(f"找不到导出文件：{name}")
+            return
+        if self._backup_lock.locked():
+            yield event.plain_result("数据导出/导入正在进行中，请稍后再试~")
+            return
+        started = time.perf_counter()
+        done = 0
+        async with self._backup_lock:
+            next_report = 0.25
+            try:
+                async for done, total in import_data(path, ctx.today):
+                    logger.info(f"[animewife] 导入 {name}：{done}/{total} 个群")
+                    if total and done < total and done / total >= next_report:
+                        while done / total >= next_report:
+                            next_report += 0.25
+                        yield event.plain_result(f"导入进度：{done}/{total} 个群")
+            except (OSError, EOFError, ValueError) as e:
+                yield event.plain_result(f"导入中止（已导入 {done} 个群）：{e}")
+                return
+        elapsed = time.perf_counter() - started
+        yield event.plain_result(f"已导入 {done} 个群的数据（耗时 {elapsed:.1f} 秒）。")
+
+    async def show_stats(self, event: AstrMessageEvent, ctx: CommandContext):
+        """查看插件运行统计（仅管理员）"""
+        if ctx.uid not in self.admins:
+            yield event.plain_result(f"{ctx.nick}，该命令仅管理员可用哦~")
+            return
+        # 老婆统计 锁 [重置]：锁竞争报告
+        if ctx.tokens and ctx.tokens[0] == "锁":
+            if len(ctx.tokens) > 1 and ctx.tokens[1] == "重置":
+                lock_profiler.reset()
+                yield event.plain_result("锁竞争统计已重置。")
+                return
+            yield event.plain_result(lock_profiler.report())
+            return
+        yield event.plain_result(self._format_stats())
+
+    def _format_stats(self) -> str:
+        uptime = int(time.time() - metrics.started_at)
+        lines = [f"【老婆统计】（统计时长 {uptime // 3600}时{uptime % 3600 // 60}分）", "命令：次数 / 平均 / p50 / p99（毫秒）"]
+        cmd_series = sorted(metrics.series("command_latency_ms"), key=lambda x: -x[1].total)
+        for labels, h in cmd_series:
+            lines.append(
+                f"• {labels.get('cmd')}：{h.total} / {h.mean:.1f} / {h.quantile(0.5):.1f} / {h.quantile(0.99):.1f}"
+            )
+        if not cmd_series:
+            lines.append("• 暂无")
+
+        lines.append("存储：次数 / 平均 / p99（毫秒）")
+        for labels, h in sorted(metrics.series("storage_latency_ms"), key=lambda x: x[0].get("op", "")):
+            lines.append(f"• {labels.get('op')}：{h.total} / {h.mean:.2f} / {h.quantile(0.99):.2f}")
+        writes = int(metrics.counter("file_writes"))
+        written = metrics.counter("bytes_written")
+        lines.append(f"• 累计写盘 {writes} 次，{written / 1024:.1f} KB")
+
+        cat_rate, cat_total = metrics.hit_rate("catalog_cache")
+        mem_rate, mem_total = metrics.hit_rate("member_cache")
+        grp_rate, grp_total = metrics.hit_rate("group_cache")
+        lines.append(
+            f"缓存命中率：图库 {cat_rate:.1%}（{cat_total} 次），群成员 {mem_rate:.1%}（{mem_total} 次），"
+            f"群配置 {grp_rate:.1%}（{grp_total} 次）"
+        )
 
-        return f"已自动取消 {len(to_cancel)} 条相关的交换请求并返还次数~"
+        http = metrics.series("http_fetch_latency_ms")
+        if http:
+            parts = [f"{lbl.get('status')}×{h.total} 平均{h.mean:.0f}ms" for lbl, h in http]
+            lines.append("图片列表请求：" + "，".join(parts))
+
+        if self.throttle.shed:
+            shed = "，".join(f"{cmd} {n}" for cmd, n in sorted(self.throttle.shed.items(), key=lambda x: -x[1]))
+            lines.append(f"限流丢弃：{shed}")
+        reuse_hits = int(metrics.counter("group_state_reuse", result="hit"))
+        reuse_conflicts = int(metrics.counter("group_state_reuse", result="conflict"))
+        if reuse_hits or reuse_conflicts:
+            lines.append(f"两阶段命令：复用第一阶段状态 {reuse_hits} 次，版本冲突后重新解析 {reuse_conflicts} 次")
+        repaired = int(metrics.counter("repairs_applied"))
+        if repaired:
+            lines.append(f"一致性修复：已修复 {repaired} 条今日老婆记录，待后台修复 {len(repairer)} 个群")
+        expired = int(metrics.counter("swap_requests_expired"))
+        if expired:
+            lines.append(f"过期清理交换请求：{expired} 条")
+        if shared_lock.enabled:
+            waits = metrics.series(f"{shared_lock.metric}_wait_ms")
+            total = sum(h.total for _, h in waits)
+            p99 = max((h.quantile(0.99) for _, h in waits), default=0.0)
+            if redis_store is not None:
+                conflicts = sum(v for (n, _), v in metrics.counters.items() if n == "storage_conflicts")
+                lines.append(f"跨节点锁（Redis）：加锁 {total} 次，最慢一类 p99 {p99:.1f}ms，提交冲突 {int(conflicts)} 次")
+            else:
+                reloads = sum(v for (n, _), v in metrics.counters.items() if n == "shared_reloads")
+                lines.append(f"跨进程锁：加锁 {total} 次，最慢一类 p99 {p99:.1f}ms，重新加载 {int(reloads)} 次")
+        return "\n".join(lines)
+
+    # ==================== 辅助方法 ====================
 
     async def terminate(self):
         """插件卸载时清理资源"""
-        global config_locks, records, swap_requests, ntr_statuses
+        global config_locks, records, ntr_statuses, state_loaded, _state_task, _preload_task
+
+        for task in self._bg_tasks:
+            task.cancel()
+        self._bg_tasks.clear()
+        if _preload_task is not None:
+            _preload_task.cancel()
         
         # 清理群组配置锁
         config_locks.clear()
         
         # 清理全局数据
         records.clear()
-        swap_requests.clear()
+        swap_store.clear()
+        repairer.clear()
         ntr_statuses.clear()
+        group_cache.clear()
+        catalog_index.clear()
+        provenance.clear()
+        use_file_backend()
+        # 重新启用时按需重新加载
+        state_loaded = False
+        _state_task = None
+        _preload_task = None
@@ -0,0 +1,113 @@
+"""
+测试公共夹具：在 bench.harness 的替身 AstrBot 环境中导入一次 main.py（模块有导入期全局状态），
+每个用例开始前清空数据目录与进程内 fakeredis，用例内通过 ``run`` 在新的事件循环中驱动插件。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.harness import (  # noqa: E402
+    FakeBot, FakeEvent, dispatch, load_plugin_module, make_catalog, make_plugin, reset_fakeredis,
+)
+
+BACKENDS = ("file", "redis")
+
+BASE_CONFIG = {
+    "rng_seed": "7",
+    "ntr_max": 3,
+    "ntr_possibility": 1.0,
+    "change_max_per_day": 3,
+    "swap_max_per_day": 2,
+    "backpack_size": 5,
+}
+
+
+@pytest.fixture(scope="session")
+def wife():
+    module = load_plugin_module(tempfile.mkdtemp(prefix="animewife-test-"))
+    make_catalog(module, 60)
+    return module
+
+
+def reset_storage(module) -> None:
+    shutil.rmtree(module.CONFIG_DIR, ignore_errors=True)
+    os.makedirs(module.CONFIG_DIR, exist_ok=True)
+    reset_fakeredis()
+
+
+@pytest.fixture(autouse=True)
+def clean_data(wife):
+    reset_storage(wife)
+    yield
+
+
+def storage_config(backend: str) -> dict:
+    if backend == "redis":
+        return {"storage_backend": "redis", "redis_url": "fakeredis://"}
+    return {}
+
+
+class Chat:
+    """一个插件实例 + 一个群：say() 发送一条消息并返回回复文本。"""
+
+    def __init__(self, module, plugin, gid: int = 1):
+        self.module = module
+        self.plugin = plugin
+        self.gid = gid
+        self.bot = FakeBot()
+
+    async def restart(self, *, wipe: bool = False) -> None:
+        """卸载插件并用同一配置重新构造（内存状态清空，数据从存储重新加载；wipe 时先清空存储）。"""
+        config, admins = self.plugin.config, self.plugin.admins
+        await self.plugin.terminate()
+        if wipe:
+            reset_storage(self.module)
+        self.plugin = make_plugin(self.module, config, admins=admins)
+        await self.module.ensure_state_loaded()
+
+    async def say(self, uid, text: str, at=(), *, gid=None) -> str:
+        event = FakeEvent(self.gid if gid is None else gid, uid, text, at_targets=list(at), bot=self.bot)
+        return "\n".join(reply_text(r) for r in await dispatch(self.plugin, event))
+
+    def cfg(self, gid=None) -> dict:
+        return self.module.read_group_snapshot(str(self.gid if gid is None else gid), self.module.get_today())
+
+
+def reply_text(res) -> str:
+    kind, body = res
+    if kind == "plain":
+        return body
+    return "".join(getattr(seg, "text", "") for seg in body)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request) -> str:
+    return request.param
+
+
+@pytest.fixture
+def run(wife):
+    """run(test, config=None)：构造插件并在新的事件循环中执行 ``await test(chat)``，结束时卸载插件。"""
+
+    def _run(test, config: dict | None = None, *, admins=("1",)):
+        async def main():
+            chat = Chat(wife, make_plugin(wife, {**BASE_CONFIG, **(config or {})}, admins=admins))
+            await wife.ensure_state_loaded()
+            try:
+                return await test(chat)
+            finally:
+                await chat.plugin.terminate()
+
+        return asyncio.run(main())
+
+    return _run
@@ -0,0 +1,174 @@
+"""文件 / Redis（fakeredis）两种存储后端上的核心流程，以及 Redis 后端的冲突回滚与跨节点锁。"""
+
+from __future__ import annotations
+
+import pytest
+
+from conftest import storage_config
+
+
+def slot_img(chat, uid, slot=1):
+    m = chat.module
+    return m.get_slot_entry(chat.cfg(), str(uid), m.get_today(), chat.plugin.backpack_size, slot)[0]
+
+
+async def count(chat, kind, uid):
+    m = chat.module
+    async with m.GroupTransaction(str(chat.gid), m.get_today(), records=True) as txn:
+        return txn.count(kind, str(uid))
+
+
+def test_draw_persists_across_restart(run, backend):
+    async def test(chat):
+        await chat.say(5, "抽老婆")
+        img = slot_img(chat, 5)
+        assert img
+        await chat.say(5, "换老婆")
+        changed = slot_img(chat, 5)
+        assert await count(chat, "change", 5) == 1
+        await chat.restart()
+        assert slot_img(chat, 5) == changed
+        assert await count(chat, "change", 5) == 1
+        assert chat.module.format_wife_name(changed) in await chat.say(5, "查老婆 1")
+
+    run(test, storage_config(backend))
+
+
+def test_ntr_moves_wife_and_counts(run, backend):
+    async def test(chat):
+        await chat.say(5, "抽老婆")
+        victim = slot_img(chat, 5)
+        reply = await chat.say(6, "牛老婆 1", [5])
+        assert "牛" in reply
+        assert slot_img(chat, 5) is None
+        assert slot_img(chat, 6) == victim
+        assert await count(chat, "ntr", 6) == 1
+
+    run(test, storage_config(backend))
+
+
+def test_swap_and_agree(run, backend):
+    async def test(chat):
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "抽老婆")
+        a, b = slot_img(chat, 5), slot_img(chat, 6)
+        await chat.say(5, "交换老婆 1 1", [6])
+        assert "5" in chat.module.swap_store.committed(str(chat.gid))
+        await chat.restart()  # 请求与次数都能从存储中恢复
+        assert await count(chat, "swap", 5) == 1
+        await chat.say(6, "同意交换", [5])
+        assert (slot_img(chat, 5), slot_img(chat, 6)) == (b, a)
+        assert chat.module.swap_store.committed(str(chat.gid)) == {}
+        assert await count(chat, "swap", 5) == 1
+
+    run(test, storage_config(backend))
+
+
+def group_state(m, gid):
+    store, client = m.redis_store, m.redis_store.client
+    return (
+        client.hgetall(store.key("g", gid)),
+        client.hgetall(store.key("bp", gid)),
+        client.hgetall(store.key("sw", gid)),
+        client.get(store.key("v", "g", gid)),
+        store.export_records(),
+    )
+
+
+def race_before_commit(monkeypatch, m, version_key):
+    """下一次核对 version_key 的提交之前，模拟另一个节点改写该版本号。"""
+    store = m.redis_store
+    transact = store._transact
+
+    def racing(build, *, bump, expected=None, data=""):
+        if expected and version_key in expected:
+            monkeypatch.setattr(store, "_transact", transact)
+            store.client.incr(version_key)
+        return transact(build, bump=bump, expected=expected, data=data)
+
+    monkeypatch.setattr(store, "_transact", racing)
+
+
+def test_redis_swap_conflict_leaves_group_untouched(run, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        gid = str(chat.gid)
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "抽老婆")
+        a, b = slot_img(chat, 5), slot_img(chat, 6)
+        await chat.say(5, "交换老婆 1 1", [6])
+        before = group_state(m, gid)
+        race_before_commit(monkeypatch, m, m.redis_store.key("v", "s", gid))
+        assert "操作冲突" in await chat.say(6, "同意交换", [5])
+        assert group_state(m, gid) == before
+        assert (slot_img(chat, 5), slot_img(chat, 6)) == (a, b)
+        assert m.swap_store.get(gid, "5") is not None
+        # 重试只交换一次
+        await chat.say(6, "同意交换", [5])
+        assert (slot_img(chat, 5), slot_img(chat, 6)) == (b, a)
+        await chat.say(6, "同意交换", [5])
+        assert (slot_img(chat, 5), slot_img(chat, 6)) == (b, a)
+
+    run(test, storage_config("redis"))
+
+
+def test_redis_conflict_rolls_back_counters(run, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        gid = str(chat.gid)
+        await chat.say(5, "抽老婆")
+        victim = slot_img(chat, 5)
+        before = group_state(m, gid)
+        race_before_commit(monkeypatch, m, m.redis_store.key("v", "g", gid))
+        assert "操作冲突" in await chat.say(6, "牛老婆 1", [5])
+        assert group_state(m, gid)[:3] == before[:3]
+        assert await count(chat, "ntr", 6) == 0
+        assert slot_img(chat, 5) == victim and slot_img(chat, 6) is None
+        await chat.say(6, "牛老婆 1", [5])
+        assert slot_img(chat, 6) == victim
+        assert await count(chat, "ntr", 6) == 1
+
+    run(test, storage_config("redis"))
+
+
+def test_redis_lock_release_checks_token(run):
+    async def test(chat):
+        m = chat.module
+        lock, client = m.shared_lock, m.redis_store.client
+        key = m.redis_store.key("lock", "group-9")
+        await lock.acquire("group-9")
+        token = client.get(key)
+        assert token
+        assert not m.RedisDataLock(m.redis_store)._try_acquire("group-9")  # 其他节点拿不到
+        lock.release("group-9")
+        assert client.get(key) is None
+        # 锁过期后被其他节点获得：释放时不能删掉对方的锁
+        await lock.acquire("group-9")
+        client.set(key, "other-node")
+        lock.release("group-9")
+        assert client.get(key) == "other-node"
+        client.delete(key)
+
+    run(test, storage_config("redis"))
+
+
+@pytest.mark.parametrize("kind", ["group", "swap"])
+def test_redis_commit_group_is_all_or_nothing(run, kind):
+    async def test(chat):
+        m = chat.module
+        store = m.redis_store
+        today = m.get_today()
+        async with m.GroupTransaction("1", today, swaps=True) as txn:
+            txn.cfg["5"] = {"date": today, "img": "作品1!角色1.jpg", "nick": "n"}
+            txn.mark_dirty()
+        before = group_state(m, "1")
+        with pytest.raises(m.StorageConflict):
+            async with m.GroupTransaction("1", today, swaps=True) as txn:
+                txn.cfg["6"] = {"date": today, "img": "作品2!角色2.jpg", "nick": "n"}
+                txn.mark_dirty()
+                txn.put_swap("6", {"target": "5", "date": today})
+                store.client.incr(store.key("v", "g" if kind == "group" else "s", "1"))
+        assert group_state(m, "1")[:3] == before[:3]
+        assert m.swap_store.get("1", "6") is None
+
+    run(test, storage_config("redis"))
@@ -0,0 +1,95 @@
+"""稀疏背包：槽位读写、找空位、分页与旧格式兼容。"""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+
+@pytest.mark.parametrize("size", [1, 7, 100, 1000])
+def test_backpack_matches_list_model(wife, size):
+    rng = random.Random(size)
+    bp = wife.Backpack(size)
+    model: list = [None] * size
+    for step in range(2000):
+        slot = rng.randrange(0, size + 2)  # 含越界槽位
+        entry = None if rng.random() < 0.4 else f"作品{step}!角色{step}.jpg"
+        bp.set(slot, entry)
+        if 1 <= slot <= size:
+            model[slot - 1] = entry
+        if step % 7 == 0:
+            free = [i for i, x in enumerate(model, 1) if not x]
+            assert bp.first_empty() == (free[0] if free else None)
+        assert bp.used == sum(1 for x in model if x)
+    assert bp.occupied() == [(i, x) for i, x in enumerate(model, 1) if x]
+    assert bp.raw() == {str(i): x for i, x in enumerate(model, 1) if x}
+    assert all(bp.get(i) == x for i, x in enumerate(model, 1))
+
+
+def test_first_empty_when_full_and_after_clear(wife):
+    bp = wife.Backpack(3)
+    for i in (1, 2, 3):
+        bp.set(i, f"x{i}")
+    assert bp.first_empty() is None
+    bp.set(2, None)
+    assert bp.first_empty() == 2
+    bp.set(2, {"img": "y", "note": None})
+    assert bp.first_empty() is None
+
+
+@pytest.mark.parametrize("per_page", [1, 3, 20])
+def test_pages(wife, per_page):
+    bp = wife.Backpack(500)
+    slots = random.Random(per_page).sample(range(1, 501), 47)
+    for s in slots:
+        bp.set(s, f"x{s}")
+    ordered = sorted(slots)
+    assert bp.pages(per_page) == -(-47 // per_page)
+    for p in range(1, bp.pages(per_page) + 1):
+        assert [i for i, _ in bp.page(p, per_page)] == ordered[(p - 1) * per_page:p * per_page]
+    assert bp.page(bp.pages(per_page) + 1, per_page) == []
+    assert wife.Backpack(5).pages(per_page) == 1
+
+
+def test_normalize_backpack_formats(wife):
+    sparse = {"1": "a.jpg", "3": {"img": "b.jpg", "note": "牛自用户x", "extra": 1}, "9": "c.jpg", "x": "d.jpg", "2": ""}
+    bp = wife.normalize_backpack(sparse, 5)
+    assert bp.occupied() == [(1, "a.jpg"), (3, {"img": "b.jpg", "note": "牛自用户x"})]
+    legacy = wife.normalize_backpack(["a.jpg", None, {"img": ""}, "d.jpg", "e.jpg"], 4)
+    assert legacy.occupied() == [(1, "a.jpg"), (4, "d.jpg")]
+    assert wife.normalize_backpack(None, 5).occupied() == []
+    assert wife.normalize_backpack(sparse, 0).size == 0
+    assert wife.backpack_slot_entry(sparse, 3, 5) == {"img": "b.jpg", "note": "牛自用户x"}
+    assert wife.backpack_slot_entry(sparse, 9, 5) is None
+    assert wife.backpack_slot_entry(["a.jpg", "b.jpg"], 2, 5) == "b.jpg"
+    assert wife.backpack_slot_entry(["a.jpg"], 2, 5) is None
+
+
+@pytest.mark.parametrize("slots, size, text", [
+    ([], 5, "1-5"),
+    ([1, 2, 3], 3, ""),
+    ([1, 3, 4], 7, "2、5-7"),
+    ([2, 5], 6, "1、3-4、6"),
+])
+def test_format_empty_slots(wife, slots, size, text):
+    bp = wife.Backpack(size)
+    for s in slots:
+        bp.set(s, "x")
+    assert wife.format_empty_slots(bp) == text
+
+
+def test_legacy_list_is_rewritten_sparse(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        async with m.GroupTransaction("1", today) as txn:
+            txn.cfg[m.BACKPACKS_KEY] = {"5": ["作品1!角色1.jpg", None, None, "作品2!角色2.jpg", None]}
+            txn.mark_dirty()
+        listing = await chat.say(5, "老婆背包")
+        assert "1. " in listing and "4. " in listing and "空位：2-3、5号" in listing
+        await chat.say(5, "抽老婆")  # 写入第一个空位
+        stored = chat.cfg()[m.BACKPACKS_KEY]["5"]
+        assert isinstance(stored, dict) and sorted(stored) == ["1", "2", "4"]
+
+    run(test)
@@ -0,0 +1,84 @@
+"""老婆背包分页：页码范围、每页内容与空位所在页，以及合并转发与超过页数上限时的翻页回退。"""
+
+from __future__ import annotations
+
+from bench.harness import FakeEvent, Nodes, dispatch
+
+
+async def seed_backpack(m, uid, slots):
+    async with m.GroupTransaction("1", m.get_today()) as txn:
+        txn.cfg[m.BACKPACKS_KEY] = {uid: {str(i): f"作品{i}!角色{i}.jpg" for i in slots}}
+        txn.mark_dirty()
+
+
+async def backpack(chat, text):
+    """发送一条老婆背包命令，返回唯一的一条回复 (kind, body)。"""
+    [res] = await dispatch(chat.plugin, FakeEvent(chat.gid, 5, text, bot=chat.bot))
+    return res
+
+
+def listed_slots(text):
+    return [int(line.split(".")[0]) for line in text.splitlines() if line[:1].isdigit() and "临时位" not in line]
+
+
+def test_pages_cover_occupied_slots_in_order(run):
+    async def test(chat):
+        m = chat.module
+        await seed_backpack(m, "5", [9, 2, 5, 7, 3])
+        first = await chat.say(5, "老婆背包")
+        assert listed_slots(first) == [2, 3]
+        assert "（第 1/3 页）" in first and "共 3 页，用 /老婆背包 <页码> 翻页。" in first
+        assert "空位" not in first
+        assert listed_slots(await chat.say(5, "老婆背包 2")) == [5, 7]
+        last = await chat.say(5, "老婆背包 3")
+        assert listed_slots(last) == [9]
+        assert "空位：1、4、6、8、10号" in last  # 空位区间只在最后一页
+        assert "11. (空)（临时位）" in last
+
+    run(test, {"backpack_size": 10, "backpack_page_size": 2})
+
+
+def test_page_out_of_range(run):
+    async def test(chat):
+        m = chat.module
+        await seed_backpack(m, "5", [1, 2, 3])
+        for page in (0, 3):
+            assert "页码超出范围啦，这个背包共 2 页~" in await chat.say(5, f"老婆背包 {page}")
+        assert "用法：/老婆背包 [@用户] [页码]" in await chat.say(5, "老婆背包 1 2")
+        # 空背包也有 1 页
+        assert "老婆背包（0/10" in await chat.say(6, "老婆背包 1")
+
+    run(test, {"backpack_size": 10, "backpack_page_size": 2})
+
+
+def test_forward_merges_all_pages(run):
+    async def test(chat):
+        m = chat.module
+        await seed_backpack(m, "5", range(1, 6))
+        kind, chain = await backpack(chat, "老婆背包")
+        assert kind == "chain" and isinstance(chain[0], Nodes)
+        texts = [node.content[0].text for node in chain[0].nodes]
+        assert len(texts) == 2 + 3  # 标题 + 每页一个节点 + 提示
+        assert [listed_slots(t) for t in texts[1:-1]] == [[1, 2], [3, 4], [5]]
+        assert "翻页" not in texts[-1]
+        # 指定页码、或只有一页时照常发文本
+        assert (await backpack(chat, "老婆背包 2"))[0] == "plain"
+        assert (await dispatch(chat.plugin, FakeEvent(1, 6, "老婆背包", bot=chat.bot)))[0][0] == "plain"
+
+    run(test, {"backpack_size": 10, "backpack_page_size": 2, "backpack_forward": True})
+
+
+def test_forward_falls_back_to_paging_beyond_max_pages(run):
+    async def test(chat):
+        m = chat.module
+        pages = m.BACKPACK_FORWARD_MAX_PAGES + 3
+        await seed_backpack(m, "5", range(1, pages + 1))
+        kind, chain = await backpack(chat, "老婆背包")
+        assert kind == "chain"
+        texts = [node.content[0].text for node in chain[0].nodes]
+        assert len(texts) == 2 + m.BACKPACK_FORWARD_MAX_PAGES
+        assert listed_slots(texts[-2]) == [m.BACKPACK_FORWARD_MAX_PAGES]
+        assert f"共 {pages} 页，用 /老婆背包 <页码> 翻页。" in texts[-1]
+        assert listed_slots(await chat.say(5, f"老婆背包 {pages}")) == [pages]
+
+    run(test, {"backpack_size": 100, "backpack_page_size": 1, "backpack_forward": True})
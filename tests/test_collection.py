@@ -0,0 +1,165 @@
+"""图鉴：位图编码、图库编号与导入时的序号换算。"""
+
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+
+def test_bitset_round_trip_random(wife):
+    rng = random.Random(46)
+    for _ in range(3000):
+        span = rng.choice([8, 64, 1000, 50000])
+        k = rng.randrange(0, min(span, 300) + 1)
+        marks = sorted(rng.sample(range(span), k))
+        bits = wife.bitset_from(marks)
+        assert list(wife.iter_bits(bits)) == marks
+        text = wife.encode_bitset(bits)
+        assert wife.decode_bitset(text) == bits
+        raw_len = (bits.bit_length() + 7) // 8
+        assert len(text) <= 1 + (raw_len + 2) // 3 * 4
+
+
+def test_encoding_picks_shorter_form(wife):
+    assert wife.encode_bitset(0) == ""
+    assert wife.decode_bitset("") == 0
+    sparse = wife.encode_bitset(wife.bitset_from([5, 40000]))
+    dense = wife.encode_bitset(wife.bitset_from(list(range(0, 800, 2))))
+    assert sparse[0] == "s" and len(sparse) < 12
+    assert dense[0] == "b"
+    # 差值跨多个 varint 字节
+    big = wife.bitset_from([0, 127, 128, 128 + 16384, 10 ** 6])
+    assert wife.decode_bitset(wife.encode_bitset(big)) == big
+
+
+@pytest.mark.parametrize("text", [None, 12, "x", "s", "q" + "AAAA", "b!!!", "s%%%"])
+def test_decode_garbage_is_empty(wife, text):
+    assert wife.decode_bitset(text) == 0
+
+
+def test_remap_bitset(wife):
+    bits = wife.bitset_from([0, 2, 9])
+    assert list(wife.iter_bits(wife.remap_bitset(bits, [5, 1, 0]))) == [0, 5]
+    assert wife.remap_bitset(0, [1]) == 0
+
+
+def test_catalog_index_remap_table(run):
+    async def test(chat):
+        idx = chat.module.catalog_index
+        await idx.sync(["a", "b", "c"])
+        assert await idx.sync(["a", "b"]) == 0
+        assert idx.remap_table(["a", "b", "c"]) is None
+        assert idx.remap_table(["a", "b"]) is None
+        await idx.sync(["c", "a", "d"])
+        assert idx.remap_table(["c", "a", "d"]) == [2, 0, 3]
+        # 编号持久化：重启后序号不变
+        await chat.restart()
+        idx = chat.module.catalog_index
+        idx.load()
+        assert idx.names == ["a", "b", "c", "d"]
+
+    run(test)
+
+
+def write_backup(path, version, collection, names=None):
+    lines = [{"type": "meta", "version": version, "groups": 1}]
+    if names is not None:
+        lines.append({"type": "catalog", "names": names})
+    lines.append({
+        "type": "group", "gid": "1", "records": {}, "swaps": {}, "ntr": None,
+        "config": {"__wife_collection__": collection},
+    })
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+async def import_file(m, path):
+    async for _ in m.import_data(path, m.get_today()):
+        pass
+
+
+def test_import_v2_remaps_to_local_indexes(run, tmp_path):
+    path = str(tmp_path / "v2.jsonl")
+
+    async def test(chat):
+        m = chat.module
+        await m.catalog_index.sync(["a", "b", "c"])
+        write_backup(path, 2, {"5": m.encode_bitset(m.bitset_from([0, 3]))}, names=["c", "a", "b", "d"])
+        await import_file(m, path)
+        bits = m.decode_bitset(chat.cfg()[m.COLLECTION_KEY]["5"])
+        assert [m.catalog_index.names[i] for i in m.iter_bits(bits)] == ["c", "d"]
+
+    run(test)
+
+
+def test_import_v1_keeps_bitsets(run, tmp_path):
+    path = str(tmp_path / "v1.jsonl")
+
+    async def test(chat):
+        m = chat.module
+        await m.catalog_index.sync(["a", "b", "c"])
+        encoded = m.encode_bitset(m.bitset_from([1]))
+        write_backup(path, 1, {"5": encoded})
+        await import_file(m, path)
+        assert chat.cfg()[m.COLLECTION_KEY]["5"] == encoded
+
+    run(test)
+
+
+def test_collect_wife_and_command(run):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        await chat.say(5, "换老婆")
+        bits = m.decode_bitset(chat.cfg()[m.COLLECTION_KEY]["5"])
+        assert bits.bit_count() == 2
+        cfg = chat.cfg()
+        img = m.catalog_index.names[next(m.iter_bits(bits))]
+        assert not m.collect_wife(cfg, "5", img)  # 已收集
+        assert not m.collect_wife(cfg, "5", m.MEMBER_ID_PREFIX + "123")  # 群成员老婆不计入
+        assert "已收集 2/60" in await chat.say(5, "我的图鉴")
+
+    run(test)
+
+
+def test_corrupt_catalog_index_disables_collection(run, tmp_path):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        await chat.say(5, "换老婆")
+
+        def collected():
+            bits = m.decode_bitset(chat.cfg()[m.COLLECTION_KEY]["5"])
+            return {m.catalog_index.names[i] for i in m.iter_bits(bits)}
+
+        before = collected()
+        with open(m.CATALOG_INDEX_FILE, "rb") as f:
+            good = f.read()
+        with open(m.CATALOG_INDEX_FILE, "wb") as f:
+            f.write(b'{"names": ["')
+        await chat.restart()
+        assert m.catalog_index.error and m.catalog_index.names == []
+        assert "管理员修复" in await chat.say(5, "我的图鉴")
+        # 停用期间不重新编号、不记录图鉴，也不导出 / 导入编号
+        await chat.say(6, "抽老婆")
+        await chat.say(5, "换老婆")
+        assert m.COLLECTION_KEY not in chat.cfg() or "6" not in chat.cfg()[m.COLLECTION_KEY]
+        summary = await m.run_integrity_scan(1)
+        assert summary["quarantined"] == []
+        with open(m.CATALOG_INDEX_FILE, "rb") as f:
+            assert f.read() == b'{"names": ["'
+        with pytest.raises(ValueError, match="图库编号"):
+            async for _ in m.export_data(str(tmp_path / "x.jsonl"), m.get_today()):
+                pass
+        # 从备份恢复编号文件后，已有的位图仍指向原来的图片
+        with open(m.CATALOG_INDEX_FILE, "wb") as f:
+            f.write(good)
+        await chat.restart()
+        assert m.catalog_index.error is None
+        assert collected() == before
+        assert "已收集" in await chat.say(5, "我的图鉴")
+
+    run(test)
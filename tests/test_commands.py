@@ -0,0 +1,76 @@
+"""命令解析（parse_command / CommandContext）与分发到处理函数。"""
+
+from __future__ import annotations
+
+COMMANDS = ["老婆帮助", "抽老婆", "查老婆", "老婆背包", "牛老婆", "换老婆", "交换老婆", "同意交换"]
+
+
+def parse(wife, text, **kw):
+    kw.setdefault("gid", 100)
+    kw.setdefault("uid", 200)
+    kw.setdefault("nick", "甲")
+    kw.setdefault("today", "2024-01-01")
+    return wife.parse_command(text, COMMANDS, **kw)
+
+
+def test_parse_command_splits_args_and_numbers(wife):
+    ctx = parse(wife, "牛老婆 3 小明 x7", at_targets=[300, "400"])
+    assert ctx.cmd == "牛老婆"
+    assert ctx.args == "3 小明 x7"
+    assert ctx.tokens == ["3", "小明", "x7"]
+    assert ctx.numbers == [3]
+    assert (ctx.gid, ctx.uid, ctx.nick, ctx.today) == ("100", "200", "甲", "2024-01-01")
+    assert ctx.at_targets == ["300", "400"]
+    assert ctx.at_target == "300"
+
+
+def test_parse_command_strips_wake_prefix_and_whitespace(wife):
+    for text in ("/查老婆 2", "! 查老婆 2", "#查老婆 2", "  查老婆   2  "):
+        ctx = parse(wife, text)
+        assert (ctx.cmd, ctx.args, ctx.numbers) == ("查老婆", "2", [2])
+
+
+def test_parse_command_without_args(wife):
+    ctx = parse(wife, "抽老婆")
+    assert (ctx.cmd, ctx.args, ctx.tokens, ctx.numbers) == ("抽老婆", "", [], [])
+    assert ctx.at_targets == [] and ctx.at_target is None
+
+
+def test_parse_command_first_match_in_command_order(wife):
+    # “交换老婆”不能被“换老婆”截走：命令表中靠前的先匹配
+    assert parse(wife, "交换老婆 1 2").cmd == "交换老婆"
+    assert wife.parse_command("换老婆", ["换", "换老婆"], gid=1, uid=2, nick="", today="").cmd == "换"
+
+
+def test_parse_command_ignores_non_commands(wife):
+    for text in ("", "   ", "今天抽老婆了吗", "老婆", "/"):
+        assert parse(wife, text) is None
+
+
+def test_parse_command_keeps_plain_text(wife):
+    ctx = wife.parse_command("发老婆 角色1", ["发老婆"], gid=1, uid=2, nick="", today="", plain_text="发老婆 角色1 ")
+    assert ctx.plain_text == "发老婆 角色1 " and ctx.args == "角色1"
+
+
+def test_dispatch_draw_then_backpack(run):
+    async def test(chat):
+        draw = await chat.say(5, "抽老婆")
+        assert "用户5" in draw and "老婆" in draw
+        img, slot, _, _ = chat.module.resolve_today_entity(chat.cfg(), "5", chat.module.get_today(), 5)
+        assert img and slot == 1
+        listing = await chat.say(5, "老婆背包")
+        assert chat.module.format_wife_name(img) in listing
+        # 同一天再抽返回同一个老婆，不占新槽位
+        await chat.say(5, "抽老婆")
+        assert chat.module.get_user_backpack(chat.cfg(), "5", 5)[1].occupied() == [(1, img)]
+
+    run(test)
+
+
+def test_dispatch_ignores_chat_messages(run):
+    async def test(chat):
+        assert await chat.say(5, "大家好") == ""
+        assert await chat.say(5, "老婆") == ""
+        assert "5" not in chat.cfg()
+
+    run(test)
@@ -0,0 +1,139 @@
+"""老婆导出 / 老婆导入：逐群 JSONL 的往返与错误处理。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from conftest import storage_config
+
+
+def group_state(chat, gid="1"):
+    m = chat.module
+    recs = {kind: grp[gid] for kind, grp in m.export_records().items() if grp.get(gid)}
+    return chat.cfg(gid), recs, dict(m.swap_store.committed(gid)), m.ntr_statuses.get(gid)
+
+
+async def drain(gen) -> list:
+    return [progress async for progress in gen]
+
+
+async def populate(chat):
+    for uid in (5, 6, 7):
+        await chat.say(uid, "抽老婆")
+    await chat.say(5, "换老婆")
+    await chat.say(6, "牛老婆 1", [7])
+    await chat.say(5, "交换老婆 1 1", [6])
+    await chat.say(1, "切换ntr开关状态")
+    await chat.say(8, "抽老婆", gid=2)
+
+
+@pytest.mark.parametrize("name", ["backup.jsonl", "backup.jsonl.gz"])
+def test_round_trip(run, backend, tmp_path, name):
+    path = str(tmp_path / name)
+
+    async def test(chat):
+        m = chat.module
+        await populate(chat)
+        before = {gid: group_state(chat, gid) for gid in ("1", "2")}
+        assert await drain(m.export_data(path, m.get_today())) == [(1, 2), (2, 2)]
+        await chat.restart(wipe=True)
+        assert group_state(chat)[0] == {}
+        assert await drain(m.import_data(path, m.get_today(), batch_size=1)) == [(1, 2), (2, 2)]
+        await chat.restart()
+        assert {gid: group_state(chat, gid) for gid in ("1", "2")} == before
+
+    run(test, storage_config(backend))
+
+
+def test_import_only_replaces_listed_groups(run, tmp_path):
+    path = str(tmp_path / "backup.jsonl")
+
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        await drain(m.export_data(path, m.get_today()))
+        await chat.say(6, "抽老婆")  # 导出之后的修改被导入覆盖
+        await chat.say(9, "抽老婆", gid=3)  # 文件中没有的群不受影响
+        other = group_state(chat, "3")
+        await drain(m.import_data(path, m.get_today()))
+        assert "6" not in chat.cfg() and "5" in chat.cfg()
+        assert group_state(chat, "3") == other
+
+    run(test)
+
+
+def test_export_is_read_only_and_lock_free(run, backend, tmp_path):
+    path = str(tmp_path / "backup.jsonl")
+
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        await chat.say(5, "抽老婆")
+        await chat.say(5, "换老婆")
+        # 悬挂的今日槽位绑定：读取时会被一致性检查发现
+        async with m.GroupTransaction("1", today) as txn:
+            txn.cfg[m.BACKPACK_TODAY_SLOT_KEY]["6"] = {"date": today, "slot": 2}
+            txn.mark_dirty()
+        m.repairer.clear()
+        version = m.group_version("1")
+        async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+            # 持有该群的全部锁、且有未提交的修改时导出：不等锁，也导不出未提交的内容
+            txn.consume("change", "5", 3)
+            txn.put_swap("5", {"target": "6", "date": today})
+            await asyncio.wait_for(drain(m.export_data(path, today)), timeout=5)
+        with open(path, encoding="utf-8") as f:
+            line = [json.loads(x) for x in f][2]
+        if backend == "file":  # Redis 后端的次数是即时生效的计数器
+            assert line["records"]["change"]["5"]["count"] == 1
+        assert line["swaps"] == {}
+        assert "6" not in line["config"][m.BACKPACK_TODAY_SLOT_KEY]  # 导出的是修复后的副本
+        assert m.group_version("1") == version  # 没有写回群配置
+
+    run(test, storage_config(backend))
+
+
+def write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write((line if isinstance(line, str) else json.dumps(line, ensure_ascii=False)) + "\n")
+
+
+def test_bad_line_aborts_after_applied_batches(run, tmp_path):
+    path = str(tmp_path / "bad.jsonl")
+    write_lines(path, [
+        {"type": "meta", "version": 1, "groups": 3},
+        {"type": "group", "gid": "11", "config": {"x": 1}, "records": {}, "swaps": {}, "ntr": None},
+        "{not json",
+        {"type": "group", "gid": "12", "config": {"x": 2}, "records": {}, "swaps": {}, "ntr": None},
+    ])
+
+    async def test(chat):
+        m = chat.module
+        with pytest.raises(ValueError, match="第 3 行"):
+            await drain(m.import_data(path, m.get_today(), batch_size=1))
+        assert chat.cfg("11") == {"x": 1}
+        assert chat.cfg("12") == {}
+
+    run(test)
+
+
+@pytest.mark.parametrize("line, error", [
+    ({"type": "meta", "version": 99}, "版本"),
+    ({"type": "group", "gid": "abc", "config": {}}, "群数据"),
+    ({"type": "group", "gid": "1", "config": [1]}, "群数据"),
+    ({"type": "catalog", "names": [1, 2]}, "图库编号"),
+    ([1, 2], "不是对象"),
+])
+def test_rejects_invalid_lines(run, tmp_path, line, error):
+    path = str(tmp_path / "bad.jsonl")
+    write_lines(path, [line])
+
+    async def test(chat):
+        m = chat.module
+        with pytest.raises(ValueError, match=error):
+            await drain(m.import_data(path, m.get_today()))
+
+    run(test)
@@ -0,0 +1,107 @@
+"""数据体检：损坏文件隔离（而不是当作空数据覆盖）、并行扫描与加锁复核。"""
+
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def quarantine(wife, monkeypatch, tmp_path):
+    path = str(tmp_path / "quarantine")
+    monkeypatch.setattr(wife, "QUARANTINE_DIR", path)
+    return path
+
+
+def quarantined(path):
+    if not os.path.isdir(path):
+        return {}
+    out = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), "rb") as f:
+            out[name] = f.read()
+    return out
+
+
+def write(wife, name, payload: bytes):
+    with open(os.path.join(wife.CONFIG_DIR, name), "wb") as f:
+        f.write(payload)
+
+
+def test_corrupt_group_file_is_moved_aside_not_overwritten(run, quarantine):
+    async def test(chat):
+        m = chat.module
+        write(m, "1.json", b'{"5": {"date": "2024-01-01", ')
+        await chat.say(6, "抽老婆")
+        files = quarantined(quarantine)
+        (moved,) = [n for n in files if not n.endswith(".reason.txt")]
+        assert moved.startswith("1.json.")
+        assert files[moved] == b'{"5": {"date": "2024-01-01", '
+        assert "JSON" in files[moved + ".reason.txt"].decode("utf-8")
+        assert set(k for k in chat.cfg() if not k.startswith("__")) == {"6"}
+
+    run(test)
+
+
+def test_scan_reports_and_quarantines_bad_files(run, quarantine):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        await chat.say(5, "抽老婆", gid=2)
+        assert "5" in chat.cfg("2")  # 群 2 的配置已在缓存中
+        write(m, "2.json", b"[1, 2]")
+        write(m, "3.json", b"{oops")
+        summary = await m.run_integrity_scan(2)
+        assert summary["files"] == len([n for n in os.listdir(m.CONFIG_DIR) if n.endswith(".json")]) + 2
+        assert sorted(r["file"] for r in summary["bad"]) == ["2.json", "3.json"]
+        assert sorted(summary["quarantined"]) == ["2.json", "3.json"]
+        assert "顶层应为对象" in {r["file"]: r["error"] for r in summary["bad"]}["2.json"]
+        assert not os.path.exists(os.path.join(m.CONFIG_DIR, "2.json"))
+        assert chat.cfg("2") == {}  # 缓存随隔离失效，不会再读到旧内容
+        assert "5" in chat.cfg("1")
+        with open(m.INTEGRITY_REPORT_FILE, encoding="utf-8") as f:
+            reports = [json.loads(line) for line in f]
+        assert len(reports) == summary["files"]
+        assert all({"file", "size", "parse_ms", "ok", "error"} <= r.keys() for r in reports)
+
+    run(test)
+
+
+def test_scan_rechecks_under_lock_and_falls_back_to_thread(run, quarantine, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        real_scan = m.scan_data_files
+
+        def stale_scan(paths):
+            # 扫描时看到的是保存途中的旧内容：报告为损坏，但复核时文件已经完好
+            return [dict(r, ok=False, error="stale") for r in real_scan(paths)]
+
+        def no_pool(*args, **kwargs):
+            raise OSError("no process pool")
+
+        monkeypatch.setattr(m, "scan_data_files", stale_scan)
+        monkeypatch.setattr(m, "ProcessPoolExecutor", no_pool)
+        summary = await m.run_integrity_scan(4)
+        assert (summary["mode"], summary["workers"]) == ("thread", 1)
+        assert summary["bad"] == [] and summary["quarantined"] == []
+        assert quarantined(quarantine) == {}
+        assert "5" in chat.cfg()
+
+    run(test)
+
+
+def test_integrity_command(run, quarantine):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        assert "仅管理员" in await chat.say(5, "老婆体检")
+        assert "未发现损坏文件" in await chat.say(1, "老婆体检")
+        write(m, "9.json", b"\xff\xfe garbage")
+        report = await chat.say(1, "老婆体检")
+        assert report.startswith("【数据体检】")
+        assert "损坏文件 1 个" in report and "9.json（已隔离）" in report
+
+    run(test)
@@ -0,0 +1,76 @@
+"""老婆排行：各榜单的计数与排序、统计缺失时只重建一次、重建保留牛老婆次数、增量维护。"""
+
+from __future__ import annotations
+
+A, B, C = "作品1!角色1.jpg", "作品2!角色2.jpg", "作品3!角色3.jpg"
+
+
+async def seed_backpacks(m, gid, backpacks):
+    async with m.GroupTransaction(gid, m.get_today()) as txn:
+        txn.cfg[m.BACKPACKS_KEY] = {uid: {str(i): img for i, img in enumerate(imgs, 1)} for uid, imgs in backpacks.items()}
+        txn.mark_dirty()
+
+
+def rebuilds(m):
+    return m.metrics.counter("wife_stats_rebuilds")
+
+
+def test_leaderboard_counts_and_order(run):
+    async def test(chat):
+        m = chat.module
+        await seed_backpacks(m, "1", {"5": [A, B], "6": [A], "7": [A, B, C]})
+        before = rebuilds(m)
+        reply = await chat.say(5, "老婆排行 老婆")
+        assert reply.splitlines() == [
+            "【最受欢迎的老婆】",
+            f"1. {m.format_wife_name(A)} - 3份",
+            f"2. {m.format_wife_name(B)} - 2份",
+            f"3. {m.format_wife_name(C)} - 1份",
+        ]
+        assert rebuilds(m) == before + 1  # 旧数据没有统计：首次查询重建
+        assert (await chat.say(5, "老婆排行 背包")).splitlines()[1:] == ["1. 7 - 3位", "2. 5 - 2位", "3. 6 - 1位"]
+        assert "【牛老婆成功】\n暂无数据" in await chat.say(5, "老婆排行")
+        assert rebuilds(m) == before + 1
+
+    run(test)
+
+
+def test_draws_update_stats_incrementally(run):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "老婆排行")
+        before = rebuilds(m)
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "抽老婆")
+        await chat.say(6, "换老婆")
+        stats = chat.cfg()[m.WIFE_STATS_KEY]
+        assert stats["filled"] == {"5": 1, "6": 1}
+        assert sum(stats["owned"].values()) == 2
+        assert rebuilds(m) == before
+
+    run(test)
+
+
+def test_ntr_board_survives_rebuild(run):
+    async def test(chat):
+        m = chat.module
+        for _ in range(2):
+            await chat.say(6, "抽老婆")
+            assert "牛" in await chat.say(5, "牛老婆", [6])
+        expected = ["【牛老婆成功】", "1. 5 - 2次"]
+        assert (await chat.say(7, "老婆排行 牛")).splitlines() == expected
+        assert "已重建本群统计" in await chat.say(1, "老婆排行 重建")
+        assert (await chat.say(7, "老婆排行 牛")).splitlines() == expected
+
+    run(test)
+
+
+def test_rebuild_is_admin_only_and_bad_kind_shows_usage(run):
+    async def test(chat):
+        m = chat.module
+        before = rebuilds(m)
+        assert "仅管理员" in await chat.say(5, "老婆排行 重建")
+        assert "用法：/老婆排行 [老婆|背包|牛]" in await chat.say(5, "老婆排行 谁")
+        assert rebuilds(m) == before
+
+    run(test)
@@ -0,0 +1,83 @@
+"""锁竞争分析：等待/持有时间与阻塞者归因到命令；未启用时全部是原生 asyncio.Lock。"""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def profiler(wife, monkeypatch):
+    """本用例内使用新的 LockProfiler；结束时恢复全局锁与未启用状态。"""
+    prof = wife.LockProfiler()
+    monkeypatch.setattr(wife, "lock_profiler", prof)
+    monkeypatch.setattr(wife, "records_lock", wife.records_lock)
+    monkeypatch.setattr(wife, "ntr_lock", wife.ntr_lock)
+    return prof
+
+
+def test_disabled_path_uses_plain_locks(run, profiler):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "牛老婆", [5])
+        assert type(m.get_config_lock("1")) is asyncio.Lock
+        assert type(m.records_lock) is asyncio.Lock and type(m.swap_store.lock("1")) is asyncio.Lock
+        assert profiler.by_lock == {} and profiler.by_command == {}
+        assert "未启用" in await chat.say(1, "老婆统计 锁")
+
+    run(test)
+
+
+def test_wait_and_blocker_are_attributed_to_commands(wife, profiler):
+    profiler.enabled = True
+    lock = wife.ProfiledLock("group", "1")
+    order = []
+
+    async def holder():
+        wife.current_command.set("牛老婆")
+        async with lock:
+            order.append("holder")
+            await asyncio.sleep(0.05)
+
+    async def waiter():
+        wife.current_command.set("查老婆")
+        await asyncio.sleep(0.01)
+        async with lock:
+            order.append("waiter")
+
+    async def main():
+        await asyncio.gather(holder(), waiter())
+
+    asyncio.run(main())
+    assert order == ["holder", "waiter"]
+    st = profiler.by_lock[("group", "1")]
+    assert (st.acquires, st.contended, st.max_queue) == (2, 1, 1)
+    waited = profiler.by_command[("group", "查老婆")]
+    assert waited.wait_ms >= 30 and waited.max_wait_ms == waited.wait_ms
+    assert profiler.by_command[("group", "牛老婆")].hold_ms >= 40
+    assert profiler.by_command[("group", "牛老婆")].wait_ms < 10
+    assert list(profiler.blocking) == [("group", "牛老婆")]
+    assert profiler.blocking[("group", "牛老婆")] == pytest.approx(waited.wait_ms)
+    report = profiler.as_dict()
+    assert report["blocking"][0]["cmd"] == "牛老婆"
+    assert report["locks"][0]["key"] == "1"
+
+
+def test_enabled_plugin_reports_and_resets(run, profiler):
+    async def test(chat):
+        m = chat.module
+        assert isinstance(m.records_lock, m.ProfiledLock)
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "牛老婆", [5])
+        assert isinstance(m.get_config_lock("1"), m.ProfiledLock)
+        assert profiler.by_command[("group", "抽老婆")].acquires >= 1
+        assert profiler.by_command[("records", "牛老婆")].acquires >= 1
+        report = await chat.say(1, "老婆统计 锁")
+        assert report.startswith("【锁竞争】")
+        assert "群配置锁[1]" in report and "牛老婆@记录锁" in report
+        assert "已重置" in await chat.say(1, "老婆统计 锁 重置")
+        assert profiler.by_lock == {}
+
+    run(test, {"lock_profiling": True})
@@ -0,0 +1,103 @@
+"""运行指标：直方图分位数、Prometheus 文本输出、分发器埋点与老婆统计命令。"""
+
+from __future__ import annotations
+
+import os
+
+
+def test_histogram_buckets_and_quantiles(wife):
+    h = wife.Histogram()
+    assert (h.quantile(0.5), h.mean) == (0.0, 0.0)
+    for ms in (0.05, 3, 3, 3, 7000):
+        h.observe(ms)
+    buckets = wife.LATENCY_BUCKETS_MS
+    assert h.counts[0] == 1  # <= 0.1
+    assert h.counts[buckets.index(5)] == 3  # (2.5, 5]
+    assert h.counts[-1] == 1  # 超出最大桶
+    assert h.total == 5 and h.mean == (0.05 + 9 + 7000) / 5
+    # 第 2.5 个样本落在 (2.5, 5] 桶内，按桶内线性插值
+    assert h.quantile(0.5) == 2.5 + 2.5 * (2.5 - 1) / 3
+    assert h.quantile(1.0) == buckets[-1]
+    assert h.quantile(0.1) <= 0.1
+
+
+def test_counters_ignore_label_order(wife):
+    m = wife.Metrics()
+    m.inc("cache", result="hit", kind="a")
+    m.inc("cache", 2, kind="a", result="hit")
+    assert m.counter("cache", result="hit", kind="a") == 3
+    assert m.counter("cache", kind="b") == 0
+    m.inc("img", result="hit")
+    m.inc("img", 3, result="miss")
+    assert m.hit_rate("img") == (0.25, 4)
+    assert m.hit_rate("none") == (0.0, 0)
+    m.reset()
+    assert m.counters == {} and m.histograms == {}
+
+
+def test_render_prometheus(wife):
+    m = wife.Metrics()
+    m.inc("commands", cmd="抽老婆")
+    m.inc("commands", cmd='a"b\\c')
+    m.observe_ms("latency_ms", 0.3, op="save")
+    m.observe_ms("latency_ms", 2000, op="save")
+    lines = m.render_prometheus().splitlines()
+    assert lines.count("# TYPE animewife_commands_total counter") == 1
+    assert 'animewife_commands_total{cmd="抽老婆"} 1' in lines
+    assert 'animewife_commands_total{cmd="a\\"b\\\\c"} 1' in lines
+    assert "# TYPE animewife_latency_ms histogram" in lines
+    buckets = [line for line in lines if line.startswith("animewife_latency_ms_bucket")]
+    assert len(buckets) == len(wife.LATENCY_BUCKETS_MS) + 1
+    assert 'animewife_latency_ms_bucket{op="save",le="0.25"} 0' in lines
+    assert 'animewife_latency_ms_bucket{op="save",le="0.5"} 1' in lines  # 累计
+    assert 'animewife_latency_ms_bucket{op="save",le="2500"} 2' in lines
+    assert 'animewife_latency_ms_bucket{op="save",le="+Inf"} 2' in lines
+    assert 'animewife_latency_ms_sum{op="save"} 2000.3' in lines
+    assert 'animewife_latency_ms_count{op="save"} 2' in lines
+
+
+def test_dispatch_records_commands_and_storage(run):
+    async def test(chat):
+        m = chat.module
+        m.metrics.reset()
+        await chat.say(5, "抽老婆")
+        await chat.say(6, "抽老婆")
+        await chat.say(5, "大家好")  # 不是命令，不计数
+        assert m.metrics.counter("commands", cmd="抽老婆") == 2
+        assert m.metrics.histogram("command_latency_ms", cmd="抽老婆").total == 2
+        assert sum(v for (n, _), v in m.metrics.counters.items() if n == "commands") == 2
+        assert m.metrics.histogram("storage_latency_ms", op="save_group_config").total >= 1
+        assert m.metrics.counter("file_writes") >= 1 and m.metrics.counter("bytes_written") > 0
+        hits, total = m.metrics.hit_rate("catalog_cache")
+        assert total == 2 and hits == 0.5  # 第二次抽取命中图库列表缓存
+
+    run(test)
+
+
+def test_stats_command_is_admin_only(run):
+    async def test(chat):
+        m = chat.module
+        m.metrics.reset()
+        await chat.say(5, "抽老婆")
+        assert "仅管理员" in await chat.say(5, "老婆统计")
+        report = await chat.say(1, "老婆统计")
+        assert report.startswith("【老婆统计】")
+        assert "• 抽老婆：1 /" in report
+        assert "累计写盘" in report and "缓存命中率" in report
+
+    run(test)
+
+
+def test_metrics_file_includes_throttle_counts(run):
+    async def test(chat):
+        m = chat.module
+        for _ in range(3):
+            await chat.say(5, "老婆帮助")
+        text = chat.plugin._render_metrics()
+        assert 'animewife_throttle_shed_total{cmd="老婆帮助"} 2' in text
+        chat.plugin._write_metrics_file(text)
+        with open(m.METRICS_FILE, encoding="utf-8") as f:
+            assert f.read() == text
+        assert not os.path.exists(m.METRICS_FILE + ".tmp")
+
+    run(test, {"throttle_rules": "老婆帮助=1/3600"})
@@ -0,0 +1,62 @@
+"""群统计与“谁有老婆”：增量维护的反向索引与全量重建一致，聊天消息不触发命令。"""
+
+from __future__ import annotations
+
+import copy
+import random
+
+import pytest
+
+from conftest import storage_config
+
+
+def normalized(stats):
+    owners = {img: {uid: sorted(slots) for uid, slots in d.items()} for img, d in stats["owners"].items()}
+    return dict(stats, owners=owners)
+
+
+def test_incremental_stats_match_rebuild(run, backend):
+    async def test(chat):
+        m = chat.module
+        r = random.Random(45)
+        texts = ["抽老婆", "换老婆", "牛老婆", "牛老婆 1", "交换老婆 1 1", "同意交换", "替换老婆 2", "发老婆 角色3 1"]
+        for _ in range(600):
+            text = r.choice(texts)
+            uid = 1 if text.startswith("发老婆") else 20 + r.randrange(8)
+            await chat.say(uid, text, [20 + r.randrange(8)], gid=1 + r.randrange(2))
+        for gid in ("1", "2"):
+            await chat.say(20, "老婆排行", gid=int(gid))  # 确保统计已建立
+            cfg = chat.cfg(gid)
+            stats = copy.deepcopy(cfg[m.WIFE_STATS_KEY])
+            rebuilt = m.rebuild_wife_stats(cfg, chat.plugin.backpack_size, m.get_today())
+            assert normalized(stats) == normalized(rebuilt)
+            assert sum(stats["owned"].values()) > 0
+
+    run(test, {**storage_config(backend), "ntr_possibility": 0.6, "change_max_per_day": 50, "ntr_max": 50})
+
+
+def test_show_owners_lists_holders(run):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        img = m.get_slot_entry(chat.cfg(), "5", m.get_today(), 5, 1)[0]
+        name = img.split("!")[1].rsplit(".", 1)[0]
+        await chat.say(1, f"发老婆 {name} 1", [6])
+        reply = await chat.say(7, f"谁有老婆 {name}")
+        assert "用户5（1号位）" in reply
+        assert "用户6" in reply
+        assert "没有人" in await chat.say(7, "谁有老婆 不存在的老婆xyz")
+
+    run(test)
+
+
+@pytest.mark.parametrize("text", ["谁有空", "谁有链接", "谁有老婆", "谁有老婆吗", "谁有老婆吧 真的", "/谁有老婆"])
+def test_chat_messages_stay_silent(run, text):
+    async def test(chat):
+        async def no_stats(*args, **kwargs):
+            raise AssertionError("chat message must not load group stats")
+
+        chat.plugin._wife_stats_cfg = no_stats
+        assert await chat.say(5, text) == ""
+
+    run(test)
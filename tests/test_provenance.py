@@ -0,0 +1,150 @@
+"""老婆来历：有容量上限的每群日志、增量索引与转手链查询。"""
+
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+from conftest import storage_config
+
+
+def entry(i, img, src, dst, via="ntr"):
+    return {"t": 1700000000 + i, "img": img, "from": src, "to": dst, "via": via}
+
+
+def test_provenance_chain(wife):
+    log = [
+        entry(0, "a", None, "1", "send"),
+        entry(1, "a", "1", "2"),
+        entry(2, "a", "9", "8"),  # 无关的转手
+        entry(3, "a", "2", "3", "swap"),
+    ]
+    assert [e["t"] for e in wife.provenance_chain(log, "3")] == [1700000003, 1700000001, 1700000000]
+    assert [e["t"] for e in wife.provenance_chain(log, "3", limit=2)] == [1700000003, 1700000001]
+    assert wife.provenance_chain(log, "7") == []
+    # 同一个人多次得到：只追溯最近的一次
+    again = log + [entry(4, "a", "3", "1"), entry(5, "a", "1", "3")]
+    assert [e["t"] for e in wife.provenance_chain(again, "3")][:3] == [1700000005, 1700000004, 1700000003]
+
+
+def full_scan(m, gid):
+    if m.redis_store is not None:
+        lines = m.redis_store.client.lrange(m.redis_store.key("prov", gid), 0, -1)
+    else:
+        with open(m.ProvenanceLog.path(gid), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def test_index_reads_only_appended_records(run, backend):
+    async def test(chat):
+        m = chat.module
+        log = m.provenance
+        assert log.entries("1", "a") == []
+        log.append("1", [entry(0, "a", None, "1"), entry(1, "b", None, "2")])
+        assert log.entries("1", "a") == [entry(0, "a", None, "1")]
+        index = log._indexes["1"]
+        end = index.end
+        log.append("1", [entry(2, "a", "1", "2")])
+        assert log.entries("1", "a") == [entry(0, "a", None, "1"), entry(2, "a", "1", "2")]
+        assert log._indexes["1"] is index and index.end > end
+        assert log.entries("1", "b") == [entry(1, "b", None, "2")]
+        assert log.entries("2", "a") == []
+
+    run(test, storage_config(backend))
+
+
+def test_file_index_picks_up_other_writers(run):
+    async def test(chat):
+        m = chat.module
+        log = m.provenance
+        log.append("1", [entry(0, "a", None, "1")])
+        assert len(log.entries("1", "a")) == 1
+        # 另一个进程追加：先写了半行
+        line = json.dumps(entry(1, "a", "1", "2"), ensure_ascii=False)
+        with open(m.ProvenanceLog.path("1"), "a", encoding="utf-8") as f:
+            f.write(line[:10])
+        assert len(log.entries("1", "a")) == 1
+        with open(m.ProvenanceLog.path("1"), "a", encoding="utf-8") as f:
+            f.write(line[10:] + "\n")
+        assert log.entries("1", "a")[-1] == entry(1, "a", "1", "2")
+
+    run(test)
+
+
+def test_file_log_compacts_to_newest_three_quarters(run, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        monkeypatch.setattr(m, "PROVENANCE_MAX_BYTES", 2000)
+        log = m.provenance
+        for i in range(200):
+            log.append("1", [entry(i, f"img{i % 3}", str(i), str(i + 1))])
+            if i % 17 == 0:
+                log.entries("1", "img0")  # 压缩前后都建立过索引
+            size = os.path.getsize(m.ProvenanceLog.path("1"))
+            assert size <= 2000
+        kept = full_scan(m, "1")
+        assert m.metrics.counter("provenance_compactions") > 0
+        assert [e["t"] for e in kept] == list(range(kept[0]["t"], 1700000200))
+        line_max = max(len(json.dumps(e, ensure_ascii=False)) + 1 for e in kept)
+        assert os.path.getsize(m.ProvenanceLog.path("1")) >= 2000 * 3 // 4 - line_max
+        for img in ("img0", "img1", "img2"):
+            assert log.entries("1", img) == [e for e in kept if e["img"] == img]
+
+    run(test)
+
+
+def test_redis_log_keeps_newest_entries(run, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        monkeypatch.setattr(m, "PROVENANCE_MAX_ENTRIES", 10)
+        log = m.provenance
+        log.append("1", [entry(i, f"img{i % 2}", str(i), str(i + 1)) for i in range(8)])
+        assert len(log.entries("1", "img0")) == 4
+        for i in range(8, 25):
+            log.append("1", [entry(i, f"img{i % 2}", str(i), str(i + 1))])
+        kept = full_scan(m, "1")
+        assert [e["t"] - 1700000000 for e in kept] == list(range(15, 25))
+        for img in ("img0", "img1"):
+            assert log.entries("1", img) == [e for e in kept if e["img"] == img]
+
+    run(test, storage_config("redis"))
+
+
+def test_rolled_back_transfers_are_not_logged(run, backend):
+    async def test(chat):
+        m = chat.module
+        with pytest.raises(RuntimeError):
+            async with m.GroupTransaction("1", m.get_today()) as txn:
+                txn.log_transfer("a.jpg", None, "5", "send", by="1")
+                raise RuntimeError
+        async with m.GroupTransaction("1", m.get_today()) as txn:
+            txn.log_transfer("img/b.jpg", "5", "6", "ntr")
+        assert m.provenance.entries("1", "a.jpg") == []
+        assert [e["to"] for e in m.provenance.entries("1", m.normalize_img_id("img/b.jpg"))] == ["6"]
+
+    run(test, storage_config(backend))
+
+
+def test_show_provenance_chain(run, backend):
+    async def test(chat):
+        await chat.say(1, "发老婆 角色15 1", [5])
+        await chat.say(6, "牛老婆", [5])
+        await chat.say(7, "抽老婆")
+        await chat.say(7, "交换老婆 1 1", [6])
+        await chat.say(6, "同意交换", [7])
+        reply = await chat.say(7, "老婆来历 1")
+        assert "角色15" in reply
+        lines = [line for line in reply.splitlines() if line[:2] in ("1.", "2.", "3.")]
+        assert len(lines) == 3
+        assert "发给" in lines[0] and "牛走" in lines[1] and "交换得到" in lines[2]
+        # 6 换到的是 7 抽到的老婆：只有交换这一条记录
+        assert len([line for line in (await chat.say(6, "老婆来历 1")).splitlines() if line[:2] == "1."]) == 1
+        await chat.say(8, "抽老婆")
+        assert "没有转手记录" in await chat.say(8, "老婆来历 1")
+        assert "空的" in await chat.say(7, "老婆来历 2")
+        assert "用法" in await chat.say(7, "老婆来历")
+
+    run(test, storage_config(backend))
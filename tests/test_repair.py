@@ -0,0 +1,142 @@
+"""今日老婆记录的一致性修复：repair_today_entity 的各种不一致形态，以及事务内 / 后台两条修复路径。"""
+
+from __future__ import annotations
+
+import json
+import os
+
+SIZE = 5
+
+
+def make_cfg(m, today, *, record=None, slots=None, mark=None, uid="5"):
+    """构造一个群配置：uid 的今日记录 / 背包槽位 {槽位: img} / 今日绑定槽位。"""
+    cfg: dict = {}
+    if record is not None:
+        cfg[uid] = dict(record, date=today)
+    if slots:
+        cfg[m.BACKPACKS_KEY] = {uid: {str(k): v for k, v in slots.items()}}
+    if mark is not None:
+        cfg[m.BACKPACK_TODAY_SLOT_KEY] = {uid: {"date": today, "slot": mark}}
+    return cfg
+
+
+def marks(m, cfg):
+    return m.get_today_slot_marks(cfg)
+
+
+def test_dangling_binding_is_cleared(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, mark=2)
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == ["清理悬挂的今日槽位绑定"]
+        assert "5" not in marks(m, cfg)
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == []
+
+    run(test)
+
+
+def test_binding_to_empty_slot_without_img_drops_record(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, record={"slot": 2, "nick": "n"}, mark=2)
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == ["2号位引用失效，清理今日记录"]
+        assert "5" not in cfg and "5" not in marks(m, cfg)
+
+    run(test)
+
+
+def test_binding_to_empty_slot_with_img_refills_slot(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, record={"img": "作品1!角色1.jpg", "nick": "n"}, mark=2)
+        fixes = m.repair_today_entity(cfg, "5", today, SIZE)
+        assert fixes == ["2号位为空，今日老婆落回该槽位", "今日记录改写为2号位引用"]
+        assert cfg["5"] == {"date": today, "slot": 2, "nick": "n"}
+        assert m.get_slot_entry(cfg, "5", today, SIZE, 2)[0] == "作品1!角色1.jpg"
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == []
+
+    run(test)
+
+
+def test_legacy_record_duplicated_in_backpack_becomes_reference(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, record={"img": "作品1!角色1.jpg", "nick": "n"}, slots={3: "作品1!角色1.jpg"})
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == ["今日记录改写为3号位引用"]
+        assert "img" not in cfg["5"] and marks(m, cfg)["5"]["slot"] == 3
+        assert m.resolve_today_entity(cfg, "5", today, SIZE)[:2] == ("作品1!角色1.jpg", 3)
+
+    run(test)
+
+
+def test_temp_record_with_binding_drops_binding(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, record={"img": "作品1!角色1.jpg", "nick": "n"}, mark=9)
+        assert m.repair_today_entity(cfg, "5", today, SIZE) == ["清理临时态的槽位绑定"]
+        assert cfg["5"]["img"] == "作品1!角色1.jpg" and "5" not in marks(m, cfg)
+
+    run(test)
+
+
+def test_group_repair_skips_history(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        cfg = make_cfg(m, today, mark=2)
+        cfg["6"] = {"date": "2000-01-01", "img": "作品2!角色2.jpg", "nick": "old"}
+        assert m.repair_group_config(cfg, today, SIZE) == [("5", "清理悬挂的今日槽位绑定")]
+        assert cfg["6"]["date"] == "2000-01-01"
+
+    run(test)
+
+
+def write_group(m, gid, cfg):
+    with open(os.path.join(m.CONFIG_DIR, f"{gid}.json"), "w", encoding="utf-8") as f:
+        json.dump(cfg, f, ensure_ascii=False)
+
+
+def read_group(m, gid):
+    with open(os.path.join(m.CONFIG_DIR, f"{gid}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_transaction_commits_repairs_once(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        write_group(m, "1", make_cfg(m, today, mark=2))
+        async with m.GroupTransaction("1", today) as txn:
+            assert "5" not in marks(m, txn.cfg)  # 群配置懒加载，加载时修复
+            assert txn.repairs == [("5", "清理悬挂的今日槽位绑定")]
+            txn.rollback()
+        assert m.repairer.needs_check("1", today)  # 回滚后下次加载重新检查
+        applied = m.metrics.counter("repairs_applied")
+        async with m.GroupTransaction("1", today) as txn:
+            txn.cfg
+            assert len(txn.repairs) == 1
+        assert "5" not in marks(m, read_group(m, "1"))
+        assert m.metrics.counter("repairs_applied") == applied + 1
+        assert not m.repairer.needs_check("1", today)
+
+    run(test, {"backpack_size": SIZE})
+
+
+def test_read_only_command_hands_repair_to_background(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        write_group(m, "1", make_cfg(m, today, mark=2))
+        await chat.say(5, "老婆背包")
+        # 读命令只在私有副本上检查，不写盘
+        assert "5" in marks(m, read_group(m, "1"))
+        assert len(m.repairer) == 1
+        assert await m.run_repairs(m.repairer.take(), today) == 1
+        assert "5" not in marks(m, read_group(m, "1"))
+
+    run(test, {"backpack_size": SIZE})
@@ -0,0 +1,83 @@
+"""聊天记录回放：日志解析与 id 映射、按日志日期计数、相同种子下回放结果可复现。"""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from bench import replay as rp
+from bench.harness import FakeBot
+from conftest import reset_storage
+
+
+def write_log(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write((row if isinstance(row, str) else json.dumps(row, ensure_ascii=False)) + "\n")
+
+
+def test_load_log_maps_ids_and_sorts_stably(tmp_path):
+    path = tmp_path / "log.jsonl"
+    write_log(path, [
+        {"ts": 200, "gid": "g1", "uid": "alice", "text": "牛老婆", "at": ["bob"]},
+        {"timestamp": "1970-01-01T08:01:40+08:00", "gid": "g2", "uid": "bob", "text": "抽老婆"},
+        "",
+        {"ts": 100, "gid": "12345", "uid": "alice", "text": "查老婆", "at_targets": ["777"]},
+        {"ts": 200, "gid": "g1", "uid": "carol", "text": "抽老婆"},
+    ])
+    msgs = rp.load_log(str(path))
+    assert [m[0] for m in msgs] == [100.0, 100.0, 200.0, 200.0]
+    assert [m[3] for m in msgs] == ["抽老婆", "查老婆", "牛老婆", "抽老婆"]  # 同一时间戳保持文件顺序
+    g1, g2 = msgs[2][1], msgs[0][1]
+    assert (g1, g2, msgs[1][1]) == ("900000000", "900000001", "12345")
+    alice, bob = msgs[2][2], msgs[2][4][0]
+    assert (alice, bob) == ("800000000", "800000001")
+    assert msgs[0][2] == bob and msgs[1][4] == ("777",)
+    assert len(rp.load_log(str(path), limit=2)) == 2
+
+
+def test_load_log_rejects_bad_lines(tmp_path):
+    path = tmp_path / "bad.jsonl"
+    write_log(path, [{"ts": 1, "gid": "1", "uid": "2", "text": "抽老婆"}, {"ts": 2, "uid": "2"}])
+    with pytest.raises(SystemExit, match="bad.jsonl:2"):
+        rp.load_log(str(path))
+
+
+def test_replay_clock_follows_log_time(wife, monkeypatch):
+    monkeypatch.setattr(wife, "get_today", wife.get_today)
+    clock = rp.ReplayClock(wife)
+    assert wife.get_today() == clock._orig()
+    clock.advance(1760803199)  # 2025-10-18 23:59:59（上海）
+    assert wife.get_today() == "2025-10-18"
+    clock.advance(1760803200)
+    assert wife.get_today() == "2025-10-19"
+
+
+def test_replay_is_reproducible(wife, run, monkeypatch):
+    base = 1760803100  # 零点前 100 秒开始，跨过零点
+    messages = []
+    for i in range(60):
+        uid = str(10 + i % 6)
+        text = ["抽老婆", "牛老婆", "换老婆", "查老婆"][i % 4]
+        at = (str(10 + (i + 1) % 6),) if text == "牛老婆" else ()
+        messages.append((base + i * 5, "1", uid, text, at))
+
+    async def once(chat):
+        m = chat.module
+        monkeypatch.setattr(m, "get_today", m.get_today)
+        clock = rp.ReplayClock(m)
+        latencies, timeline = await rp.replay(chat.plugin, FakeBot(), messages, clock, speed=None, window=60)
+        assert sum(len(v) for v in latencies.values()) == len(messages)
+        assert len(timeline.rows()) == 5
+        assert clock.today == "2025-10-19"
+        return {"checksums": rp.state_checksums(m, {"1"})}
+
+    first = run(once, {"ntr_possibility": 0.5})
+    reset_storage(wife)
+    second = run(once, {"ntr_possibility": 0.5})
+    assert rp.compare_checksums(second, first) == (True, f"状态校验和一致：{first['checksums']['total']}")
+    reset_storage(wife)
+    other = run(once, {"ntr_possibility": 0.5, "rng_seed": "8"})
+    same, report = rp.compare_checksums(other, first)
+    assert not same and "groups 不同的群（1）：1" in report
@@ -0,0 +1,45 @@
+"""发老婆：目标解析（@ / QQ 号列表）与批量发放。"""
+
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.mark.parametrize("args, qq, keyword", [
+    ("10001 10002 角色5", ["10001", "10002"], ["角色5"]),
+    ("@某人 10001 随机", ["10001"], ["随机"]),
+    ("2233娘", [], ["2233娘"]),
+    ("角色1 20240", [], ["角色1", "20240"]),
+    ("10001 角色1 10002", ["10001"], ["角色1", "10002"]),
+    ("１２３４５ 角色1", [], ["１２３４５", "角色1"]),
+    ("角色 3", [], ["角色", "3"]),
+])
+def test_split_send_args(wife, args, qq, keyword):
+    assert wife.split_send_args(args.split()) == (qq, keyword)
+
+
+def today_img(chat, uid):
+    m = chat.module
+    return m.resolve_today_entity(chat.cfg(), str(uid), m.get_today(), chat.plugin.backpack_size)[0]
+
+
+def test_send_to_leading_qq_numbers(run):
+    async def test(chat):
+        await chat.say(1, "发老婆 10001 10002 角色5 1")
+        assert today_img(chat, 10001) == today_img(chat, 10002)
+        assert today_img(chat, 10001) is not None
+
+    run(test)
+
+
+def test_trailing_number_stays_in_keyword(run):
+    async def test(chat):
+        reply = await chat.say(1, "发老婆 角色1 12345", [5])
+        # 12345 是候选序号而不是第二个目标
+        assert "候选序号超出范围" in reply
+        assert today_img(chat, 12345) is None
+        assert today_img(chat, 5) is None
+        await chat.say(1, "发老婆 角色15 1", [5])
+        assert chat.module.format_wife_name(today_img(chat, 5)).endswith("角色15")
+
+    run(test)
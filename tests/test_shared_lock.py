@@ -0,0 +1,105 @@
+"""跨进程锁（shared_data_lock）：锁文件互斥，以及其他进程改写数据文件后本进程持锁时重新加载、不覆盖对方的修改。"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+
+import pytest
+
+LOCKED = {"shared_data_lock": True}
+
+
+def other_process_write(path, data) -> None:
+    """模拟另一个进程：不经过本进程的 save_json（不会记录版本戳），原子替换文件。"""
+    tmp = f"{path}.other"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def reload_count(m, data):
+    return m.metrics.counter("shared_reloads", data=data)
+
+
+def test_lock_file_excludes_other_holders(run):
+    async def test(chat):
+        m = chat.module
+        assert m.shared_lock.enabled
+        async with m.shared_lock.hold("records"):
+            fd = os.open(os.path.join(m.LOCK_DIR, "records.lock"), os.O_RDWR)
+            try:
+                with pytest.raises(BlockingIOError):
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            finally:
+                os.close(fd)
+        fd = os.open(os.path.join(m.LOCK_DIR, "records.lock"), os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)  # 释放后其他进程可以拿到
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    run(test, LOCKED)
+
+
+def test_group_file_rewritten_by_other_process_is_reloaded(run):
+    async def test(chat):
+        m = chat.module
+        gid = str(chat.gid)
+        await chat.say(5, "抽老婆")
+        path = os.path.join(m.CONFIG_DIR, f"{gid}.json")
+        cfg = read_json(path)
+        assert "5" in cfg and m.group_cache.get(gid) is not None
+        other = dict(cfg["5"], nick="other")
+        cfg["6"] = other
+        other_process_write(path, cfg)
+        before = reload_count(m, "group")
+        # 本进程下一次写入群配置时持锁发现版本变化，基于对方写入的内容修改
+        await chat.say(7, "抽老婆")
+        assert reload_count(m, "group") == before + 1
+        saved = read_json(path)
+        assert saved["6"] == other
+        assert {"5", "6", "7"} <= set(saved)
+        assert chat.cfg()["6"] == other
+
+    run(test, LOCKED)
+
+
+def test_records_rewritten_by_other_process_are_not_lost(run):
+    async def test(chat):
+        m = chat.module
+        gid = str(chat.gid)
+        today = m.get_today()
+        await chat.say(5, "抽老婆")
+        await chat.say(5, "换老婆")
+        data = read_json(m.RECORDS_FILE)
+        assert data["change"][gid]["5"]["count"] == 1
+        # 另一个进程在同一个群里给用户 6 记了两次换老婆
+        data["change"][gid]["6"] = {"date": today, "count": 2}
+        other_process_write(m.RECORDS_FILE, data)
+        before = reload_count(m, "records")
+        await chat.say(5, "换老婆")
+        assert reload_count(m, "records") == before + 1
+        saved = read_json(m.RECORDS_FILE)
+        assert saved["change"][gid]["5"]["count"] == 2
+        assert saved["change"][gid]["6"] == {"date": today, "count": 2}
+
+    run(test, LOCKED)
+
+
+def test_without_shared_lock_versions_are_not_tracked(run):
+    async def test(chat):
+        m = chat.module
+        assert not m.shared_lock.enabled
+        await chat.say(5, "抽老婆")
+        assert not m.shared_lock.changed(m.RECORDS_FILE)
+        assert m.shared_lock.version(m.RECORDS_FILE) is None
+
+    run(test, {})
@@ -0,0 +1,127 @@
+"""两阶段命令复用第一阶段的群配置（版本未变才复用，被并发写入后重新加载），以及只读命令的无锁快照读取。"""
+
+from __future__ import annotations
+
+import asyncio
+
+from conftest import storage_config
+
+
+def reuse_count(m, result):
+    return m.metrics.counter("group_state_reuse", result=result)
+
+
+async def draw_entry(m, gid, uid, img):
+    async with m.GroupTransaction(gid, m.get_today()) as txn:
+        txn.cfg[uid] = {"date": m.get_today(), "img": img, "nick": uid}
+        txn.mark_dirty()
+
+
+def test_snapshot_is_reused_while_version_unchanged(run, backend):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        await draw_entry(m, "1", "5", "作品1!角色1.jpg")
+        async with m.GroupTransaction("1", today) as txn:
+            cfg = txn.cfg
+        snapshot = txn.snapshot()
+        hits = reuse_count(m, "hit")
+        async with m.GroupTransaction("1", today, reuse=snapshot) as txn:
+            assert txn.cfg is cfg
+            assert txn.reused
+        assert reuse_count(m, "hit") == hits + 1
+
+    run(test, storage_config(backend))
+
+
+def test_snapshot_is_dropped_after_concurrent_write(run, backend):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        await draw_entry(m, "1", "5", "作品1!角色1.jpg")
+        async with m.GroupTransaction("1", today) as txn:
+            assert "6" not in txn.cfg
+        snapshot = txn.snapshot()
+        await draw_entry(m, "1", "6", "作品2!角色2.jpg")
+        conflicts = reuse_count(m, "conflict")
+        async with m.GroupTransaction("1", today, reuse=snapshot) as txn:
+            assert not txn.reused
+            assert txn.cfg["6"]["img"] == "作品2!角色2.jpg"
+        assert reuse_count(m, "conflict") == conflicts + 1
+
+    run(test, storage_config(backend))
+
+
+def test_rolled_back_transaction_has_no_snapshot(run):
+    async def test(chat):
+        m = chat.module
+        async with m.GroupTransaction("1", m.get_today()) as txn:
+            txn.cfg
+            txn.rollback()
+        assert txn.snapshot() is None
+
+    run(test)
+
+
+def test_draw_re_resolves_when_group_written_between_phases(run, backend, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        fetch = chat.plugin._fetch_wife_image_for_event
+
+        async def racing_fetch(event, gid):
+            # 第一阶段与第二阶段之间，同一群里另一个用户完成了抽老婆
+            monkeypatch.setattr(chat.plugin, "_fetch_wife_image_for_event", fetch)
+            await chat.say(6, "抽老婆")
+            return await fetch(event, gid)
+
+        monkeypatch.setattr(chat.plugin, "_fetch_wife_image_for_event", racing_fetch)
+        conflicts = reuse_count(m, "conflict")
+        await chat.say(5, "抽老婆")
+        assert reuse_count(m, "conflict") == conflicts + 1
+        size = chat.plugin.backpack_size
+        cfg = chat.cfg()
+        imgs = [m.get_slot_entry(cfg, uid, m.get_today(), size, 1)[0] for uid in ("5", "6")]
+        assert all(imgs)
+
+    run(test, storage_config(backend))
+
+
+def test_snapshot_read_does_not_see_uncommitted_edits(run, backend):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        await draw_entry(m, "1", "5", "作品1!角色1.jpg")
+        async with m.GroupTransaction("1", today, swaps=True) as txn:
+            txn.cfg["6"] = {"date": today, "img": "作品2!角色2.jpg", "nick": "6"}
+            txn.mark_dirty()
+            txn.put_swap("5", {"target": "6", "date": today})
+            # 事务持有群锁期间，只读路径不等锁，也读不到未提交的修改
+            assert "6" not in m.read_group_snapshot("1", today)
+            assert m.swap_store.committed("1") == {}
+        assert m.read_group_snapshot("1", today)["6"]["img"] == "作品2!角色2.jpg"
+        assert set(m.swap_store.committed("1")) == {"5"}
+
+    run(test, storage_config(backend))
+
+
+def test_snapshot_copy_is_private(run, backend):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        await draw_entry(m, "1", "5", "作品1!角色1.jpg")
+        m.read_group_snapshot("1", today)["5"]["img"] = "改过的.jpg"
+        assert m.read_group_snapshot("1", today)["5"]["img"] == "作品1!角色1.jpg"
+
+    run(test, storage_config(backend))
+
+
+def test_read_commands_do_not_wait_for_group_lock(run):
+    async def test(chat):
+        m = chat.module
+        await chat.say(5, "抽老婆")
+        async with m.get_config_lock(str(chat.gid)):
+            reply = await asyncio.wait_for(chat.say(5, "老婆背包"), 1.0)
+            assert "老婆背包（1/5" in reply
+            await asyncio.wait_for(chat.say(5, "查看交换请求"), 1.0)
+
+    run(test)
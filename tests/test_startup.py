@@ -0,0 +1,87 @@
+"""延迟加载：导入与构造不读数据，首条命令触发加载；加载失败后重试；后台预加载最近活跃的群。"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from conftest import BASE_CONFIG, Chat, make_plugin
+
+
+def drive(wife, config, test):
+    async def main():
+        chat = Chat(wife, make_plugin(wife, {**BASE_CONFIG, **config}))
+        try:
+            return await test(chat)
+        finally:
+            await chat.plugin.terminate()
+
+    return asyncio.run(main())
+
+
+def test_first_command_loads_state(wife):
+    with open(wife.RECORDS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"change": {"1": {"5": {"date": wife.get_today(), "count": 3}}}}, f)
+
+    async def test(chat):
+        assert not wife.state_loaded
+        assert "已经换了3次" in await chat.say(5, "换老婆")
+        assert wife.state_loaded
+        assert wife.records["change"]["1"]["5"]["count"] == 3
+
+    drive(wife, {}, test)
+
+
+def test_failed_load_is_retried(wife, monkeypatch):
+    monkeypatch.setattr(wife, "STATE_LOAD_RETRY_DELAY", 0.01)
+    real = wife.load_records
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("disk not ready")
+        real()
+
+    monkeypatch.setattr(wife, "load_records", flaky)
+
+    async def test(chat):
+        with pytest.raises(OSError):
+            await chat.say(5, "抽老婆")
+        assert not wife.state_loaded
+        assert "用户5" in await chat.say(5, "抽老婆")
+        assert wife.state_loaded and len(calls) == 2
+        # 后台任务等到加载成功后照常运行，而不是随第一次失败退出
+        await asyncio.sleep(0.05)
+        assert chat.plugin._bg_tasks and not any(t.done() for t in chat.plugin._bg_tasks)
+
+    drive(wife, {}, test)
+
+
+def test_preload_fills_cache_with_recent_groups(wife):
+    today = wife.get_today()
+    for i, gid in enumerate(("7", "8", "9")):
+        path = os.path.join(wife.CONFIG_DIR, f"{gid}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"5": {"date": today, "img": "作品1!角色1.jpg", "nick": "n"}}, f)
+        os.utime(path, (1000 + i, 1000 + i))
+
+    async def test(chat):
+        await chat.say(5, "老婆帮助")
+        await wife._preload_task
+        assert set(wife.group_cache._data) >= {"8", "9"}
+        assert "7" not in wife.group_cache._data
+
+    drive(wife, {"preload_recent_groups": 2}, test)
+
+
+def test_preload_default_matches_schema(wife):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, "_conf_schema.json"), encoding="utf-8") as f:
+        default = json.load(f)["preload_recent_groups"]["default"]
+    plugin = make_plugin(wife, {})
+    assert plugin.preload_recent_groups == default == 100
+    assert make_plugin(wife, {"preload_recent_groups": 0}).preload_recent_groups == 0
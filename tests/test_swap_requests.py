@@ -0,0 +1,80 @@
+"""交换请求存储：反向索引、过期堆与后台到期清理。"""
+
+from __future__ import annotations
+
+
+def req(target, expires_at=None, date="2024-01-01"):
+    rec = {"target": str(target), "date": date}
+    if expires_at is not None:
+        rec["expires_at"] = expires_at
+    return rec
+
+
+def test_reverse_index_tracks_put_and_pop(wife, tmp_path):
+    store = wife.SwapRequestStore(str(tmp_path))
+    store.put("1", "a", req("t"))
+    store.put("1", "b", req("t"))
+    store.put("1", "c", req("a"))
+    assert sorted(u for u, _ in store.received_by("1", "t")) == ["a", "b"]
+    assert sorted(store.related("1", ["a"])) == ["a", "c"]
+    # 重新发起会替换旧请求，并从旧目标的索引中移除
+    store.put("1", "a", req("x"))
+    assert [u for u, _ in store.received_by("1", "t")] == ["b"]
+    assert [u for u, _ in store.received_by("1", "x")] == ["a"]
+    assert store.pop("1", "b")["target"] == "t"
+    assert store.received_by("1", "t") == []
+    store.pop("1", "a")
+    store.pop("1", "c")
+    assert store.group_ids() == []
+
+
+def test_heap_orders_expiry_and_wakes_on_earlier_request(wife, tmp_path):
+    store = wife.SwapRequestStore(str(tmp_path))
+    store.put("1", "a", req("t", 300.0))
+    assert store.wakeup.is_set()
+    store.wakeup.clear()
+    store.put("2", "b", req("t", 500.0))
+    assert not store.wakeup.is_set()  # 比堆顶晚，不必唤醒
+    store.put("1", "c", req("t", 100.0))
+    assert store.wakeup.is_set()
+    assert store.next_expiry() == 100.0
+    assert store.pop_due(99.0) == []
+    assert store.pop_due(300.0) == [("1", "c", 100.0), ("1", "a", 300.0)]
+    assert store.next_expiry() == 500.0
+    # 没有 expires_at 的请求不进堆
+    store.put("3", "d", req("t"))
+    assert store.pop_due(10 ** 9) == [("2", "b", 500.0)]
+    assert store.next_expiry() is None
+
+
+def test_replace_group_rebuilds_index(wife, tmp_path):
+    store = wife.SwapRequestStore(str(tmp_path))
+    store.put("1", "a", req("t"))
+    store.replace_group("1", {"b": req("u"), "bad": "x"})
+    assert store.get("1", "a") is None
+    assert [u for u, _ in store.received_by("1", "u")] == ["b"]
+    assert store.group("1") == {"b": req("u")}
+
+
+def test_expire_refunds_and_skips_reissued_requests(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+            for uid in ("a", "b"):
+                txn.consume("swap", uid, 5)
+                txn.put_swap(uid, {"target": "t", "date": today, "expires_at": 1000.0})
+            # b 重新发起：旧的堆条目失效，新请求不能被清理
+            txn.put_swap("b", {"target": "t", "date": today, "expires_at": 5000.0})
+        assert await m.expire_swap_requests(2000.0, today) == 1
+        async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+            assert txn.get_swap("a") is None
+            assert txn.get_swap("b")["expires_at"] == 5000.0
+            assert txn.count("swap", "a") == 0
+            assert txn.count("swap", "b") == 1
+        assert m.swap_store.committed("1").keys() == {"b"}
+        assert await m.expire_swap_requests(2000.0, today) == 0
+        assert await m.expire_swap_requests(6000.0, today) == 1
+        assert m.swap_store.committed("1") == {}
+
+    run(test)
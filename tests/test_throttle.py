@@ -0,0 +1,55 @@
+"""命令限流：规则解析、令牌桶补充与空闲桶清理。"""
+
+from __future__ import annotations
+
+import pytest
+
+
+def test_parse_throttle_rules(wife):
+    rules = wife.parse_throttle_rules("抽老婆=3/60，老婆背包=5/10; *=10\n坏规则, x=abc, y=0/5, =1/1")
+    assert rules == {"抽老婆": (3.0, 0.05), "老婆背包": (5.0, 0.5), "*": (10.0, 10.0 / 60)}
+    assert wife.parse_throttle_rules("") == {}
+
+
+def test_bucket_sheds_then_refills(wife):
+    t = wife.CommandThrottle({"抽老婆": (2.0, 0.5)})
+    assert [t.allow("g", "u", "抽老婆", now=0.0) for _ in range(3)] == [True, True, False]
+    # 其他用户、其他群各有自己的桶
+    assert t.allow("g", "v", "抽老婆", now=0.0)
+    assert t.allow("h", "u", "抽老婆", now=0.0)
+    assert not t.allow("g", "u", "抽老婆", now=1.0)  # 只补充了 0.5 个令牌
+    assert t.allow("g", "u", "抽老婆", now=2.0)
+    # 补充不超过桶容量
+    assert [t.allow("g", "u", "抽老婆", now=100.0) for _ in range(3)] == [True, True, False]
+    assert t.shed == {"抽老婆": 3}
+    assert t.passed == {"抽老婆": 7}
+
+
+def test_default_rule_and_unlisted_commands(wife):
+    t = wife.CommandThrottle({"*": (1.0, 0.01)})
+    assert t.allow("g", "u", "查老婆", now=0.0)
+    assert not t.allow("g", "u", "查老婆", now=1.0)
+    assert t.allow("g", "u", "老婆背包", now=1.0)  # 每个命令单独计数
+    assert wife.CommandThrottle({"抽老婆": (1.0, 1.0)}).allow("g", "u", "查老婆")
+    assert not wife.CommandThrottle({}).enabled
+
+
+def test_prune_drops_only_refilled_buckets(wife):
+    t = wife.CommandThrottle({"*": (1.0, 1.0), "抽老婆": (1.0, 0.001)})
+    t.PRUNE_THRESHOLD = 3
+    t.allow("g", "a", "查老婆", now=0.0)
+    t.allow("g", "b", "查老婆", now=0.0)
+    t.allow("g", "c", "抽老婆", now=0.0)
+    # 第 4 个桶触发清理：查老婆的桶 5 秒后已回满，抽老婆的桶仍在冷却
+    t.allow("g", "d", "查老婆", now=5.0)
+    assert set(t._buckets) == {("g", "c", "抽老婆"), ("g", "d", "查老婆")}
+    assert not t.allow("g", "c", "抽老婆", now=5.0)
+
+
+@pytest.mark.parametrize("rules, replies", [("", 3), ("老婆帮助=1/3600", 1)])
+def test_dispatch_drops_throttled_messages(run, rules, replies):
+    async def test(chat):
+        out = [await chat.say(5, "老婆帮助") for _ in range(3)]
+        assert sum(1 for text in out if text) == replies
+
+    run(test, {"throttle_rules": rules})
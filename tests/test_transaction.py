@@ -0,0 +1,58 @@
+"""GroupTransaction：提交 / 回滚时内存状态与落盘数据的一致性。"""
+
+from __future__ import annotations
+
+import copy
+
+import pytest
+
+
+def test_exception_in_block_discards_changes(run):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        with pytest.raises(ValueError):
+            async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+                txn.consume("change", "5", 3)
+                txn.put_swap("5", {"target": "6", "date": today})
+                txn.cfg["5"] = {"date": today, "img": "作品1!角色1.jpg", "nick": "n"}
+                txn.mark_dirty()
+                raise ValueError
+        async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+            assert txn.count("change", "5") == 0
+            assert txn.get_swap("5") is None
+            assert "5" not in txn.cfg
+
+    run(test)
+
+
+def test_failed_records_save_restores_memory(run, monkeypatch):
+    async def test(chat):
+        m = chat.module
+        today = m.get_today()
+        async with m.GroupTransaction("1", today, records=True) as txn:
+            txn.consume("change", "5", 3)
+        before = copy.deepcopy(m.records)
+
+        def broken_save_records():
+            raise OSError("disk full")
+
+        monkeypatch.setattr(m, "save_records", broken_save_records)
+        with pytest.raises(OSError):
+            async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+                txn.consume("change", "5", 3)
+                txn.consume("ntr", "6", 3)
+                txn.put_swap("5", {"target": "6", "date": today})
+                txn.cfg["5"] = {"date": today, "img": "作品1!角色1.jpg", "nick": "n"}
+                txn.mark_dirty()
+        assert m.records == before
+        assert m.swap_store.get("1", "5") is None
+        assert txn.snapshot() is None
+        # 锁已释放，后续事务照常进行；群配置在 save_records 之前已经写入
+        monkeypatch.undo()
+        async with m.GroupTransaction("1", today, records=True, swaps=True) as txn:
+            assert txn.count("change", "5") == 1
+            assert txn.count("ntr", "6") == 0
+            assert "5" in txn.cfg
+
+    run(test)